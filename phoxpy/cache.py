@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011 Alexander Shorin
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+"""Cache of responses for read-only phox requests."""
+
+import sys
+import threading
+import time
+from collections import OrderedDict
+from copy import deepcopy
+from . import xml
+from .messages import Message
+
+__all__ = ['DEFAULT_TTLS', 'COALESCED_REQUESTS', 'ResponseCache',
+           'SingleFlight', 'request_key']
+
+#: Read-only phox request types mapped to seconds their responses are
+#: considered fresh.
+DEFAULT_TTLS = {
+    'options-get': 300,
+    'directory-versions': 5,
+    'request-info': 30,
+    'request-samples': 30,
+}
+
+#: Read-only phox request types which identical concurrent requests could
+#: share single response.
+COALESCED_REQUESTS = frozenset([
+    'directory', 'directory-versions', 'options-get', 'registration-journal',
+    'request-info', 'request-samples', 'request-works', 'patient-history',
+])
+
+
+def request_key(message):
+    """Returns canonical source of phox request message without session id,
+    so equal requests of different sessions have the same key. Fields of
+    objects are sorted by their names.
+
+    :param message: Request message.
+    :type message: :class:`~phoxpy.messages.Message`,
+                   :class:`~phoxpy.xml.Element` or str
+
+    >>> request_key('<phox-request sessionid="1" type="request-info">'
+    ...             '<content><o><f n="b" v="2"/><f n="a" v="1"/></o>'
+    ...             '</content></phox-request>').splitlines()[-1]
+    '<phox-request type="request-info"><content><o><f n="a" v="1"/><f n="b" v="2"/></o></content></phox-request>'
+    """
+    if isinstance(message, Message):
+        root = message.to_xml()
+    elif isinstance(message, xml.ElementType):
+        root = deepcopy(message)
+    else:
+        root = xml.load(message)
+    root.attrib.pop('sessionid', None)
+    for elem in root.iter('o'):
+        elem[:] = sorted(elem, key=lambda child: child.get('n'))
+    return xml.dump(root)
+
+
+class _Call(object):
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """Runs single call per key at once. Callers with the same key which come
+    while it's in flight wait for it and share its result or error."""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._calls)
+
+    def do(self, key, func):
+        """Calls `func` unless call with the same `key` is in flight.
+
+        :return: 2-element tuple of `func` result and flag if it was shared
+                 with another caller.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error[0], call.error[1], call.error[2]
+            return call.result, True
+        try:
+            call.result = func()
+        except:
+            call.error = sys.exc_info()
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result, False
+
+
+class ResponseCache(object):
+    """Cache of raw responses for read-only phox requests.
+
+    Responses are kept as received data and decoded on each hit, so callers
+    never share mutable results. Entries expire after TTL of their request
+    type and least recently used ones are discarded when total size of data
+    exceeds `max_size`. Concurrent identical requests which missed the cache
+    are sent once.
+
+    :param ttls: Request types mapped to seconds their responses are fresh.
+                 Requests of other types are not cached. Defaults to
+                 :data:`DEFAULT_TTLS`.
+    :type ttls: dict
+
+    :param max_size: Maximum size of cached data in bytes.
+    :type max_size: int
+    """
+    def __init__(self, ttls=None, max_size=16 * 1024 * 1024):
+        if ttls is None:
+            ttls = DEFAULT_TTLS
+        self.ttls = dict(ttls)
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.clock = time.time
+        self._entries = OrderedDict()
+        self._flight = SingleFlight()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self.get(key, False) is not None
+
+    @property
+    def hit_rate(self):
+        """Fraction of requests answered from cache."""
+        total = self.hits + self.misses
+        return total and float(self.hits) / total or 0.0
+
+    def stats(self):
+        """Returns cache metrics as dict."""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'evictions': self.evictions,
+            'entries': len(self),
+            'size': self.size,
+            'hit_rate': self.hit_rate,
+        }
+
+    def is_cacheable(self, request_type):
+        """Checks if responses of the request type are cached."""
+        return request_type in self.ttls
+
+    def get(self, key, count=True):
+        """Returns fresh response data by request key or ``None``."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and entry[1] <= self.clock():
+                self.size -= len(entry[2])
+                entry = None
+            if entry is None:
+                if count:
+                    self.misses += 1
+                return None
+            self._entries[key] = entry
+            if count:
+                self.hits += 1
+            return entry[2]
+
+    def set(self, key, request_type, data):
+        """Stores response data of the request."""
+        if len(data) > self.max_size:
+            return
+        expires = self.clock() + self.ttls[request_type]
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.size -= len(entry[2])
+            self._entries[key] = (request_type, expires, data)
+            self.size += len(data)
+            while self.size > self.max_size:
+                entry = self._entries.popitem(last=False)[1]
+                self.size -= len(entry[2])
+                self.evictions += 1
+
+    def fetch(self, key, request_type, load, decode):
+        """Returns decoded response of the request from cache or loads it.
+
+        :param key: Request key. See :func:`request_key`.
+
+        :param request_type: Phox request type.
+        :type request_type: str
+
+        :param load: Callable without arguments which sends the request and
+                     returns response data.
+
+        :param decode: Callable which decodes response data. Data is stored
+                       only if it was decoded without errors.
+        """
+        data = self.get(key)
+        if data is not None:
+            return decode(data)
+        result = []
+        def load_and_store():
+            data = load()
+            result.append(decode(data))
+            self.set(key, request_type, data)
+            return data
+        data, shared = self._flight.do(key, load_and_store)
+        if not shared:
+            return result[0]
+        with self._lock:
+            self.coalesced += 1
+        return decode(data)
+
+    def invalidate(self, *types):
+        """Drops cached responses of specified request types or all of them
+        if no types passed."""
+        with self._lock:
+            for key, entry in self._entries.items():
+                if not types or entry[0] in types:
+                    del self._entries[key]
+                    self.size -= len(entry[2])
+
+    def clear(self):
+        """Drops all cached responses."""
+        self.invalidate()
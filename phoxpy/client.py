@@ -8,24 +8,43 @@
 #
 
 import hashlib
+import Queue
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from copy import deepcopy
+from types import GeneratorType
+from . import exceptions
+from .cache import COALESCED_REQUESTS, ResponseCache, SingleFlight, \
+                   request_key
 from . import http
 from . import xml
-from .messages import Message, PhoxResponse
+from .mapping import Mapping
+from .messages import Message, PhoxRequest, PhoxResponse
 from .modules.auth import login, logout, AuthRequest, AuthResponse
+from .parallel import default_decoder
 
-__all__ = ['PhoxResource', 'Session', 'open']
+__all__ = ['PhoxResource', 'Session', 'SessionPool', 'open']
 
 md5 = lambda s: hashlib.md5(s).hexdigest()
 
 class PhoxResource(http.Resource):
-    """Specific resource for LIS server with native xml support."""
+    """Specific resource for LIS server with native xml support.
+
+    :param intern: Deduplicate strings of decoded responses by specified
+                   :class:`~phoxpy.xml.InternTable` or by new one for each
+                   response if ``True``.
+    """
     def __init__(self, *args, **kwargs):
+        self.intern = kwargs.pop('intern', None)
         super(PhoxResource, self).__init__(*args, **kwargs)
         self.headers.setdefault('Accept', 'text/html, */*')
         self.headers.setdefault('Content-Type', 'text/html')
         self.headers.setdefault('User-Agent', 'PhoxPy')
 
-    def post_xml(self, path, body, headers=None, **params):
+    def post_xml(self, path, body, headers=None, idempotent=None,
+                 parallel=None, lazy=False, **params):
         """Send request to specified url.
 
         :param path: Resource relative path.
@@ -49,22 +68,44 @@ class PhoxResource(http.Resource):
         :param headers: HTTP headers dictionary.
         :type headers: dict
 
+        :param idempotent: Request is safe to retry.
+        :type idempotent: bool
+
+        :param parallel: Decode large sequences of response by specified
+                         parallel decoder.
+        :type parallel: :class:`~phoxpy.parallel.ParallelDecoder`
+
+        :param lazy: Decode response objects fields on demand.
+        :type lazy: bool
+
         :param params: Custom query parameters as keyword arguments.
 
         :return: 3-element ``tuple``:
 
                  - response status code (``int``)
                  - http headers (``dict``)
-                 - response data (:class:`~phoxpy.xml.Element`)
+                 - response data as XML events stream
 
         :rtype: tuple
         """
+        status, headers, data = self.post_data(path, body, headers,
+                                               idempotent, **params)
+        return status, headers, self.make_stream(data, parallel, lazy)
+
+    def post_data(self, path, body, headers=None, idempotent=None, **params):
+        """Send request to specified url like :meth:`post_xml` does, but
+        returns response data as is."""
         if isinstance(body, Message):
             body = str(body)
         elif isinstance(body, xml.ElementType):
             body = xml.dump(body)
-        status, headers, data = self.post(path, body, headers, **params)
-        return status, headers, xml.parse(data)
+        return self.post(path, body, headers, idempotent=idempotent, **params)
+
+    def make_stream(self, data, parallel=None, lazy=False):
+        """Wraps response data to XML events stream."""
+        if parallel is not None:
+            return parallel.make_stream(data, self.intern, lazy)
+        return xml.make_stream(data, self.intern, lazy)
 
 
 class Session(object):
@@ -87,10 +128,40 @@ class Session(object):
                    hack your account simply by passing password hash.
     :type secure: bool
 
+    :param intern: Deduplicate repeated strings of decoded responses, which
+                   saves memory for large directories and journals. ``True``
+                   deduplicates them within each response,
+                   :class:`~phoxpy.xml.InternTable` instance shares them
+                   between all responses of the session.
+    :type intern: bool or :class:`~phoxpy.xml.InternTable`
+
+    :param cache: Cache responses of read-only requests. ``True`` creates
+                  :class:`~phoxpy.cache.ResponseCache` with default options.
+    :type cache: bool or :class:`~phoxpy.cache.ResponseCache`
+
+    :param coalesce: Send identical concurrent read-only requests once and
+                     share response between them. ``True`` coalesces
+                     requests of this session, :class:`~phoxpy.cache.SingleFlight`
+                     instance shares them between sessions.
+    :type coalesce: bool or :class:`~phoxpy.cache.SingleFlight`
+
+    :param keepalive: Interval in seconds to ping server while session is
+                      idle, so it doesn't expire.
+    :type keepalive: float
+
+    :param relogin: Login again and repeat request if session turned out to
+                    be unknown or expired.
+    :type relogin: bool
+
     :param data: Custom keyword options.
                  See :class:`~phoxpy.messages.AuthRequest` for more information.
     """
-    def __init__(self, login, password, client_id, secure=False, **data):
+    #: Type of cheap read-only request to ping server by.
+    keepalive_request = 'directory-versions'
+
+    def __init__(self, login, password, client_id, secure=False, intern=None,
+                 cache=None, coalesce=None, keepalive=None, relogin=False,
+                 **data):
         if secure:
             password = md5(password)
 
@@ -100,6 +171,22 @@ class Session(object):
                                         **data)
         self._userctx = AuthResponse()
         self._resource = None
+        self.intern = intern
+        if cache is True:
+            cache = ResponseCache()
+        elif cache is False:
+            cache = None
+        self.cache = cache
+        if coalesce is True:
+            coalesce = SingleFlight()
+        elif coalesce is False:
+            coalesce = None
+        self.flight = coalesce
+        self.keepalive = keepalive
+        self.relogin = relogin
+        self._last_used = 0
+        self._auth_lock = threading.Lock()
+        self._keepalive_stop = None
 
     def open(self, url, http_session=None):
         """Provides authorization and registration session on server
@@ -114,15 +201,20 @@ class Session(object):
         """
         self.bind_resource(url, http_session)
         login(self)
+        if self.keepalive:
+            self.start_keepalive(self.keepalive)
 
     def close(self):
         """Closes current active session."""
+        self.stop_keepalive()
         logout(self)
 
     def bind_resource(self, url, http_session=None):
-        self._resource = PhoxResource(url, session=http_session)
+        self._resource = PhoxResource(url, session=http_session,
+                                      intern=self.intern)
 
-    def request(self, path='', body=None, headers=None, wrapper=None, **params):
+    def request(self, path='', body=None, headers=None, wrapper=None,
+                parallel=None, lazy=False, idempotent=None, **params):
         """Makes single request to server.
 
         :param path: Resource relative path.
@@ -140,18 +232,181 @@ class Session(object):
                         object.
         :type wrapper: callable
 
+        :param parallel: Decode large sequences of response items, like
+                         directory objects or registration journal rows, in
+                         the pool of processes. ``True`` uses decoder shared
+                         by all sessions.
+        :type parallel: bool or :class:`~phoxpy.parallel.ParallelDecoder`
+
+        :param lazy: Decode response objects as
+                     :class:`~phoxpy.xmlobjects.LazyObject` which convert
+                     their fields on first access. Useful when only few
+                     fields of large objects are needed.
+        :type lazy: bool
+
+        :param idempotent: Request is safe to retry. By default it's decided
+                           by request type, see
+                           :meth:`~phoxpy.http.RetryPolicy.is_idempotent`.
+        :type idempotent: bool
+
         :param params: Custom query parameters as keyword arguments.
 
         :return: Response message.
+
+        Requests which failed due to transient LIS errors are retried
+        according to :class:`~phoxpy.http.RetryPolicy` of HTTP session if
+        they are idempotent.
+
+        Responses of read-only requests are taken from session
+        :attr:`cache` while they are fresh. If session coalesces requests,
+        identical ones which are sent at the same time share single response:
+        waiters receive copy of decoded :class:`~phoxpy.mapping.Mapping` or
+        decode shared response data themselves.
+
+        If session is set to :attr:`relogin`, requests which failed because
+        session is unknown or expired are sent again after login.
         """
+        reqtype = self.request_type(body)
+        sessionid = self.id
+        try:
+            return self._send(path, body, headers, wrapper, parallel, lazy,
+                              params, idempotent)
+        except exceptions.LisBaseException, err:
+            if not err.invalidates_session or not self.relogin \
+                    or sessionid is None or reqtype in ('login', 'logout'):
+                raise
+            self.reauth(sessionid)
+            return self._send(path, body, headers, wrapper, parallel, lazy,
+                              params, idempotent)
+
+    def _send(self, path, body, headers, wrapper, parallel, lazy, params,
+              idempotent=None, cached=True):
+        self._last_used = time.time()
         self.sign(body)
         if wrapper is None:
             wrapper = PhoxResponse
         if hasattr(wrapper, 'to_python'):
             wrapper = wrapper.to_python
-        return wrapper(
-            self._resource.post_xml(path, body, headers, **params)[2]
-        )
+        policy = self._resource.session.retry_policy
+        reqtype = self.request_type(body)
+        if idempotent is None:
+            idempotent = policy.is_idempotent(reqtype)
+        if parallel is True:
+            parallel = default_decoder()
+        elif parallel is False:
+            parallel = None
+        resource = self._resource
+        cache = self.cache
+        if not cached or cache is not None and not cache.is_cacheable(reqtype):
+            cache = None
+        flight = self.flight
+        if not cached or reqtype not in COALESCED_REQUESTS:
+            flight = None
+        if cache is not None or flight is not None:
+            key = (path, tuple(sorted(params.items())), request_key(body))
+            options = (wrapper, parallel, lazy)
+            def load():
+                return resource.post_data(path, body, headers, idempotent,
+                                          **params)[2].read()
+            def decode(data):
+                return wrapper(resource.make_stream(data, parallel, lazy))
+            if flight is None:
+                send = lambda: cache.fetch(key, reqtype, load, decode)
+            else:
+                send = lambda: self._coalesce(flight, cache, key, reqtype,
+                                              options, load, decode)
+        else:
+            def send():
+                return wrapper(resource.post_xml(path, body, headers,
+                                                 idempotent, parallel,
+                                                 lazy, **params)[2])
+        # host circuit breaker is checked by http session for each request
+        return policy.call(send, idempotent=idempotent,
+                           errors=(exceptions.LisBaseException,))
+
+    def _coalesce(self, flight, cache, key, reqtype, options, load, decode):
+        if cache is not None:
+            data = cache.get(key)
+            if data is not None:
+                return decode(data)
+        def send():
+            data = load()
+            result = decode(data)
+            # snapshot is taken before leader returns the result, so waiters
+            # never copy changes made by the leader's caller; lazy objects
+            # keep elements of shared tree, generators could be consumed
+            # only once
+            snapshot = None
+            if not options[2] and isinstance(result, Mapping):
+                try:
+                    snapshot = deepcopy(result)
+                except TypeError:
+                    pass
+            if cache is not None:
+                cache.set(key, reqtype, data)
+            return data, result, snapshot, options
+        (data, result, snapshot, shared_options), shared = \
+            flight.do(key, send)
+        if not shared:
+            return result
+        if shared_options == options and snapshot is not None:
+            return deepcopy(snapshot)
+        return decode(data)
+
+    def reauth(self, sessionid):
+        """Logs in again if session id is still the same as the expired
+        one. Concurrent callers wait for single login and use its result.
+
+        :param sessionid: Expired session id.
+        """
+        with self._auth_lock:
+            if self.id == sessionid:
+                login(self)
+
+    def ping(self):
+        """Sends :attr:`keepalive_request` to the server bypassing cache,
+        so session is not expired while idle."""
+        reqtype = self.keepalive_request
+        sessionid = self.id
+        try:
+            self._send('', PhoxRequest(type=reqtype), None, None, None, False,
+                       {}, cached=False)
+        except exceptions.LisBaseException, err:
+            if not err.invalidates_session or not self.relogin:
+                raise
+            self.reauth(sessionid)
+
+    def start_keepalive(self, interval):
+        """Starts background thread which pings server when session was
+        idle for `interval` seconds. Thread stops when session is closed or
+        garbage collected."""
+        self.stop_keepalive()
+        stop = self._keepalive_stop = threading.Event()
+        thread = threading.Thread(target=_keepalive,
+                                  args=(weakref.ref(self), stop, interval))
+        thread.daemon = True
+        thread.start()
+
+    def stop_keepalive(self):
+        """Stops background keepalive thread."""
+        if self._keepalive_stop is not None:
+            self._keepalive_stop.set()
+            self._keepalive_stop = None
+
+    def invalidate(self, *types):
+        """Drops cached responses of specified request types or all of them
+        if no types passed."""
+        if self.cache is not None:
+            self.cache.invalidate(*types)
+
+    def request_type(self, message):
+        """Returns phox request type of the message or ``None`` if it's
+        unknown."""
+        if isinstance(message, Message):
+            return getattr(message, 'type', None)
+        elif isinstance(message, xml.ElementType):
+            return message.attrib.get('type')
+        return None
 
     def sign(self, message):
         """Signs :class:`~phox.messages.Message` instance by setting session id
@@ -202,6 +457,144 @@ class Session(object):
     userctx = property(_get_userctx, _set_userctx)
 
 
+def _keepalive(ref, stop, interval):
+    # holds session by weak reference, so forgotten sessions are collected
+    while not stop.wait(interval):
+        session = ref()
+        if session is None or not session.is_active():
+            return
+        if time.time() - session._last_used >= interval:
+            try:
+                session.ping()
+            except Exception:
+                # next ping will try again
+                pass
+        del session
+
+
+class SessionPool(object):
+    """Pool of authenticated sessions shared by worker threads.
+
+    Session signs requests with its id, so it's handed out to single thread
+    at once. Idle sessions are taken in least recently used order, which
+    spreads requests evenly between them. Sessions are logged in on first
+    use and logged in again after server reports them unknown or expired.
+
+    :param url: Server URL.
+    :type url: str
+
+    :param credentials: :class:`Session` keyword arguments: login, password,
+                        client id and so on. List of them assigns different
+                        logins and licenses to sessions round robin.
+    :type credentials: dict or list
+
+    :param size: Number of sessions. Defaults to number of credentials.
+    :type size: int
+
+    :param http_session: HTTP session shared by all sessions, so they reuse
+                         pooled connections.
+    :type http_session: :class:`~phoxpy.http.Session`
+
+    :param options: Common :class:`Session` keyword arguments, like
+                    ``cache`` or ``coalesce``.
+    """
+    def __init__(self, url, credentials, size=None, http_session=None,
+                 **options):
+        if isinstance(credentials, dict):
+            credentials = [credentials]
+        if size is None:
+            size = len(credentials)
+        if http_session is None:
+            http_session = http.Session()
+        self.url = url
+        self.http_session = http_session
+        self.sessions = []
+        self._idle = Queue.Queue()
+        for idx in xrange(size):
+            params = dict(options)
+            params.update(credentials[idx % len(credentials)])
+            session = Session(**params)
+            self.sessions.append(session)
+            self._idle.put(session)
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def acquire(self, timeout=None):
+        """Takes idle session logging it in if needed. Blocks until some
+        session is released.
+
+        :param timeout: Seconds to wait for idle session.
+        :type timeout: float
+
+        :raises: :exc:`Queue.Empty` if no session was released in time.
+        """
+        session = self._idle.get(True, timeout)
+        if not session.is_active():
+            try:
+                session.open(self.url, self.http_session)
+            except:
+                self._idle.put(session)
+                raise
+        return session
+
+    def release(self, session):
+        """Returns session to the pool."""
+        self._idle.put(session)
+
+    @contextmanager
+    def session(self, timeout=None):
+        """Context manager which holds session from the pool. If session
+        turned out to be unknown or expired, it will be logged in again on
+        next use."""
+        session = self.acquire(timeout)
+        try:
+            yield session
+        except exceptions.LisBaseException, err:
+            if err.invalidates_session:
+                session.id = None
+            raise
+        finally:
+            self.release(session)
+
+    def call(self, func, *args, **kwargs):
+        """Calls `func` with pooled session as first argument. Call is
+        repeated once with logged in again session if server reports that
+        session is unknown or expired.
+
+        Generators returned by `func` are consumed while session is held.
+        """
+        for attempt in (0, 1):
+            with self.session() as session:
+                try:
+                    result = func(session, *args, **kwargs)
+                    if isinstance(result, GeneratorType):
+                        result = list(result)
+                    return result
+                except exceptions.LisBaseException, err:
+                    if attempt or not err.invalidates_session:
+                        raise
+                    session.id = None
+
+    def request(self, *args, **kwargs):
+        """Makes single request with pooled session.
+        See :meth:`Session.request` for arguments."""
+        return self.call(lambda session: session.request(*args, **kwargs))
+
+    def close(self):
+        """Logs out active sessions. Sessions which are in use are closed
+        after they are released."""
+        for idx in xrange(len(self.sessions)):
+            session = self._idle.get()
+            try:
+                if session.is_active():
+                    session.close()
+            except exceptions.LisBaseException:
+                session.id = None
+            finally:
+                self._idle.put(session)
+
+
 def open(url, *args, **credentials):
     """Returns initialized and authorized :class:`Session` instance."""
     session = Session(*args, **credentials)
@@ -0,0 +1,403 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011 Alexander Shorin
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+"""Columnar tables built from phox XML sequences without decoding each row
+to Python object."""
+
+import calendar
+import csv
+import datetime
+import json
+import sys
+from array import array
+from . import exceptions
+from . import mapping
+from . import xml
+from .xmlcodec import parse_datetime
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__all__ = ['Column', 'Table', 'build', 'schema']
+
+#: Column kinds mapped to :mod:`array` type codes of their values.
+TYPECODES = {
+    'int': 'l',
+    'float': 'd',
+    'bool': 'b',
+    'datetime': 'l',
+    'text': 'l',
+}
+
+#: Phox value type markers mapped to column kinds.
+TYPEMARKERS = {
+    'I': 'int',
+    'L': 'int',
+    'F': 'float',
+    'B': 'bool',
+    'D': 'datetime',
+    'S': 'text',
+    None: 'text',
+}
+
+#: Mapping field types mapped to column kinds.
+FIELD_KINDS = [
+    (mapping.BooleanField, 'bool'),
+    (mapping.IntegerField, 'int'),
+    (mapping.LongField, 'int'),
+    (mapping.FloatField, 'float'),
+    (mapping.DateTimeField, 'datetime'),
+    (mapping.ListField, None),
+    (mapping.ObjectField, None),
+    (mapping.Field, 'text'),
+]
+
+MAGIC = 'PHOXCOL1'
+
+
+def schema(fields):
+    """Returns column name to kind mapping for `fields`.
+
+    :param fields: :class:`~phoxpy.mapping.Mapping` subclass or mapping of
+                   names to :class:`~phoxpy.mapping.Field` instances or kind
+                   names. Nested lists and objects are skipped.
+
+    >>> class Item(mapping.Mapping):
+    ...     code = mapping.TextField()
+    ...     count = mapping.IntegerField(name='cnt')
+    ...     tags = mapping.ListField(mapping.RefField())
+    >>> sorted(schema(Item).items())
+    [('cnt', 'int'), ('code', 'text')]
+    """
+    if isinstance(fields, type) and issubclass(fields, mapping.Mapping):
+        fields = dict((field.name, field) for field in fields._fields.values())
+    result = {}
+    for name, field in fields.items():
+        if isinstance(field, mapping.Field):
+            for cls, kind in FIELD_KINDS:
+                if isinstance(field, cls):
+                    break
+            name = field.name or name
+        else:
+            kind = field
+        if kind is None:
+            continue
+        if kind not in TYPECODES:
+            raise ValueError('unknown column kind %r' % kind)
+        result[name] = kind
+    return result
+
+
+class Column(object):
+    """Typed column of table values.
+
+    Numbers and booleans are stored in :class:`array.array`, datetimes as
+    seconds since epoch, texts are dictionary encoded: column stores codes of
+    values from :attr:`categories` list. Missing values are tracked by
+    :attr:`valid` flags.
+
+    :param name: Column name.
+    :type name: str
+
+    :param kind: Column kind: ``int``, ``float``, ``bool``, ``datetime`` or
+                 ``text``.
+    :type kind: str
+
+    :param size: Number of missing values to start with.
+    :type size: int
+    """
+    def __init__(self, name, kind, size=0):
+        self.name = name
+        self.kind = kind
+        self.data = array(TYPECODES[kind], [0]) * size
+        self.valid = array('b', [0]) * size
+        self.categories = []
+        self._codes = {}
+        self.convert = getattr(self, '_convert_' + kind)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, idx):
+        if not self.valid[idx]:
+            return None
+        value = self.data[idx]
+        if self.kind == 'text':
+            return self.categories[value]
+        elif self.kind == 'datetime':
+            return datetime.datetime.utcfromtimestamp(value)
+        elif self.kind == 'bool':
+            return bool(value)
+        return value
+
+    def __iter__(self):
+        for idx in xrange(len(self)):
+            yield self[idx]
+
+    def _convert_int(self, value):
+        return int(value)
+
+    def _convert_float(self, value):
+        return float(value)
+
+    def _convert_bool(self, value):
+        return value == 'true'
+
+    def _convert_datetime(self, value):
+        return calendar.timegm(parse_datetime(value).timetuple())
+
+    def _convert_text(self, value):
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self.categories)
+            self.categories.append(value)
+        return code
+
+    def append(self, value):
+        """Appends XML attribute value converted according column kind.
+        ``None`` is appended as missing value."""
+        if value is None:
+            self.data.append(0)
+            self.valid.append(0)
+        else:
+            self.data.append(self.convert(value))
+            self.valid.append(1)
+
+    def to_numpy(self):
+        """Returns column values as :mod:`numpy` array without copying
+        them. Datetimes are returned as ``datetime64[s]`` values, texts as
+        integer codes of :attr:`categories`. Use :attr:`valid` flags to
+        find missed values.
+        """
+        if numpy is None:
+            raise ImportError('numpy is required')
+        dtype = {
+            'int': numpy.int_,
+            'float': numpy.float64,
+            'bool': numpy.int8,
+            'datetime': 'datetime64[s]',
+            'text': numpy.int_,
+        }[self.kind]
+        values = numpy.frombuffer(self.data, dtype)
+        if self.kind == 'bool':
+            values = values.view(numpy.bool_)
+        return values
+
+
+class Table(object):
+    """Set of equal length columns.
+
+    :param columns: List of :class:`Column` instances.
+    :type columns: list
+    """
+    def __init__(self, columns=None):
+        self.columns = list(columns or [])
+        self._index = dict((col.name, col) for col in self.columns)
+
+    def __len__(self):
+        if not self.columns:
+            return 0
+        return len(self.columns[0])
+
+    def __getitem__(self, name):
+        return self._index[name]
+
+    def __contains__(self, name):
+        return name in self._index
+
+    @property
+    def names(self):
+        """Column names in order of their appearance."""
+        return [col.name for col in self.columns]
+
+    def add_column(self, name, kind):
+        """Adds new column filled by missing values."""
+        column = Column(name, kind, len(self))
+        self.columns.append(column)
+        self._index[name] = column
+        return column
+
+    def rows(self):
+        """Yields table rows as tuples of values in :attr:`names` order."""
+        columns = self.columns
+        for idx in xrange(len(self)):
+            yield tuple(col[idx] for col in columns)
+
+    def to_numpy(self):
+        """Returns mapping of column names to :mod:`numpy` arrays.
+
+        See :meth:`Column.to_numpy` for details.
+        """
+        return dict((col.name, col.to_numpy()) for col in self.columns)
+
+    def to_csv(self, fileobj, encoding='utf-8', **options):
+        """Writes table to CSV file with header row.
+
+        :param fileobj: File-like object.
+        :param encoding: Texts encoding.
+        :param options: :func:`csv.writer` options.
+        """
+        writer = csv.writer(fileobj, **options)
+        writer.writerow(self.names)
+        for row in self.rows():
+            line = []
+            for value in row:
+                if value is None:
+                    value = ''
+                elif isinstance(value, unicode):
+                    value = value.encode(encoding)
+                elif isinstance(value, datetime.datetime):
+                    value = value.strftime('%Y-%m-%d %H:%M:%S')
+                line.append(value)
+            writer.writerow(line)
+
+    def dump(self, fileobj):
+        """Writes table to binary columnar file.
+
+        File starts with JSON header which describes columns, followed by
+        their raw values and valid flags one column after another, so each
+        column could be read as single block.
+        """
+        header = {
+            'rows': len(self),
+            'byteorder': sys.byteorder,
+            'columns': [{
+                'name': col.name,
+                'kind': col.kind,
+                'itemsize': col.data.itemsize,
+                'categories': col.categories,
+            } for col in self.columns]
+        }
+        header = json.dumps(header)
+        fileobj.write(MAGIC)
+        fileobj.write('%d\n' % len(header))
+        fileobj.write(header)
+        for col in self.columns:
+            fileobj.write(col.data.tostring())
+            fileobj.write(col.valid.tostring())
+
+    @classmethod
+    def load(cls, fileobj):
+        """Reads table from binary columnar file written by :meth:`dump`."""
+        if fileobj.read(len(MAGIC)) != MAGIC:
+            raise ValueError('not a columnar table file')
+        header = json.loads(fileobj.read(int(fileobj.readline())))
+        rows = header['rows']
+        columns = []
+        for info in header['columns']:
+            col = Column(info['name'], info['kind'])
+            if col.data.itemsize != info['itemsize']:
+                raise ValueError('column %s item size %d is not supported'
+                                 '' % (col.name, info['itemsize']))
+            col.data.fromstring(fileobj.read(rows * col.data.itemsize))
+            col.valid.fromstring(fileobj.read(rows))
+            if header['byteorder'] != sys.byteorder:
+                col.data.byteswap()
+            col.categories = info['categories']
+            col._codes = dict((value, idx)
+                              for idx, value in enumerate(col.categories))
+            columns.append(col)
+        return cls(columns)
+
+
+def build(xmlsrc, sequence, fields=None, removed=True):
+    """Builds :class:`Table` from items of named XML sequence.
+
+    Values are taken from XML attributes right when parser emits elements,
+    so items are never decoded to Python objects. Nested sequences and
+    objects are skipped. If item has several fields with the same name, the
+    last one is taken like decoder does.
+
+    :param xmlsrc: XML data source or stream.
+
+    :param sequence: Name of sequence with items.
+    :type sequence: str
+
+    :param fields: Columns to build. See :func:`schema` for possible values,
+                   list of names means to take only them. If omitted, all
+                   fields are taken. Kinds of columns not defined by schema
+                   are chosen by value type markers.
+
+    :param removed: Include items marked as removed.
+    :type removed: bool
+
+    :rtype: :class:`Table`
+
+    :raises: :exc:`~phoxpy.exceptions.LisBaseException` if LIS responded
+             with error.
+
+    >>> table = build('<s n="items">'
+    ...               '<o id="1"><f n="count" t="I" v="5"/></o>'
+    ...               '<o id="2"><f n="count" t="I" v="7"/></o>'
+    ...               '</s>', 'items')
+    >>> table.names
+    ['id', 'count']
+    >>> list(table['count'])
+    [5, 7]
+    """
+    kinds = {}
+    names = None
+    if isinstance(fields, (list, tuple, set, frozenset)):
+        names = set(fields)
+    elif fields is not None:
+        kinds = schema(fields)
+        names = set(kinds)
+    table = Table()
+    if names is not None:
+        for name in sorted(names):
+            if name in kinds:
+                table.add_column(name, kinds[name])
+
+    def take(name, value, kind):
+        if names is not None and name not in names:
+            return
+        if name not in table:
+            table.add_column(name, kind)
+        row[name] = value
+
+    stream = xml.make_stream(xmlsrc)
+    depth = None
+    row = None
+    skip = False
+    for event, elem in stream:
+        if depth is None:
+            if event != 'start':
+                continue
+            if elem.tag == 's' and elem.get('n') == sequence:
+                depth = 0
+            elif elem.tag == 'error':
+                code = elem.get('code')
+                descr = elem.get('description', '')
+                raise exceptions.from_code(int(code), descr.encode('utf-8'))
+            continue
+        if event == 'start':
+            depth += 1
+            if depth == 1:
+                row = {}
+                skip = False
+                for name, value in elem.attrib.items():
+                    take(name, value, 'text')
+            elif depth == 2 and elem.get('n') is not None:
+                if elem.tag == 'f':
+                    if elem.get('n') == 'removed' and not removed:
+                        skip = elem.get('v') == 'true'
+                    kind = TYPEMARKERS.get(elem.get('t'), 'text')
+                    take(elem.get('n'), elem.get('v'), kind)
+                elif elem.tag == 'r':
+                    take(elem.get('n'), elem.get('i'), 'text')
+        else:
+            depth -= 1
+            if depth == 0:
+                if skip:
+                    continue
+                for column in table.columns:
+                    column.append(row.get(column.name))
+            elif depth < 0:
+                break
+    return table
@@ -7,7 +7,17 @@
 # you should have received as part of this distribution.
 #
 
+#: LIS error codes mapped to exception classes. Filled by
+#: :class:`LisExceptionMeta` on each class definition.
+REGISTRY = {}
+
 class LisExceptionMeta(type):
+    """Registers exception classes with error code in :data:`REGISTRY`."""
+    def __init__(cls, name, bases, data):
+        super(LisExceptionMeta, cls).__init__(name, bases, data)
+        if data.get('code') is not None:
+            REGISTRY[data['code']] = cls
+
     def __call__(cls, description=None):
         return super(LisExceptionMeta, cls).__call__(cls.code, description)
 
@@ -16,6 +26,12 @@ class LisBaseException(Exception):
     __metaclass__ = LisExceptionMeta
     code = None
     description = None
+    #: Error is transient, so request could succeed if repeated later.
+    retryable = False
+    #: Session is unknown or expired and should be logged in again.
+    invalidates_session = False
+    #: Repeating request won't help without changing it.
+    permanent = False
 
     def __init__(self, code, description=None):
         self.code = code
@@ -36,6 +52,7 @@ class UnknownError(LisSystemError):
 class InvalidBuildNumber(LisSystemError):
     """Exception for LIS error code #220"""
     code = 220
+    permanent = True
 
 ################################################################################
 # Database
@@ -47,6 +64,7 @@ class LisDatabaseError(LisBaseException):
 class HibernateError(LisDatabaseError):
     """Error in SQL query execution on server side. #103"""
     code = 103
+    retryable = True
 
 ################################################################################
 # Requests
@@ -54,6 +72,7 @@ class HibernateError(LisDatabaseError):
 
 class LisRequestError(LisBaseException):
     """Base exception for request processing errors."""
+    permanent = True
 
 class RequestParsingError(LisRequestError):
     """Couldn't parse XML data due to invalid format of it. #200"""
@@ -69,6 +88,7 @@ class NoProcessorError(LisRequestError):
 
 class LisValueError(LisBaseException, ValueError):
     """Base exception for value errors."""
+    permanent = True
 
 class IncorrectDateFormat(LisValueError):
     """Datetime value has invalid format. #207"""
@@ -80,6 +100,7 @@ class IncorrectDateFormat(LisValueError):
 
 class LisLicenseError(LisBaseException):
     """Base exception for auth related errors."""
+    permanent = True
 
 class LicenseNotFound(LisLicenseError):
     """License not found. #401"""
@@ -99,25 +120,29 @@ class LisAuthError(LisBaseException):
 class UnknownUser(LisAuthError):
     """User not found in common list. #500"""
     code = 500
+    permanent = True
 
 class UnknownSession(LisAuthError):
     """Request passed with invalid session number or expired one. #501"""
     code = 501
+    invalidates_session = True
 
 class NotAuthorized(LisAuthError):
     """Exception for LIS error code #502"""
     code = 502
+    invalidates_session = True
 
 class AuthentificationError(LisAuthError):
     """Invalid login name or password. #504"""
     code = 504
+    permanent = True
 
 ################################################################################
 # Permissions
 ################################################################################
 
 class LisAccessError(LisBaseException):
-    pass
+    permanent = True
 
 class AccessDeny(LisAccessError):
     """No permissions to execute requested operation. #400"""
@@ -125,15 +150,23 @@ class AccessDeny(LisAccessError):
 
 ################################################################################
 
-_EXC_BY_CODE = {}
-_stack = [LisBaseException]
-while _stack:
-    current = _stack.pop()
-    for cls in current.__subclasses__():
-        if cls.code is not None:
-            _EXC_BY_CODE[cls.code] = cls
-        _stack.append(cls)
-del _stack
-
 def get_error_class(code):
-    return _EXC_BY_CODE.get(code, LisBaseException)
+    """Returns exception class for LIS error code or
+    :exc:`LisBaseException` if code is unknown."""
+    return REGISTRY.get(code, LisBaseException)
+
+def from_code(code, description=None):
+    """Returns exception instance for LIS error code. Unknown codes are
+    kept by :exc:`LisBaseException` instance.
+
+    >>> from_code(501, 'expired')
+    UnknownSession('expired',)
+    >>> from_code(999).code
+    999
+    """
+    cls = REGISTRY.get(code)
+    if cls is None:
+        err = LisBaseException(description)
+        err.code = code
+        return err
+    return cls(description)
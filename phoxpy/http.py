@@ -13,27 +13,45 @@
 
 import base64
 import errno
+import random
 import socket
 import sys
 import time
 import urllib
-from httplib import BadStatusLine, HTTPConnection, HTTPSConnection
+import zlib
+from httplib import BadStatusLine, HTTPConnection, HTTPSConnection, \
+                    IncompleteRead
 from urlparse import urlsplit, urlunsplit
-from threading import Lock
+from threading import Lock, local
+from . import exceptions
 try:
     from cStringIO import StringIO
 except ImportError:
     from StringIO import StringIO
 
 __all__ = [
-    'CHUNK_SIZE', 'RETRYABLE_ERRORS',
-    'HTTPError', 'RedirectLimit',
-    'ResponseBody', 'Session', 'Resource'
+    'CHUNK_SIZE', 'BUFFER_SIZE', 'RETRYABLE_ERRORS', 'CONNECT_ERRORS',
+    'RETRYABLE_LIS_ERRORS', 'IDEMPOTENT_REQUESTS',
+    'HTTPError', 'RedirectLimit', 'CircuitOpen',
+    'ResponseBody', 'DecompressingBody',
+    'RetryBudget', 'CircuitBreaker', 'RetryPolicy',
+    'Session', 'Resource'
 ]
 
-#: Nominal data chunk size to process by default
+#: Maximum size of response data which is buffered in memory, larger ones
+#: are streamed with :class:`ResponseBody`
 CHUNK_SIZE = 16 * 1024 * 1024
 
+#: Default size of buffers to read and send streamed data by
+BUFFER_SIZE = 64 * 1024
+
+#: Content encodings which could be decompressed mapped to zlib window bits
+CONTENT_ENCODINGS = {
+    'gzip': 16 + zlib.MAX_WBITS,
+    'x-gzip': 16 + zlib.MAX_WBITS,
+    'deflate': zlib.MAX_WBITS,
+}
+
 #: Frozen set of socket errors which will trigger retry request.
 RETRYABLE_ERRORS = frozenset([
     errno.EPIPE, errno.ETIMEDOUT,
@@ -42,6 +60,27 @@ RETRYABLE_ERRORS = frozenset([
     errno.ENETRESET, errno.ENETUNREACH, errno.ENETDOWN
 ])
 
+#: Frozen set of socket errors which means that request wasn't sent at all,
+#: so it's safe to retry it even if it's not idempotent.
+CONNECT_ERRORS = frozenset([
+    errno.ECONNREFUSED, errno.EHOSTDOWN, errno.EHOSTUNREACH,
+    errno.ENETUNREACH, errno.ENETDOWN
+])
+
+#: Frozen set of LIS error codes which are transient and will trigger retry
+#: request, like #103 (HibernateError). See
+#: :attr:`~phoxpy.exceptions.LisBaseException.retryable`.
+RETRYABLE_LIS_ERRORS = frozenset(code for code, cls
+                                 in exceptions.REGISTRY.items()
+                                 if cls.retryable)
+
+#: Frozen set of phox request types which could be safely sent more than once.
+#: Other requests could be marked as idempotent per call.
+IDEMPOTENT_REQUESTS = frozenset([
+    'directory', 'directory-versions', 'registration-journal',
+    'request-info', 'request-samples', 'request-works', 'patient-history',
+])
+
 class HTTPError(Exception):
     """Base class for errors based on HTTP status codes >= 400."""
 
@@ -50,40 +89,150 @@ class RedirectLimit(Exception):
     by the maximum number of redirections.
     """
 
+class CircuitOpen(Exception):
+    """Exception raised when requests to the host are suspended by
+    :class:`CircuitBreaker` after too many failures in a row."""
+
 class ResponseBody(object):
     """Readonly file-like wrapper for http response data.
 
+    Chunked transfer encoding is decoded by wrapper itself, so data could be
+    read by any portions regardless of chunk boundaries. :meth:`readinto`
+    receives data straight into caller's buffer, so response could be
+    consumed by reusable :class:`bytearray` without allocating new string
+    for each portion.
+
     :param resp: :class:`~httplib.HTTPResponse` instance.
-    :param callback: Callable object.
+    :param callback: Callable object which is called once all data is read.
+    :param buffer_size: Maximum amount of data in bytes to read from the
+                        connection at once.
+    :type buffer_size: int
     """
-    def __init__(self, resp, callback):
+    def __init__(self, resp, callback, buffer_size=None):
         self.resp = resp
         self.callback = callback
+        self.buffer_size = buffer_size or BUFFER_SIZE
+        self._chunked = self.is_chunked_transfer()
+        self._chunk_left = 0
+        self._pending = ''
+        self._eof = False
 
     def __iter__(self):
-        """Iterates over response data.
-
-        If data transfer encoding is "chunked", than it would iterate over each
-        line for each chunk in response. Otherwise it works like readlines
-        method.
+        """Iterates over response data by lines like :meth:`readlines`
+        regardless of transfer encoding.
 
         Yields:
             Response data by lines.
         """
-        if self.is_chunked_transfer():
-            while not self.is_closed():
-                chunks = int(self.readline().strip(), 16)
-                if not chunks:
-                    self.read(2) #crlf
-                    self.resp.close()
-                    self.callback()
-                    break
-                for line in self.read(chunks).splitlines():
-                    yield line
-                self.read(2) #crlf
+        return self.readlines()
+
+    def _read_chunk_size(self):
+        """Reads next chunk header and returns chunk size."""
+        line = self.resp.fp.readline()
+        size = line.split(';', 1)[0].strip()
+        if not size:
+            return 0
+        return int(size, 16)
+
+    def _chunk_span(self, size):
+        """Returns amount of data up to `size` bytes which could be read from
+        current position without crossing chunk boundary or ``0`` at the
+        end of response."""
+        if not self._chunk_left:
+            self._chunk_left = self._read_chunk_size()
+            if not self._chunk_left:
+                # skip trailers till the final crlf
+                while self.resp.fp.readline() not in ('\r\n', '\n', ''):
+                    pass
+                self._finish()
+                return 0
+        return min(size, self._chunk_left)
+
+    def _consumed(self, size):
+        """Marks `size` bytes of current chunk as read."""
+        if not size:
+            raise IncompleteRead('')
+        self._chunk_left -= size
+        if not self._chunk_left:
+            self.resp.fp.readline() # crlf
+
+    def _read_piece(self, size):
+        """Reads up to `size` bytes of response data. Returns empty string at
+        the end of response."""
+        if self._eof:
+            return ''
+        if not self._chunked:
+            data = self.resp.read(size)
+            if not data or self.resp.isclosed():
+                self._finish()
+            return data
+        size = self._chunk_span(size)
+        if not size:
+            return ''
+        data = self.resp.fp.read(size)
+        self._consumed(len(data))
+        return data
+
+    def _fp_readinto(self, view):
+        """Reads data from response stream straight into `view`. Returns
+        amount of read bytes or ``None`` if stream couldn't do that."""
+        fp = self.resp.fp
+        readinto = getattr(fp, 'readinto', None)
+        if readinto is not None:
+            return readinto(view)
+        # socket file of Python 2 has no readinto, but while its own read
+        # buffer is empty data could be received into view by socket itself
+        sock = getattr(fp, '_sock', None)
+        rbuf = getattr(fp, '_rbuf', None)
+        if sock is None or rbuf is None:
+            return None
+        rbuf.seek(0, 2)
+        if rbuf.tell():
+            return None
+        while True:
+            try:
+                return sock.recv_into(view)
+            except socket.error, err:
+                if err.args[0] != errno.EINTR:
+                    raise
+
+    def _readinto_piece(self, view):
+        """Reads up to ``len(view)`` bytes of response data into `view`
+        without intermediate strings if response stream allows that.
+        Returns amount of read bytes."""
+        if self._eof:
+            return 0
+        if self._chunked:
+            size = self._chunk_span(len(view))
+            if not size:
+                return 0
+            view = view[:size]
+            length = None
         else:
-            for line in self.readlines():
-                yield line
+            length = getattr(self.resp, 'length', None)
+            if length is not None:
+                view = view[:length]
+        size = self._fp_readinto(view)
+        if size is None:
+            data = self._read_piece(len(view))
+            view[:len(data)] = data
+            return len(data)
+        if self._chunked:
+            self._consumed(size)
+            return size
+        if length is not None:
+            self.resp.length = length - size
+        if not size or size == length:
+            self._finish()
+        return size
+
+    def _finish(self):
+        """Closes wrapped response and calls callback once."""
+        self._eof = True
+        self.resp.close()
+        if self.callback is not None:
+            self.callback()
+            self.callback = None
 
     def read(self, size=None):
         """Read response data.
@@ -95,27 +244,75 @@ class ResponseBody(object):
         :return: Data chunk.
         :rtype: str
         """
-        bytes_data = self.resp.read(size)
-        if size is None or len(bytes_data) < size:
-            self.resp.close()
-        return bytes_data
+        if size is None or size < 0:
+            chunks = [self._pending]
+            while True:
+                piece = self._read_piece(self.buffer_size)
+                if not piece:
+                    break
+                chunks.append(piece)
+            self._pending = ''
+            return ''.join(chunks)
+        chunks = []
+        if self._pending:
+            chunks.append(self._pending[:size])
+            self._pending = self._pending[size:]
+            size -= len(chunks[0])
+        while size:
+            piece = self._read_piece(min(size, self.buffer_size))
+            if not piece:
+                break
+            chunks.append(piece)
+            size -= len(piece)
+        return ''.join(chunks)
+
+    def readinto(self, buffer):
+        """Reads response data into preallocated writable buffer.
+
+        :param buffer: :class:`bytearray` or writable :class:`memoryview`.
+
+        :return: Amount of read bytes. ``0`` means end of response.
+        :rtype: int
+        """
+        view = memoryview(buffer)
+        pos = 0
+        if self._pending:
+            pos = min(len(view), len(self._pending))
+            view[:pos] = self._pending[:pos]
+            self._pending = self._pending[pos:]
+        while pos < len(view):
+            size = self._readinto_piece(view[pos:pos + self.buffer_size])
+            if not size:
+                break
+            pos += size
+        return pos
 
     def readline(self):
         """Reads one line from response data."""
-        return self.resp.fp.readline()
+        while '\n' not in self._pending:
+            piece = self._read_piece(self.buffer_size)
+            if not piece:
+                break
+            self._pending += piece
+        pos = self._pending.find('\n') + 1 or len(self._pending)
+        line, self._pending = self._pending[:pos], self._pending[pos:]
+        return line
 
     def readlines(self):
         """Yields response data line by line."""
-        while not self.is_closed():
-            yield self.readline()
+        while True:
+            line = self.readline()
+            if not line:
+                break
+            yield line
 
     def close(self):
         """Closes wrapped response instance by reading all data to void."""
-        while not self.resp.isclosed():
-            self.read(CHUNK_SIZE)
-        if self.callback is not None:
-            self.callback()
-            self.callback = None
+        while self._read_piece(self.buffer_size):
+            pass
+        self._pending = ''
+        if not self._eof:
+            self._finish()
 
     def is_chunked_transfer(self):
         """Check if response has chunked transfer encoding nature."""
@@ -123,30 +320,457 @@ class ResponseBody(object):
 
     def is_closed(self):
         """Check if response stream is closed."""
-        return self.resp.isclosed()
+        return self.resp.isclosed() and not self._pending
+
+
+class DecompressingBody(object):
+    """Readonly file-like wrapper for gzip or deflate encoded response data.
+
+    Data is decompressed on the fly while it's being read, so neither
+    compressed nor decompressed response is kept in memory as whole.
+
+    :param resp: :class:`~httplib.HTTPResponse` instance or any other object
+                 with ``read`` method.
+    :param encoding: Response content encoding.
+    :type encoding: str
+    :param callback: Callable object which is called when all data is read.
+    """
+    def __init__(self, resp, encoding, callback=None):
+        self.resp = resp
+        self.encoding = encoding
+        self.callback = callback
+        self._zobj = zlib.decompressobj(CONTENT_ENCODINGS[encoding])
+        self._raw_deflate = False
+        self._buffer = ''
+        self._eof = False
+
+    def __iter__(self):
+        """Iterates over decompressed data by lines."""
+        while True:
+            line = self.readline()
+            if not line:
+                break
+            yield line
+
+    def _decompress(self, data, size):
+        try:
+            return self._zobj.decompress(data, size)
+        except zlib.error:
+            if self.encoding != 'deflate' or self._raw_deflate:
+                raise
+            # some servers send raw deflate stream without zlib header
+            self._raw_deflate = True
+            self._zobj = zlib.decompressobj(-zlib.MAX_WBITS)
+            return self._zobj.decompress(data, size)
+
+    def _fill(self, size):
+        """Decompresses next portion of data, but no more than `size` bytes.
+        Returns ``False`` if there is no more data."""
+        if self._zobj.unconsumed_tail:
+            data = self._zobj.unconsumed_tail
+        elif self._eof:
+            return False
+        else:
+            data = self.resp.read(BUFFER_SIZE)
+            if not data:
+                self._eof = True
+                self._buffer += self._zobj.flush()
+                self._close()
+                return True
+        self._buffer += self._decompress(data, size)
+        return True
+
+    def _close(self):
+        if self.callback is not None:
+            self.callback()
+            self.callback = None
+
+    def read(self, size=None):
+        """Reads decompressed data.
+
+        :param size: Amount of data in bytes that should be readed.
+                     ``None`` value means "read all at once".
+        :type size: int
+
+        :return: Data chunk.
+        :rtype: str
+        """
+        if size is None or size < 0:
+            chunks = [self._buffer]
+            self._buffer = ''
+            while self._fill(BUFFER_SIZE):
+                chunks.append(self._buffer)
+                self._buffer = ''
+            return ''.join(chunks)
+        while len(self._buffer) < size:
+            if not self._fill(size - len(self._buffer)):
+                break
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def readline(self, size=None):
+        """Reads one line from decompressed data.
+
+        :param size: Maximum amount of data in bytes to read, so long line
+                     is returned by parts. ``None`` value means no limit.
+        :type size: int
+
+        :return: Line or its part.
+        :rtype: str
+        """
+        if size is not None and size < 0:
+            size = None
+        start = 0
+        while True:
+            pos = self._buffer.find('\n', start) + 1
+            if pos:
+                break
+            pos = len(self._buffer)
+            if size is not None and pos >= size:
+                break
+            # only new data could contain line end
+            start = pos
+            limit = BUFFER_SIZE if size is None else size - pos
+            if not self._fill(min(limit, BUFFER_SIZE)):
+                break
+        if size is not None:
+            pos = min(pos, size)
+        data, self._buffer = self._buffer[:pos], self._buffer[pos:]
+        return data
+
+    def close(self):
+        """Closes wrapped response by reading all data to void."""
+        while self._fill(BUFFER_SIZE):
+            self._buffer = ''
+        self._buffer = ''
+
+    def is_closed(self):
+        """Check if all data has been read."""
+        return self._eof and not self._buffer
+
+
+class RetryBudget(object):
+    """Limits retries to the fraction of the requests made, so failing server
+    doesn't receive several times more requests than usually.
+
+    Each request deposits `ratio` of retry, each retry withdraws one.
+
+    :param ratio: Allowed retries per request.
+    :type ratio: float
+
+    :param reserve: Retries available from the start and maximum number of
+                    saved ones.
+    :type reserve: int
+    """
+    def __init__(self, ratio=0.2, reserve=10):
+        self.ratio = ratio
+        self.reserve = reserve
+        self.balance = float(reserve)
+        self.lock = Lock()
+
+    def deposit(self):
+        """Records new request."""
+        with self.lock:
+            self.balance = min(self.reserve, self.balance + self.ratio)
+
+    def withdraw(self):
+        """Takes one retry from the budget. Returns ``False`` if budget is
+        exhausted."""
+        with self.lock:
+            if self.balance < 1:
+                return False
+            self.balance -= 1
+            return True
+
+
+class CircuitBreaker(object):
+    """Suspends requests to the host after `threshold` failures in a row.
+
+    After `reset_timeout` seconds single probe request is allowed: if it
+    succeeds, circuit is closed again, otherwise it stays open for another
+    `reset_timeout` seconds.
+
+    :param threshold: Number of failures in a row to open circuit.
+    :type threshold: int
+
+    :param reset_timeout: Seconds before next probe request.
+    :type reset_timeout: float
+    """
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+    def __init__(self, threshold=5, reset_timeout=30):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.lock = Lock()
+
+    def allow(self):
+        """Checks if request could be sent."""
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and \
+                    time.time() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def success(self):
+        """Records successful request."""
+        with self.lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def failure(self):
+        """Records failed request."""
+        with self.lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+                self.state = self.OPEN
+                self.opened_at = time.time()
+
+
+class RetryPolicy(object):
+    """Decides which failed requests to retry and when.
+
+    Delays grow exponentially starting from `backoff` seconds and are
+    randomized by `jitter`, so clients which failed at the same moment don't
+    retry all together. Requests are retried only if they are idempotent,
+    unless error shows that nothing was sent to the server.
+
+    :param max_retries: Maximum number of retries per request.
+    :type max_retries: int
+
+    :param backoff: Delay before first retry in seconds.
+    :type backoff: float
+
+    :param factor: Delay multiplier for each next retry.
+    :type factor: float
+
+    :param max_delay: Maximum delay between retries in seconds.
+    :type max_delay: float
+
+    :param jitter: Fraction of delay to randomize: each delay is chosen
+                   between ``delay * (1 - jitter)`` and ``delay``.
+    :type jitter: float
+
+    :param deadline: Total time in seconds for request with all retries.
+                     Retry which couldn't fit it isn't made.
+    :type deadline: float
+
+    :param delays: Static list of delays. Overrides exponential backoff.
+    :type delays: list
+
+    :param budget: Retries budget shared by all requests. ``None`` means
+                   unlimited.
+    :type budget: :class:`RetryBudget`
+
+    :param breaker_threshold: Failures in a row to open per host
+                              :class:`CircuitBreaker`. ``None`` disables it.
+    :type breaker_threshold: int
+
+    :param breaker_timeout: Seconds before open circuit allows probe request.
+    :type breaker_timeout: float
+
+    :param retryable_errors: Socket error codes to retry.
+    :type retryable_errors: iterable
+
+    :param retryable_codes: LIS error codes to retry. By default errors
+                            marked as
+                            :attr:`~phoxpy.exceptions.LisBaseException.retryable`
+                            are retried.
+    :type retryable_codes: iterable
+
+    :param idempotent_requests: Phox request types which are safe to retry.
+    :type idempotent_requests: iterable
+
+    Calls made while another call of the same policy is running in the thread,
+    like HTTP requests of retried phox request, don't deposit to the `budget`,
+    so each logical request is counted once.
+    """
+    def __init__(self, max_retries=3, backoff=0.05, factor=2, max_delay=5,
+                 jitter=0.5, deadline=None, delays=None, budget=None,
+                 breaker_threshold=5, breaker_timeout=30,
+                 retryable_errors=RETRYABLE_ERRORS,
+                 retryable_codes=None,
+                 idempotent_requests=IDEMPOTENT_REQUESTS):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.factor = factor
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.deadline = deadline
+        self.delays = delays is not None and list(delays) or None
+        self.budget = budget
+        self.breaker_threshold = breaker_threshold
+        self.breaker_timeout = breaker_timeout
+        self.retryable_errors = set(retryable_errors)
+        if retryable_codes is not None:
+            retryable_codes = set(retryable_codes)
+        self.retryable_codes = retryable_codes
+        self.idempotent_requests = set(idempotent_requests)
+        self.random = random.Random()
+        self._breakers = {}
+        self._lock = Lock()
+        self._local = local()
+
+    def delay(self, attempt):
+        """Returns delay in seconds before retry number `attempt` or ``None``
+        if no more retries are allowed."""
+        if self.delays is not None:
+            if attempt >= len(self.delays):
+                return None
+            return self.delays[attempt]
+        if attempt >= self.max_retries:
+            return None
+        delay = min(self.max_delay, self.backoff * self.factor ** attempt)
+        return delay * (1 - self.jitter * self.random.random())
+
+    def is_idempotent(self, request_type):
+        """Checks if phox request of specified type is safe to retry."""
+        return request_type in self.idempotent_requests
+
+    def is_transient(self, err):
+        """Checks if error is transient, so request could succeed later."""
+        if isinstance(err, socket.error):
+            return bool(err.args) and err.args[0] in self.retryable_errors
+        if self.retryable_codes is None:
+            return getattr(err, 'retryable', False)
+        return getattr(err, 'code', None) in self.retryable_codes
+
+    def is_retryable(self, err, idempotent):
+        """Checks if request failed with `err` could be sent again."""
+        if not self.is_transient(err):
+            return False
+        if idempotent:
+            return True
+        return isinstance(err, socket.error) and err.args[0] in CONNECT_ERRORS
+
+    def breaker(self, host):
+        """Returns :class:`CircuitBreaker` for specified host or ``None`` if
+        they are disabled."""
+        if self.breaker_threshold is None or host is None:
+            return None
+        with self._lock:
+            if host not in self._breakers:
+                self._breakers[host] = CircuitBreaker(self.breaker_threshold,
+                                                      self.breaker_timeout)
+            return self._breakers[host]
+
+    def call(self, func, host=None, idempotent=False, errors=(Exception,),
+             on_retry=None):
+        """Calls `func` retrying it on transient failures.
+
+        :param func: Callable without arguments which makes the request.
+
+        :param host: Request target host to track its health.
+        :type host: str
+
+        :param idempotent: Request is safe to be sent more than once.
+        :type idempotent: bool
+
+        :param errors: Exception classes to handle. Others are raised as is.
+        :type errors: tuple
+
+        :param on_retry: Callable which receives error before each retry.
+
+        :raises: :exc:`CircuitOpen` if requests to the `host` are suspended.
+        """
+        if getattr(self._local, 'active', False):
+            return self._call(func, host, idempotent, errors, on_retry)
+        if self.budget is not None:
+            self.budget.deposit()
+        self._local.active = True
+        try:
+            return self._call(func, host, idempotent, errors, on_retry)
+        finally:
+            self._local.active = False
+
+    def _call(self, func, host, idempotent, errors, on_retry):
+        breaker = self.breaker(host)
+        start = time.time()
+        attempt = 0
+        while True:
+            if breaker is not None and not breaker.allow():
+                raise CircuitOpen('Requests to %s are suspended' % host)
+            try:
+                result = func()
+            except errors, err:
+                if not self.is_transient(err):
+                    if breaker is not None:
+                        breaker.success()
+                    raise
+                if breaker is not None:
+                    breaker.failure()
+                if not self.is_retryable(err, idempotent):
+                    raise
+                delay = self.delay(attempt)
+                if delay is None:
+                    raise
+                if self.deadline is not None and \
+                        time.time() + delay - start > self.deadline:
+                    raise
+                if self.budget is not None and not self.budget.withdraw():
+                    raise
+                if on_retry is not None:
+                    on_retry(err)
+                attempt += 1
+                time.sleep(delay)
+            else:
+                if breaker is not None:
+                    breaker.success()
+                return result
 
 
 class Session(object):
     """HTTP session holder.
 
     :param retry_delays: List of delay seconds before next try will be used.
+                         Shortcut for :class:`RetryPolicy` with static
+                         delays.
     :type retry_delays: list of int
 
     :param max_redirects: Maximum number of redirects before
                           :exc:`~phoxpy.http.RedirectLimit` will be raised.
     :type max_redirects: int
 
-    :param retryable_errors:
+    :param retryable_errors: Socket error codes to retry.
     :type retryable_errors: iterable
+
+    :param retry_policy: Retry policy. By default requests are retried with
+                         exponential backoff.
+    :type retry_policy: :class:`RetryPolicy`
+
+    :param compression: Ask server to send gzip or deflate compressed
+                        responses. They are decompressed transparently.
+    :type compression: bool
+
+    :param compress_threshold: Send request bodies larger than this number of
+                               bytes gzip compressed. ``None`` disables
+                               request compression; server should support it.
+    :type compress_threshold: int
+
+    :param buffer_size: Maximum amount of data in bytes to read or send at
+                        once for streamed request and response bodies.
+    :type buffer_size: int
     """
     def __init__(self, retry_delays=None, max_redirects=5,
-                 retryable_errors=RETRYABLE_ERRORS):
+                 retryable_errors=RETRYABLE_ERRORS, retry_policy=None,
+                 compression=False, compress_threshold=None,
+                 buffer_size=BUFFER_SIZE):
         self._conns = {}
         self._perm_redirects = {}
         self.lock = Lock()
-        self.retry_delays = list(retry_delays or [0])
         self.max_redirects = max_redirects
-        self.retryable_errors = set(retryable_errors)
+        self.compression = compression
+        self.compress_threshold = compress_threshold
+        self.buffer_size = buffer_size
+        if retry_policy is None:
+            retry_policy = RetryPolicy(delays=retry_delays,
+                                       retryable_errors=retryable_errors)
+        self.retry_policy = retry_policy
 
     def _prerare_request(self, method, url, body, headers, credentials):
         """Prepare request options for future use."""
@@ -170,8 +794,15 @@ class Session(object):
             elif body is not None:
                 raise TypeError('Invalid request body data %r' % body)
         if isinstance(body, basestring):
+            if self.compress_threshold is not None \
+                    and len(body) > self.compress_threshold:
+                body = gzip_compress(body)
+                headers['Content-Encoding'] = 'gzip'
             headers['Content-Length'] = str(len(body))
 
+        if self.compression:
+            headers.setdefault('Accept-Encoding', 'gzip, deflate')
+
         if credentials:
             basic_auth = 'Basic %s' % base64.b64encode('%s:%s' % credentials)
             headers['Authorization'] = basic_auth
@@ -180,7 +811,7 @@ class Session(object):
 
 
     def request(self, method, url, body=None, headers=None, credentials=None,
-                _num_redirects=0):
+                idempotent=None, _num_redirects=0):
         """Send request to specified url.
 
         :param method: Request method (GET, POST, PUT etc.).
@@ -199,6 +830,10 @@ class Session(object):
         :param credentials: Username and password pair used for basic auth.
         :type credentials: list, tuple
 
+        :param idempotent: Request is safe to retry. By default it's decided
+                           by `method`. File-like bodies are never retried.
+        :type idempotent: bool
+
         :return: 3-element ``tuple`` of response status code (``int``),
                  http headers (``dict``) and response data.
 
@@ -208,39 +843,44 @@ class Session(object):
                  depending from ``CHUNK_SIZE`` variable and `Content-Length`
                  header values.
         :rtype: tuple
+
+        :raises: :exc:`CircuitOpen` if requests to the host are suspended
+                 due to many failures.
         """
 
         method, url, body, headers, credentials = \
             self._prerare_request(method, url, body, headers, credentials)
         
         path_query = urlunsplit(('', '') + urlsplit(url)[2:4] + ('',))
+        if idempotent is None:
+            idempotent = method in ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+        if body is not None and not isinstance(body, basestring):
+            idempotent = False
 
         conn = self._connect(url)
-        retries = iter(self.retry_delays)
-        while True:
-            try:
-                resp = self._send_request(conn, method,
+        send = lambda: self._send_request(conn, method,
                                           path_query, body, headers)
-            except socket.error, err:
-                self._try_retry(conn, err, retries)
-                continue
-
-            if resp.status in (301, 302, 303, 307):
-                resp.read()
-                self._cache_connection(url, conn)
-                if _num_redirects > self.max_redirects:
-                    raise RedirectLimit('Redirection limit (%s) exceeded'
-                                        '' % self.max_redirects)
-                location = resp.getheader('location')
-                if resp.status == 301:
-                    self._perm_redirects[url] = location
-                elif resp.status == 303:
-                    method = 'GET'
-                return self.request(method, location, body, headers,
-                                    _num_redirects=_num_redirects + 1)
-
-            cache_connection = lambda: self._cache_connection(url, conn)
-            return self._handle_response(method, resp, cache_connection)
+        # connection is (re)opened by send, so connect errors are retried too
+        resp = self.retry_policy.call(send, urlsplit(url)[1], idempotent,
+                                      errors=(socket.error,),
+                                      on_retry=lambda err: conn.close())
+        if resp.status in (301, 302, 303, 307):
+            resp.read()
+            self._cache_connection(url, conn)
+            if _num_redirects > self.max_redirects:
+                raise RedirectLimit('Redirection limit (%s) exceeded'
+                                    '' % self.max_redirects)
+            location = resp.getheader('location')
+            if resp.status == 301:
+                self._perm_redirects[url] = location
+            elif resp.status == 303:
+                method = 'GET'
+            return self.request(method, location, body, headers,
+                                idempotent=idempotent,
+                                _num_redirects=_num_redirects + 1)
+
+        cache_connection = lambda: self._cache_connection(url, conn)
+        return self._handle_response(method, resp, cache_connection)
 
     def _connect(self, url):
         """Create HTTP/HTTPS connection based on url.
@@ -268,7 +908,6 @@ class Session(object):
                 else:
                     raise ValueError('%s is not a supported scheme' % scheme)
                 conn = cls(host)
-                conn.connect()
         finally:
             self.lock.release()
         return conn
@@ -283,6 +922,8 @@ class Session(object):
 
     def _send_request(self, conn, method, path_query, body, headers):
         """Actually sends prepared request via active connection."""
+        if conn.sock is None:
+            conn.connect()
         try:
             conn.putrequest(method, path_query, skip_accept_encoding=True)
             for header in headers:
@@ -293,7 +934,7 @@ class Session(object):
                     conn.send(body)
                 else:
                     while True:
-                        chunk = body.read(CHUNK_SIZE)
+                        chunk = body.read(self.buffer_size)
                         if not chunk:
                             break
                         conn.send(('%x\r\n' % len(chunk)) + chunk + '\r\n')
@@ -305,19 +946,6 @@ class Session(object):
             else:
                 raise
 
-    def _try_retry(self, conn, err, retries):
-        """Checks if there could be one more shot."""
-        ecode = err.args[0]
-        if ecode not in self.retryable_errors:
-            raise
-        try:
-            delay = retries.next()
-        except StopIteration:
-            # No more retries, raise last socket error.
-            raise err
-        time.sleep(delay)
-        conn.close() # relay on autoopen connection property
-
     def _handle_response(self, method, resp, cache_connection):
         """Handles response to make final changes."""
         status = resp.status
@@ -331,6 +959,12 @@ class Session(object):
             resp.read()
             cache_connection()
 
+        # Decompress encoded response bodies on the fly
+        elif resp.getheader('content-encoding') in CONTENT_ENCODINGS:
+            body = ResponseBody(resp, cache_connection, self.buffer_size)
+            data = DecompressingBody(body, resp.getheader('content-encoding'))
+            streamed = True
+
         # Buffer small response bodies
         elif int(resp.getheader('content-length', sys.maxint)) < CHUNK_SIZE:
             data = resp.read()
@@ -339,12 +973,14 @@ class Session(object):
         # For large or chunked response bodies, do not buffer the full body,
         # and instead return a minimal file-like object
         else:
-            data = ResponseBody(resp, cache_connection)
+            data = ResponseBody(resp, cache_connection, self.buffer_size)
             streamed = True
 
         # Handle errors
         if status >= 400:
-            if method != 'HEAD':
+            if isinstance(data, DecompressingBody):
+                error = data.read()
+            elif method != 'HEAD':
                 error = resp.read()
                 cache_connection()
             else:
@@ -386,7 +1022,8 @@ class Resource(object):
         obj.headers = self.headers.copy()
         return obj
 
-    def post(self, path=None, body=None, headers=None, **params):
+    def post(self, path=None, body=None, headers=None, idempotent=None,
+             **params):
         """Sends POST request to resource.
 
         :param path: Resource relative path.
@@ -399,6 +1036,10 @@ class Resource(object):
         :param headers: HTTP headers dictionary.
         :type headers: dict
 
+        :param idempotent: Request is safe to retry. See
+                           :meth:`Session.request` for details.
+        :type idempotent: bool
+
         :param params: Custom query parameters as keyword arguments.
             
         :return: 3-element ``tuple`` of response status code (``int``),
@@ -410,9 +1051,10 @@ class Resource(object):
             header values.
         :rtype: tuple
         """
-        return self._request('POST', path, body, headers, **params)
+        return self._request('POST', path, body, headers, idempotent, **params)
 
-    def _request(self, method, path=None, body=None, headers=None, **params):
+    def _request(self, method, path=None, body=None, headers=None,
+                 idempotent=None, **params):
         all_headers = self.headers.copy()
         all_headers.update(headers or {})
         if path is not None:
@@ -420,8 +1062,16 @@ class Resource(object):
         else:
             url = urljoin(self.url, **params)
         return self.session.request(method, url, body=body, headers=all_headers,
-                                    credentials=self.credentials)
+                                    credentials=self.credentials,
+                                    idempotent=idempotent)
+
 
+def gzip_compress(data, level=6):
+    """Compresses data to gzip format."""
+    if isinstance(data, unicode):
+        data = data.encode('utf-8')
+    zobj = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return zobj.compress(data) + zobj.flush()
 
 def quote(string, safe=''):
     if isinstance(string, unicode):
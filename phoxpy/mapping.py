@@ -16,7 +16,7 @@ import copy
 import datetime
 from itertools import islice
 from . import xml
-from .xmlobjects import Attribute, Reference
+from .xmlobjects import Attribute, LazyObject, Reference
 
 __all__ = ['Field', 'BooleanField', 'IntegerField', 'LongField', 'FloatField',
            'TextField', 'DateTimeField', 'RefField', 'ListField', 'ObjectField',
@@ -183,7 +183,7 @@ class Mapping(object):
 
     @classmethod
     def wrap(cls, data):
-        if isinstance(data, dict):
+        if isinstance(data, (dict, LazyObject)):
             return cls(**data)
         elif isinstance(data, Mapping):
             return cls(**dict(data.items()))
@@ -476,7 +476,7 @@ class ObjectField(Field):
         super(ObjectField, self).__init__(name, default=default)
 
     def _get_value(self, value):
-        if isinstance(value, dict):
+        if isinstance(value, (dict, LazyObject)):
             return self.mapping(**value)
         elif isinstance(value, self.mapping):
             return value
@@ -484,7 +484,7 @@ class ObjectField(Field):
             return self.mapping(**dict(value.items()))
 
     def _set_value(self, value):
-        if isinstance(value, dict):
+        if isinstance(value, (dict, LazyObject)):
             return self.mapping(**value)
         elif isinstance(value, self.mapping):
             return value
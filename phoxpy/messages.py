@@ -10,7 +10,15 @@
 from phoxpy import xml
 from phoxpy.mapping import MetaMapping, Mapping, AttributeField, ObjectField
 
-__all__ = ['Message', 'PhoxRequest', 'PhoxResponse', 'Content']
+__all__ = ['Message', 'PhoxRequest', 'PhoxResponse', 'Content',
+           'CONTENT_DEPTH', 'ITEMS_DEPTH']
+
+#: Depth of the message content object element:
+#: ``phox-response/content/o``.
+CONTENT_DEPTH = 2
+#: Depth of items elements of content object sequences, like directory
+#: objects or registration journal rows: ``phox-response/content/o/s/o``.
+ITEMS_DEPTH = 4
 
 
 class Content(Mapping):
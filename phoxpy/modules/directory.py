@@ -8,14 +8,19 @@
 #
 
 import time
+import threading
+from itertools import islice
+from phoxpy import columnar
+from phoxpy import xml
 from phoxpy.xmlcodec import DirectoryResponseCodec
 from phoxpy.mapping import (
     Mapping, ObjectField, ListField, RefField, TextField, AttributeField
 )
-from phoxpy.messages import PhoxRequest, PhoxRequestContent
+from phoxpy.messages import PhoxRequest, PhoxRequestContent, ITEMS_DEPTH
+from phoxpy.xmlobjects import LazyObject
 
-__all__ = ['DIRS_FOR_NEW_PROC',
-           'items', 'load', 'store', 'remove', 'restore',
+__all__ = ['DIRS_FOR_NEW_PROC', 'CACHED_REQUESTS',
+           'items', 'load', 'load_table', 'store', 'store_many', 'remove', 'restore',
            'DirectoryLoad', 'DirectorySave', 'DirectorySaveNew',
            'DirectoryRemove', 'DirectoryRemoveNew', 'DirectoryRestore']
 
@@ -67,17 +72,44 @@ DIRS_FOR_NEW_PROC = set(
      'wellType', 'worklistDefGroup']
 )
 
+#: Types of requests which cached responses depend on directories data.
+CACHED_REQUESTS = ('directory', 'directory-versions')
+
 def maybe_item_or_ids(value):
     """Helper to make no difference what have passed: directory item, single or
     list of ids.
     """
-    if isinstance(value, (dict, Mapping)):
+    if isinstance(value, (dict, LazyObject, Mapping)):
         return [value['id']]
     elif isinstance(value, list):
         return value
     elif value is not None:
         return [value]
 
+def batches(seq, size):
+    """Splits sequence by lists of `size` items. ``None`` size means single
+    batch with all of them."""
+    seq = iter(seq)
+    while True:
+        batch = list(islice(seq, size))
+        if not batch:
+            break
+        yield batch
+
+def remove_version(xmlsrc):
+    """Decodes new directory version from old-style directory-remove
+    response. Unlike other responses, its content holds the version as
+    single unnamed string field.
+
+    >>> remove_version('<phox-response><content><f t="S" v="6"/></content>'
+    ...                '</phox-response>')
+    6
+    """
+    stream = xml.make_stream(xmlsrc)
+    for event, elem in stream:
+        if event == 'start' and elem.tag in ('f', 'error'):
+            return int(xml.decode_elem(stream, elem))
+
 def items(session):
     """Iterates over all available directories.
 
@@ -90,7 +122,8 @@ def items(session):
     for db in resp['versions']:
         yield db['name'], db['version']
 
-def load(session, name, ids=None, removed=False, _wrapper=DirectoryResponseCodec):
+def load(session, name, ids=None, removed=False, lazy=False, fields=None,
+         where=None, _wrapper=DirectoryResponseCodec):
     """Loads data from specified directory.
 
     :param session: Active session instance.
@@ -105,16 +138,87 @@ def load(session, name, ids=None, removed=False, _wrapper=DirectoryResponseCodec
     :param removed: Allows to yield removed items if set as True.
     :type removed: bool
 
+    :param lazy: Yield :class:`~phoxpy.xmlobjects.LazyObject` instances which
+                 convert their fields on first access. Faster if only few
+                 fields of objects are used.
+    :type lazy: bool
+
+    :param fields: Names of objects fields to load. Other ones are skipped
+                   while response decoding. If omitted, all fields are
+                   loaded.
+    :type fields: list
+
+    :param where: Predicate objects should match. Objects are matched while
+                  response decoding by fields it uses, so mismatched ones are
+                  never fully decoded. Restrictions of ``id`` field are sent
+                  to server within request.
+    :type where: :class:`~phoxpy.predicates.Predicate`
+
     :yields: Directory objects as dict.
     """
     ids = maybe_item_or_ids(ids)
+    if where is not None:
+        matched = where.ids()
+        if matched is not None:
+            if ids is not None:
+                matched = matched.intersection(ids)
+            if not matched:
+                return
+            ids = sorted(matched)
     msg = DirectoryLoad(name=name, elements=ids).to_message(type='directory')
-    resp = session.request(body=msg, wrapper=_wrapper)
+    extra = set()
+    if fields is not None:
+        fields = set(fields)
+        if not removed:
+            extra.add('removed')
+        if where is not None:
+            extra.update(where.fields)
+        extra -= fields
+        fields |= extra
+    def wrapper(stream):
+        if fields is not None:
+            stream = xml.project(stream, fields, ITEMS_DEPTH)
+        if where is not None:
+            stream = xml.where(stream, where, ITEMS_DEPTH)
+        return _wrapper.to_python(stream)
+    # mismatched objects are decoded lazy to convert only matched fields
+    resp = session.request(body=msg, wrapper=wrapper,
+                           lazy=lazy or where is not None)
     for item in resp[name]:
         if not removed and item.get('removed', False):
             continue
+        for key in extra:
+            item.pop(key, None)
+        if where is not None and not lazy:
+            item = item.copy()
         yield item
 
+def load_table(session, name, ids=None, fields=None, removed=False):
+    """Loads data from specified directory as columnar table. Objects are not
+    decoded one by one, their fields are collected into typed arrays instead.
+
+    :param session: Active session instance.
+    :type session: :class:`~phoxpy.client.Session`
+
+    :param name: Directory name.
+    :type name: str
+
+    :param ids: List of object ids. If omitted, all objects will be loaded.
+    :type ids: list
+
+    :param fields: Table columns. See :func:`~phoxpy.columnar.build` for
+                   details.
+
+    :param removed: Allows to include removed items if set as True.
+    :type removed: bool
+
+    :rtype: :class:`~phoxpy.columnar.Table`
+    """
+    ids = maybe_item_or_ids(ids)
+    msg = DirectoryLoad(name=name, elements=ids).to_message(type='directory')
+    wrapper = lambda stream: columnar.build(stream, name, fields, removed)
+    return session.request(body=msg, wrapper=wrapper)
+
 def store(session, name, item):
     """Stores directory object on server.
 
@@ -143,10 +247,79 @@ def store(session, name, item):
                               # very obliviously.
     msg = DirectorySave(directory=name, element=item).to_message(type=msgtype)
     resp = session.request(body=msg)
+    session.invalidate(*CACHED_REQUESTS)
     item['id'] = resp['id']
     return item['id'], resp['version']
 
-def remove(session, name, ids):
+def store_many(session, name, items, batch_size=100, concurrency=4):
+    """Stores many directory objects on server.
+
+    Directory save request holds only single object, so objects are stored
+    with concurrent requests over pooled HTTP connections of the `session`.
+    Objects are taken from `items` by batches, so it may be a generator of
+    any length.
+
+    :param session: Active session instance.
+    :type session: :class:`~phoxpy.client.Session`
+
+    :param name: Directory name.
+    :type name: str
+
+    :param items: Directory objects. See :func:`store` for details.
+    :type items: iterable
+
+    :param batch_size: Number of objects taken from `items` at once.
+    :type batch_size: int
+
+    :param concurrency: Number of concurrent requests.
+    :type concurrency: int
+
+    :returns: List of object ids in same order as `items` and final directory
+              version. If some object couldn't be stored, first error is
+              raised after the rest of objects in batch were processed.
+              Ids of objects stored so far and directory version are kept
+              in its `ids` and `version` attributes, with ``None`` in place
+              of objects that failed.
+    :rtype: tuple
+    """
+    ids = []
+    version = None
+    for batch in batches(items, batch_size):
+        results = [None] * len(batch)
+        errors = []
+        tasks = iter(enumerate(batch))
+        lock = threading.Lock()
+        def worker():
+            while True:
+                with lock:
+                    try:
+                        pos, item = tasks.next()
+                    except StopIteration:
+                        return
+                try:
+                    results[pos] = store(session, name, item)
+                except Exception, err:
+                    errors.append(err)
+        threads = [threading.Thread(target=worker)
+                   for idx in xrange(min(concurrency, len(batch)) - 1)]
+        for thread in threads:
+            thread.start()
+        worker()
+        for thread in threads:
+            thread.join()
+        for result in results:
+            if result is None:
+                ids.append(None)
+                continue
+            ids.append(result[0])
+            version = max(version, result[1])
+        if errors:
+            err = errors[0]
+            err.ids, err.version = ids, version
+            raise err
+    return ids, version
+
+def remove(session, name, ids, batch_size=None):
     """Marks directory objects as removed. This is not actual removing, but
     hiding objects from user sight.
 
@@ -159,21 +332,26 @@ def remove(session, name, ids):
     :param ids: List of object ids to remove.
     :type ids: list
 
+    :param batch_size: Maximum number of ids per request. By default all of
+                       them are sent with single one.
+    :type batch_size: int
+
     :returns: New directory version.
-    :rtype: str
+    :rtype: int
     """
-    ids = maybe_item_or_ids(ids)
-    content = DirectoryRemove(directory=name, ids=ids)
-    if name in DIRS_FOR_NEW_PROC:
-        msg = content.to_message(type='directory-remove-new')
-        resp = session.request(body=msg)
-        return resp.content['version']
-    else:
-        msg = content.to_message(type='directory-remove')
-        resp = session.request(body=msg)
-        return resp['version']
-
-def restore(session, name, ids):
+    version = None
+    for batch in batches(maybe_item_or_ids(ids), batch_size):
+        content = DirectoryRemove(directory=name, ids=batch)
+        if name in DIRS_FOR_NEW_PROC:
+            msg = content.to_message(type='directory-remove-new')
+            version = session.request(body=msg).content['version']
+        else:
+            msg = content.to_message(type='directory-remove')
+            version = session.request(body=msg, wrapper=remove_version)
+    session.invalidate(*CACHED_REQUESTS)
+    return version
+
+def restore(session, name, ids, batch_size=None):
     """Restores removed directory objects.
 
     :param session: Active session instance.
@@ -185,12 +363,17 @@ def restore(session, name, ids):
     :param ids: List of object ids to restore.
     :type ids: list
 
+    :param batch_size: Maximum number of ids per request. By default all of
+                       them are sent with single one.
+    :type batch_size: int
+
     :returns: True
     :rtype: bool
     """
-    ids = maybe_item_or_ids(ids)
-    message = DirectoryRestore(directory=name, ids=ids)
-    session.request(body=message)
+    for batch in batches(maybe_item_or_ids(ids), batch_size):
+        content = DirectoryRestore(directory=name, ids=batch)
+        session.request(body=content.to_message(type='directory-restore'))
+    session.invalidate(*CACHED_REQUESTS)
     return True
 
 def changes(session, init_versions=None, timeout=10):
@@ -7,16 +7,42 @@
 # you should have received as part of this distribution.
 #
 
+import base64
+import os
+import threading
 import time
 from cStringIO import StringIO
+from phoxpy import columnar
+from phoxpy import xml
+from phoxpy.messages import CONTENT_DEPTH, ITEMS_DEPTH, PhoxResponse
 from phoxpy.scheme.journal import RegistrationJournalFilter, RegistrationJournal
 from phoxpy.scheme.requests import RequestInfo, RequestSamples, PrintRequestOld
 
 
-__all__ = ['load', 'select', 'changes', 'samples', 'report']
+__all__ = ['load', 'select', 'select_table', 'changes', 'samples', 'report',
+           'save_report', 'report_many', 'decode_base64']
 
+#: Supported report formats by their ids.
+REPORT_FORMATS = [None, 'fp3', 'pdf']
 
-def load(session, idx):
+#: Number of base64 characters decoded at once while saving report.
+REPORT_CHUNK_SIZE = 64 * 1024
+
+
+def projection(fields, depth, raw=()):
+    """Returns response wrapper which decodes only `fields` of objects at
+    `depth` or ``None`` if `fields` are not specified. Values of `raw` fields
+    are passed through as byte strings."""
+    if fields is None:
+        return None
+    def wrapper(stream):
+        stream = xml.project(stream, fields, depth)
+        if raw:
+            stream = xml.passthrough(stream, raw)
+        return PhoxResponse.to_python(stream)
+    return wrapper
+
+def load(session, idx, fields=None):
     """Loads request information by provided id.
 
     :param session: Active session instance.
@@ -25,17 +51,21 @@ def load(session, idx):
     :param idx: Request id.
     :type idx: str
 
+    :param fields: Names of request information fields to load. Other ones
+                   are skipped while response decoding.
+    :type fields: list
+
     :returns: Request information.
     :rtype: dict
     """
     msg = RequestInfo(request=idx).to_message(type='request-info')
-    resp = session.request(body=msg)
+    resp = session.request(body=msg, wrapper=projection(fields, CONTENT_DEPTH))
     data = resp.unwrap()
     data.pop('sessionid', None)
     data.pop('buildnumber', None)
     return data
 
-def select(session, filter=None, **options):
+def select(session, filter=None, fields=None, **options):
     """Selects requests from registration journal.
 
     :param session: Active session instance.
@@ -44,6 +74,10 @@ def select(session, filter=None, **options):
     :param filter: Predefined requests filter.
     :type filter: :class:`~phoxpy.modules.requests.RegistrationJournalFilter`
 
+    :param fields: Names of rows fields to load. Other ones are skipped while
+                   response decoding. If omitted, all fields are loaded.
+    :type fields: list
+
     :param options: Custom additional filter options. See
                     :class:`~phoxpy.modules.requests.RegistrationJournalFilter`
                     for supported keys.
@@ -56,10 +90,34 @@ def select(session, filter=None, **options):
     else:
         filter.update(options)
     msg = RegistrationJournal(filter=filter).to_message(type='registration-journal')
-    resp = session.request(body=msg)
+    resp = session.request(body=msg, wrapper=projection(fields, ITEMS_DEPTH))
     for row in resp['Request']:
         yield row
 
+def select_table(session, filter=None, fields=None, **options):
+    """Selects requests from registration journal as columnar table.
+
+    :param session: Active session instance.
+    :type session: :class:`~phoxpy.client.Session`
+
+    :param filter: Predefined requests filter.
+    :type filter: :class:`~phoxpy.modules.requests.RegistrationJournalFilter`
+
+    :param fields: Table columns. See :func:`~phoxpy.columnar.build` for
+                   details.
+
+    :param options: Custom additional filter options.
+
+    :rtype: :class:`~phoxpy.columnar.Table`
+    """
+    if filter is None:
+        filter = RegistrationJournalFilter(**options)
+    else:
+        filter.update(options)
+    msg = RegistrationJournal(filter=filter).to_message(type='registration-journal')
+    wrapper = lambda stream: columnar.build(stream, 'Request', fields)
+    return session.request(body=msg, wrapper=wrapper)
+
 def samples(session, idx):
     """Retrieves short information about request samples.
 
@@ -92,15 +150,51 @@ def changes(session,  timestamp=0, timeout=10):
 
     :yields: Registration journal rows as dict.
     """
+    # timestamps have seconds resolution, so rows changed within the same
+    # second share them and are told apart by ids
+    seen = set()
     while True:
         for item in select(session, last_timestamp=timestamp):
             if timestamp < item['timestamp']:
                 timestamp = item['timestamp']
-                yield item
+                seen = set()
+            elif item['timestamp'] < timestamp or item['id'] in seen:
+                continue
+            seen.add(item['id'])
+            yield item
         time.sleep(timeout)
 
-def report(session, idx, format='fp3'):
-    """Produces request report as PDF or FastReport prepared template file.
+def decode_base64(data, write, chunk_size=REPORT_CHUNK_SIZE):
+    """Decodes base64 `data` by chunks passing them to `write` callable, so
+    decoded data is never held as a whole. Whitespaces are ignored.
+
+    :returns: Number of decoded bytes.
+    :rtype: int
+
+    >>> chunks = []
+    >>> decode_base64('UGhv eHB5', chunks.append, 4)
+    6
+    >>> chunks
+    ['Pho', 'xpy']
+    """
+    size = 0
+    tail = ''
+    for pos in xrange(0, len(data), chunk_size):
+        chunk = tail + ''.join(str(data[pos:pos + chunk_size]).split())
+        border = len(chunk) - len(chunk) % 4
+        tail = chunk[border:]
+        if border:
+            decoded = base64.b64decode(chunk[:border])
+            size += len(decoded)
+            write(decoded)
+    if tail:
+        raise ValueError('incomplete base64 data')
+    return size
+
+def save_report(session, idx, output, format='fp3'):
+    """Produces request report and writes it to `output`. Base64 encoded
+    report is the only field decoded from response and it is written to
+    `output` by chunks as it's decoded.
 
     .. warning:: For LIS print-server only!
 
@@ -110,18 +204,117 @@ def report(session, idx, format='fp3'):
     :param idx: Request id.
     :type idx: str
 
+    :param output: File-like object or callable which takes chunks of report.
+
     :param format: Report file format. Possible values are ``fp3`` or ``pdf``.
     :type format: str
 
-    :return: File-like object.
-    :rtype: :func:`~cStringIO.StringIO`
+    :returns: Report size in bytes.
+    :rtype: int
     """
-    formats = [None, 'fp3', 'pdf']
-    if format is not None and format in formats:
-        formatid = formats.index(format)
+    if format is not None and format in REPORT_FORMATS:
+        formatid = REPORT_FORMATS.index(format)
     else:
         raise ValueError('unsupported format %s' % format)
     msg = PrintRequestOld(result={'request': idx, 'format': formatid})
     msg = msg.to_message(type='print-request-old')
-    resp = session.request(body=msg)
-    return StringIO(resp['base64String'])
+    fields = ['base64String']
+    resp = session.request(body=msg,
+                           wrapper=projection(fields, CONTENT_DEPTH, fields))
+    write = output.write if hasattr(output, 'write') else output
+    return decode_base64(resp['base64String'], write)
+
+def report_many(session, ids, output, format='pdf', concurrency=4):
+    """Produces reports for many requests with concurrent requests. Each of
+    them is written to own file as soon as it's received, so only
+    `concurrency` reports are held in memory at once and `ids` may be
+    a generator of any length.
+
+    .. warning:: For LIS print-server only!
+
+    :param session: Active session instance or pool of them. Pooled sessions
+                    serve requests in parallel.
+    :type session: :class:`~phoxpy.client.Session` or
+                   :class:`~phoxpy.client.SessionPool`
+
+    :param ids: Request ids.
+    :type ids: iterable
+
+    :param output: Directory to store reports as ``<id>.<format>`` files or
+                   callable which takes request id and returns file-like
+                   object to write report to. Files are closed after report
+                   is written.
+    :type output: str or callable
+
+    :param format: Report file format. Possible values are ``fp3`` or ``pdf``.
+    :type format: str
+
+    :param concurrency: Number of concurrent requests.
+    :type concurrency: int
+
+    :returns: Request ids mapped to report sizes. If some report couldn't be
+              produced, first error is raised after the rest of them were
+              processed.
+    :rtype: dict
+    """
+    if format not in REPORT_FORMATS[1:]:
+        raise ValueError('unsupported format %s' % format)
+    if isinstance(output, basestring):
+        path = output
+        output = lambda idx: open(os.path.join(path, '%s.%s' % (idx, format)),
+                                  'wb')
+    if hasattr(session, 'call'):
+        fetch = lambda *args: session.call(save_report, *args)
+    else:
+        fetch = lambda *args: save_report(session, *args)
+    results = {}
+    errors = []
+    tasks = iter(ids)
+    lock = threading.Lock()
+    def worker():
+        while True:
+            with lock:
+                try:
+                    idx = tasks.next()
+                except StopIteration:
+                    return
+            try:
+                fileobj = output(idx)
+                try:
+                    results[idx] = fetch(idx, fileobj, format)
+                finally:
+                    fileobj.close()
+            except Exception, err:
+                errors.append(err)
+    threads = [threading.Thread(target=worker)
+               for idx in xrange(max(concurrency, 1) - 1)]
+    for thread in threads:
+        thread.start()
+    worker()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return results
+
+def report(session, idx, format='fp3'):
+    """Produces request report as PDF or FastReport prepared template file.
+
+    .. warning:: For LIS print-server only!
+
+    :param session: Active session instance.
+    :type session: :class:`~phoxpy.client.Session`
+
+    :param idx: Request id.
+    :type idx: str
+
+    :param format: Report file format. Possible values are ``fp3`` or ``pdf``.
+    :type format: str
+
+    :return: File-like object with decoded report.
+    :rtype: :func:`~cStringIO.StringIO`
+    """
+    output = StringIO()
+    save_report(session, idx, output, format)
+    output.seek(0)
+    return output
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011 Alexander Shorin
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+"""Parallel decoding of large XML sequences in the pool of processes."""
+
+import atexit
+import multiprocessing
+import re
+import threading
+from itertools import chain
+from . import xml
+
+__all__ = ['ParallelDecoder', 'split', 'split_blocks', 'decode_chunk',
+           'default_decoder']
+
+#: Amount of data in bytes read from XML source at once while it's split.
+BLOCK_SIZE = 64 * 1024
+
+# each markup construct of well-formed document matches some alternative,
+# so lone ``<`` is incomplete markup which needs more data
+_TAG_RE = re.compile(r'<!--.*?-->|<!\[CDATA\[.*?\]\]>|<\?.*?\?>'
+                     r'|<!(?!--|\[CDATA\[)[^>]*>'
+                     r'|<(/?)([A-Za-z_][\w.:-]*)'
+                     r'([^>"\']*(?:(?:"[^"]*"|\'[^\']*\')[^>"\']*)*)>'
+                     r'|(<)', re.S)
+_ENCODING_RE = re.compile(r'<\?xml[^>]*encoding=["\']([\w.:-]+)["\']')
+
+
+def split(data, chunk_size=1000, min_items=None):
+    """Splits raw XML data at top level items of outermost sequences.
+
+    Data is scanned for tags only, without full parsing. Sequences with less
+    than `min_items` items are left in place.
+
+    :param data: XML data.
+    :type data: str
+
+    :param chunk_size: Number of items in single chunk.
+    :type chunk_size: int
+
+    :param min_items: Minimal number of items in sequence to split it.
+                      Defaults to `chunk_size`.
+    :type min_items: int
+
+    :return: 2-element tuple: XML skeleton where split sequences are emptied
+             and marked by :data:`~phoxpy.xml.PART_ATTR` attribute with
+             their index, and list of chunks lists for each split sequence.
+    :rtype: tuple
+
+    >>> skeleton, parts = split('<o><s n="a"><f v="1"/><f v="2"/>'
+    ...                         '<f v="3"/></s></o>', 2)
+    >>> skeleton
+    '<o><s n="a" phoxpy-part="0"></s></o>'
+    >>> parts
+    [['<f v="1"/><f v="2"/>', '<f v="3"/>']]
+    """
+    parts = []
+    def add_chunk(idx, chunk):
+        if idx == len(parts):
+            parts.append([])
+        parts[idx].append(chunk)
+    skeleton = split_blocks([data], add_chunk, chunk_size, min_items)
+    return skeleton, parts
+
+
+def split_blocks(blocks, add_chunk, chunk_size=1000, min_items=None):
+    """Splits XML data like :func:`split` does, but reads it by blocks and
+    passes each chunk to `add_chunk` as soon as it's complete. Only the
+    skeleton and data of unfinished chunk are kept in memory.
+
+    :param blocks: Iterable of XML data blocks.
+
+    :param add_chunk: Callable which receives index of split sequence and
+                      its next chunk.
+
+    :return: XML skeleton.
+    :rtype: str
+    """
+    if min_items is None:
+        min_items = chunk_size
+    blocks = iter(blocks)
+    skeleton = []
+    buf = ''
+    base = 0 # offset of buffer in the whole data
+    pos = 0
+    prev = 0
+    eof = False
+    depth = 0
+    seq_depth = None
+    part = None
+    parts = 0
+    while True:
+        incomplete = None
+        for match in _TAG_RE.finditer(buf, pos - base):
+            closing, tag, attrs, lone = match.groups()
+            if lone is not None:
+                if eof:
+                    continue
+                incomplete = match.start()
+                break
+            if tag is None:
+                continue
+            if closing:
+                depth -= 1
+                if seq_depth is None:
+                    continue
+                if depth == seq_depth + 1:
+                    ends.append(base + match.end())
+                elif depth == seq_depth:
+                    seq_depth = None
+                    if part is None and len(ends) < min_items:
+                        continue
+                    if part is None:
+                        part = parts
+                        parts += 1
+                        skeleton.append(buf[prev - base:start - base - 1])
+                        skeleton.append(' %s="%d">' % (xml.PART_ATTR, part))
+                    add_chunk(part, buf[start - base:match.start()])
+                    part = None
+                    prev = base + match.start()
+                    continue
+            elif attrs.endswith('/'):
+                if seq_depth is not None and depth == seq_depth + 1:
+                    ends.append(base + match.end())
+            else:
+                if seq_depth is None and tag == 's':
+                    seq_depth = depth
+                    start = base + match.end()
+                    ends = []
+                depth += 1
+                continue
+            if seq_depth is None:
+                continue
+            if part is None and len(ends) >= min_items:
+                part = parts
+                parts += 1
+                skeleton.append(buf[prev - base:start - base - 1])
+                skeleton.append(' %s="%d">' % (xml.PART_ATTR, part))
+            # chunk is complete when next item ends, the last one takes the
+            # rest of sequence
+            while part is not None and len(ends) > chunk_size:
+                add_chunk(part, buf[start - base:ends[chunk_size - 1] - base])
+                start = ends[chunk_size - 1]
+                del ends[:chunk_size]
+        if eof:
+            break
+        # scan is resumed from incomplete markup which is kept to be matched
+        # with next block
+        pos = base + (len(buf) if incomplete is None else incomplete)
+        if seq_depth is None:
+            skeleton.append(buf[prev - base:pos - base])
+            prev = pos
+        keep = prev if part is None else start
+        buf = buf[keep - base:]
+        base = keep
+        data = next(blocks, '')
+        eof = not data
+        buf += data
+    skeleton.append(buf[prev - base:])
+    return ''.join(skeleton)
+
+
+def decode_chunk(args):
+    """Decodes chunk of sequence items. Runs in pool worker process.
+
+    :param args: 2-element tuple of XML encoding and items source.
+
+    :return: List of decoded items.
+    """
+    encoding, chunk = args
+    xmlsrc = ('<?xml version="1.0" encoding="%s"?><s>%s</s>'
+              '' % (encoding, chunk))
+    # interned values are pickled by reference, so results are sent back
+    # faster
+    return list(xml.decode(xmlsrc, intern=True))
+
+
+class ParallelDecoder(object):
+    """Decodes large XML sequences in the pool of processes.
+
+    XML codecs are written in pure Python and decoding runs on single core,
+    while parsing itself is cheap. Decoder splits raw XML data at top level
+    items of large sequences, decodes chunks of them in parallel and passes
+    decoded items to the codecs of the rest document in the original order.
+
+    :param processes: Number of worker processes. Defaults to CPU count.
+    :type processes: int
+
+    :param chunk_size: Number of sequence items to decode by single task.
+    :type chunk_size: int
+
+    :param min_items: Minimal number of items in sequence to decode it in
+                      parallel. Defaults to `chunk_size`.
+    :type min_items: int
+    """
+    def __init__(self, processes=None, chunk_size=1000, min_items=None):
+        self.processes = processes
+        self.chunk_size = chunk_size
+        self.min_items = min_items
+        self._pool = None
+        self._lock = threading.Lock()
+
+    @property
+    def pool(self):
+        """Pool of worker processes. It's started on first access."""
+        with self._lock:
+            if self._pool is None:
+                self._pool = multiprocessing.Pool(self.processes)
+            return self._pool
+
+    def close(self):
+        """Stops worker processes."""
+        with self._lock:
+            if self._pool is not None:
+                self._pool.terminate()
+                self._pool.join()
+                self._pool = None
+
+    def make_stream(self, xmlsrc, intern=None, lazy=False):
+        """Wraps XML source to events stream like
+        :func:`~phoxpy.xml.make_stream` does, but large sequences are
+        decoded in worker processes.
+
+        :param xmlsrc: XML data or file-like object.
+
+        File-like source is read by blocks and chunks of items are sent to
+        workers while the rest of data is being read. Objects decoded in
+        worker processes are never lazy.
+        """
+        if hasattr(xmlsrc, 'read'):
+            blocks = iter(lambda: xmlsrc.read(BLOCK_SIZE), '')
+        else:
+            blocks = iter([xmlsrc])
+        head = next(blocks, '')
+        match = _ENCODING_RE.match(head)
+        encoding = match and match.group(1) or 'utf-8'
+        results = {}
+        def add_chunk(idx, chunk):
+            task = self.pool.apply_async(decode_chunk, ((encoding, chunk),))
+            results.setdefault(str(idx), []).append(task)
+        skeleton = split_blocks(chain([head], blocks), add_chunk,
+                                self.chunk_size, self.min_items)
+        stream = xml.make_stream(skeleton, intern, lazy)
+        if not results:
+            return stream
+        if not isinstance(stream, xml.Stream):
+            stream = xml.Stream(stream)
+        stream.parts = dict((idx, (task.get() for task in tasks))
+                            for idx, tasks in results.items())
+        return stream
+
+
+_default_decoder = None
+
+def default_decoder():
+    """Returns :class:`ParallelDecoder` shared by all sessions. Its worker
+    processes are stopped at interpreter exit."""
+    global _default_decoder
+    if _default_decoder is None:
+        _default_decoder = ParallelDecoder()
+        atexit.register(_default_decoder.close)
+    return _default_decoder
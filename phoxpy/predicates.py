@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011 Alexander Shorin
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+"""Predicates for filtering decoded objects.
+
+>>> match = (F('code') == 'A1') & F('price').between(10, 20)
+>>> match({'code': 'A1', 'price': 15})
+True
+>>> match({'code': 'A1', 'price': 25})
+False
+>>> match = F('id').in_(['1', '2']) & ~F('removed')
+>>> match({'id': '1', 'removed': True})
+False
+>>> sorted(match.ids())
+['1', '2']
+"""
+
+import operator
+
+__all__ = ['Predicate', 'Field', 'F']
+
+
+class Predicate(object):
+    """Compiled condition over object fields. Predicates are combined with
+    ``&``, ``|`` and ``~`` operators and called with object to match.
+
+    :param test: Callable which takes object and returns matching result.
+
+    :param fields: Names of fields used by the `test`.
+    :type fields: frozenset
+    """
+    def __init__(self, test, fields=frozenset()):
+        self.test = test
+        self.fields = frozenset(fields)
+
+    def __call__(self, obj):
+        return bool(self.test(obj))
+
+    def __and__(self, other):
+        left, right = self.test, other.test
+        return And(lambda obj: left(obj) and right(obj),
+                   self.fields | other.fields, [self, other])
+
+    def __or__(self, other):
+        left, right = self.test, other.test
+        return Or(lambda obj: left(obj) or right(obj),
+                  self.fields | other.fields, [self, other])
+
+    def __invert__(self):
+        test = self.test
+        return Predicate(lambda obj: not test(obj), self.fields)
+
+    def ids(self):
+        """Returns set of object ids which only could match or ``None`` if
+        predicate doesn't restrict them."""
+        return None
+
+
+class IdPredicate(Predicate):
+    """Predicate which matches objects with ids from set."""
+    def __init__(self, test, ids):
+        super(IdPredicate, self).__init__(test, ['id'])
+        self._ids = frozenset(ids)
+
+    def ids(self):
+        return self._ids
+
+
+class And(Predicate):
+    def __init__(self, test, fields, parts):
+        super(And, self).__init__(test, fields)
+        self.parts = parts
+
+    def ids(self):
+        result = None
+        for part in self.parts:
+            ids = part.ids()
+            if ids is None:
+                continue
+            result = ids if result is None else result & ids
+        return result
+
+
+class Or(And):
+    def ids(self):
+        result = frozenset()
+        for part in self.parts:
+            ids = part.ids()
+            if ids is None:
+                return None
+            result |= ids
+        return result
+
+
+class Field(object):
+    """Object field reference which builds predicates by comparison.
+    Missed fields have ``None`` value.
+
+    :param name: Field name.
+    :type name: str
+    """
+    def __init__(self, name):
+        self.name = name
+
+    def _compare(self, op, value):
+        name = self.name
+        def test(obj):
+            field = obj.get(name)
+            return field is not None and op(field, value)
+        return Predicate(test, [name])
+
+    def __eq__(self, value):
+        name = self.name
+        test = lambda obj: obj.get(name) == value
+        if name == 'id':
+            return IdPredicate(test, [value])
+        return Predicate(test, [name])
+
+    def __ne__(self, value):
+        return ~(self == value)
+
+    def __lt__(self, value):
+        return self._compare(operator.lt, value)
+
+    def __le__(self, value):
+        return self._compare(operator.le, value)
+
+    def __gt__(self, value):
+        return self._compare(operator.gt, value)
+
+    def __ge__(self, value):
+        return self._compare(operator.ge, value)
+
+    def __invert__(self):
+        name = self.name
+        return Predicate(lambda obj: not obj.get(name), [name])
+
+    def in_(self, values):
+        """Matches if field value is one of `values`."""
+        name = self.name
+        values = frozenset(values)
+        test = lambda obj: obj.get(name) in values
+        if name == 'id':
+            return IdPredicate(test, values)
+        return Predicate(test, [name])
+
+    def between(self, low=None, high=None):
+        """Matches if field value is in range from `low` to `high`
+        inclusively. ``None`` means unbounded."""
+        name = self.name
+        def test(obj):
+            value = obj.get(name)
+            return (value is not None
+                    and (low is None or low <= value)
+                    and (high is None or value <= high))
+        return Predicate(test, [name])
+
+    def contains(self, *values):
+        """Matches if field sequence, like list of references, holds any of
+        `values`."""
+        name = self.name
+        values = frozenset(values)
+        test = lambda obj: not values.isdisjoint(obj.get(name) or ())
+        return Predicate(test, [name])
+
+    def exists(self):
+        """Matches if field is set."""
+        name = self.name
+        return Predicate(lambda obj: obj.get(name) is not None, [name])
+
+#: Shortcut for :class:`Field`.
+F = Field
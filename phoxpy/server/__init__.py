@@ -8,6 +8,7 @@
 #
 
 from cStringIO import StringIO
+from phoxpy import http
 from phoxpy.server.auth import AuthExt
 from phoxpy.server.directory import DirectoryExt
 from phoxpy.server.options import OptionsExt
@@ -16,11 +17,12 @@ from phoxpy.server.main import BaseLisServer
 
 class MockHttpSession(object):
 
-    def __init__(self, server=None):
+    def __init__(self, server=None, retry_policy=None):
         self.server = server or SimpleLISServer('0.0', '00000')
+        self.retry_policy = retry_policy or http.RetryPolicy()
 
     def request(self, method, url, body=None, headers=None, credentials=None,
-                _num_redirects=0):
+                idempotent=None, _num_redirects=0):
         return 200, {}, StringIO(str(self.server.dispatch(body)))
 
 
@@ -11,7 +11,7 @@ import hashlib
 from random import randint
 from phoxpy import exceptions
 from phoxpy.messages import PhoxRequest, PhoxResponse
-from phoxpy.messages import auth
+from phoxpy.modules import auth
 from phoxpy.server.main import ServerExtension, request_type
 
 __all__ = ['AuthExt']
@@ -29,20 +29,34 @@ class AuthExt(ServerExtension):
         super(AuthExt, self).__init__(db)
 
     def get_session_id(self):
-        return str(randint(10000, 50000))
+        with self.lock:
+            while True:
+                sessionid = str(randint(10000, 50000))
+                if sessionid not in self.db['sessions']:
+                    return sessionid
 
     def add_license(self, key):
-        self.db['licenses'].add(key)
+        with self.lock:
+            self.db['licenses'].add(key)
 
     def add_user(self, login, password, secure=False):
         if secure:
             password = md5(password)
-        self.db['users'][login] = password
+        with self.lock:
+            self.db['users'][login] = password
+
+    def expire(self, sessionid=None):
+        """Drops specified session or all of them."""
+        with self.lock:
+            if sessionid is None:
+                self.db['sessions'].clear()
+            else:
+                self.db['sessions'].discard(sessionid)
 
     @request_type(auth.AuthRequest)
     def handle_login(self, request):
         if request['clientId'] not in self.db['licenses']:
-            raise exceptions.LicenseNotFound(request.client_id)
+            raise exceptions.LicenseNotFound(request['clientId'])
 
         if request['instanceCount'] is None:
             raise exceptions.LisBaseException(654)
@@ -53,20 +67,20 @@ class AuthExt(ServerExtension):
         if self.db['users'][request['login']] != request['password']:
             raise exceptions.AuthentificationError()
 
-        sessionid = self.get_session_id()
-        self.db['sessions'].add(sessionid)
+        with self.lock:
+            sessionid = self.get_session_id()
+            self.db['sessions'].add(sessionid)
 
-        return auth.AuthResponse(
+        return auth.AuthResponse().to_message(
             sessionid=sessionid,
-            buildnumber=self.build_number,
-            version=self.server_version
+            buildnumber=self.build_number
         )
 
     @request_type(PhoxRequest)
     def handle_logout(self, request):
-        if request.sessionid not in self.db['sessions']:
-            raise exceptions.UnknownSession()
-
-        self.db['sessions'].remove(request.sessionid)
+        with self.lock:
+            if request.sessionid not in self.db['sessions']:
+                raise exceptions.UnknownSession()
+            self.db['sessions'].remove(request.sessionid)
 
         return PhoxResponse(sessionid=request.sessionid)
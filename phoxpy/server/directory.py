@@ -7,74 +7,95 @@
 # you should have received as part of this distribution.
 #
 
-from random import randint
+import threading
 from phoxpy import xml
 from phoxpy import messages
 from phoxpy import exceptions
-from phoxpy.messages import directory
+from phoxpy.mapping import IntegerField, TextField
+from phoxpy.modules import directory
 from phoxpy.server.main import ServerExtension, request_type
+from phoxpy.server.storage import VersionedStore
+from phoxpy.xmlobjects import LazyObject
 
-__all__ = ['DirectoryExt', 'DirectoryItem']
+__all__ = ['DirectoryExt', 'DirectoryItem', 'DirectoryChanges']
 
-class DirectoryItem(object):
+class DirectoryChanges(messages.PhoxRequestContent):
+    """Content for mock server request type ``directory-changes``."""
 
-    def __init__(self, name, *items):
-        db = self._db = {}
-        db['name'] = name
-        db['version'] = 0
-        db['items'] = {}
-        for item in items:
-            self.update(item)
+    #: Directory data source name.
+    name = TextField()
+    #: Known directory version.
+    version = IntegerField()
 
-    def __getitem__(self, item):
-        return self.db['items'][item]
 
-    def __iter__(self):
-        return iter(self.keys())
+class DirectoryItem(VersionedStore):
+    """Single directory storage. Has own :attr:`lock`, so concurrent
+    requests to different directories don't block each other."""
 
-    def __contains__(self, item):
-        return item in self.db['items']
+    def __init__(self, name, *items):
+        super(DirectoryItem, self).__init__()
+        self.lock = threading.RLock()
+        self.name = name
+        if items:
+            self.set_many(items)
 
     def keys(self):
-        return self.db['items'].keys()
+        with self.lock:
+            return super(DirectoryItem, self).keys()
 
     def values(self):
-        return self.db['items'].values()
+        with self.lock:
+            return super(DirectoryItem, self).values()
 
     def items(self):
-        return self.db['items'].items()
+        with self.lock:
+            return super(DirectoryItem, self).items()
 
     def get(self, id_or_item):
-        if isinstance(id_or_item, dict):
+        if isinstance(id_or_item, (dict, LazyObject)):
             idx = id_or_item['id']
         else:
             idx = id_or_item
-        return self.db['items'][idx]
+        return self[idx]
 
     def set(self, item):
-        assert isinstance(item, dict)
-        if 'id' not in item:
-            item['id'] = str(randint(1, 10000))
-        self.db['items'][item['id']] = item
-        self.db['version'] += 1
-        return item['id'], self.version
+        """Stores single item as new directory version.
+
+        :return: Item id and new version.
+        """
+        with self.lock:
+            ids, version = self.commit([item])
+            return ids[0], version
+
+    def set_many(self, items):
+        """Stores batch of items as single new directory version.
+
+        :return: List of item ids and new version.
+        """
+        with self.lock:
+            return self.commit(items)
 
     def update(self, idx, **values):
-        item = self.get(idx)
-        item.update(values)
-        return self.set(item)
+        """Updates single item as new directory version.
 
-    @property
-    def db(self):
-        return self._db
+        :return: Item id and new version.
+        """
+        ids, version = self.update_many([idx], **values)
+        return ids[0], version
 
-    @property
-    def name(self):
-        return self._db['name']
+    def update_many(self, ids, **values):
+        """Updates batch of items as single new directory version.
 
-    @property
-    def version(self):
-        return self._db['version']
+        :return: List of item ids and new version.
+        """
+        with self.lock:
+            ids = list(ids)
+            return ids, super(DirectoryItem, self).update(ids, **values)
+
+    def changes(self, since):
+        with self.lock:
+            return super(DirectoryItem, self).changes(since)
+    changes.__doc__ = VersionedStore.changes.__doc__
 
 
 class DirectoryExt(ServerExtension):
@@ -86,8 +107,9 @@ class DirectoryExt(ServerExtension):
         return iter(self.db)
 
     def add(self, name, *items):
-        assert name not in self.db
-        self.db[name] = DirectoryItem(name)
+        with self.lock:
+            assert name not in self.db
+            self.db[name] = DirectoryItem(name)
         return self.update(name, *items)
 
     def get(self, name):
@@ -96,14 +118,13 @@ class DirectoryExt(ServerExtension):
         return self.db[name]
 
     def items(self):
-        return self.db.items()
+        with self.lock:
+            return self.db.items()
 
     def update(self, name, *items):
-        dirdb = self.get(name)
-        for item in items:
-            dirdb.set(item)
+        return self.get(name).set_many(items)
 
-    @request_type(directory.DirectoryVersions)
+    @request_type(messages.PhoxRequest)
     def handle_directory_versions(self, request):
         return messages.PhoxResponse(
             sessionid=request.sessionid,
@@ -119,14 +140,15 @@ class DirectoryExt(ServerExtension):
 
         dirdb = self.get(request['name'])
 
-        if ids:
-            items = [dirdb.get(idx) for idx in ids if idx in dirdb]
-        else:
-            items = dirdb.values()
-        data = {
-            'version': dirdb.version,
-            dirdb.name: items
-        }
+        with dirdb.lock:
+            if ids:
+                items = [dirdb.get(idx) for idx in ids if idx in dirdb]
+            else:
+                items = dirdb.values()
+            data = {
+                'version': dirdb.version,
+                dirdb.name: items
+            }
 
         return messages.PhoxResponse(
             sessionid = request.sessionid,
@@ -134,6 +156,22 @@ class DirectoryExt(ServerExtension):
             **data
         )
 
+    @request_type(DirectoryChanges)
+    def handle_directory_changes(self, request):
+        dirdb = self.get(request['name'])
+        with dirdb.lock:
+            ids = dirdb.changes(request.get('version') or 0)
+            if ids is None:
+                # changelog doesn't cover known version, all items are changed
+                ids = dirdb.keys()
+            version = dirdb.version
+        return messages.PhoxResponse(
+            sessionid=request.sessionid,
+            buildnumber=request.buildnumber,
+            version=version,
+            ids=ids
+        )
+
     def _directory_save(self, request):
         item = request['element']
         dirdb = self.get(request['directory'])
@@ -150,16 +188,14 @@ class DirectoryExt(ServerExtension):
     def handle_directory_save(self, request):
         return self._directory_save(request)
 
-    @request_type(directory.DirectorySaveNew)
+    @request_type(directory.DirectorySave)
     def handle_directory_save_new(self, request):
         return self._directory_save(request)
 
     @request_type(directory.DirectoryRemove)
     def handle_directory_remove(self, request):
         dirdb = self.get(request['directory'])
-        version = dirdb.version
-        for idx in request['ids']:
-            _, version = dirdb.update(idx, removed=True)
+        _, version = dirdb.update_many(request['ids'], removed=True)
         # we have to return this one
         root = xml.Element('phox-response', sessionid=request['sessionid'])
         content = xml.Element('content')
@@ -167,18 +203,14 @@ class DirectoryExt(ServerExtension):
         root.append(content)
         return xml.dump(root)
 
-    @request_type(directory.DirectoryRemoveNew)
+    @request_type(directory.DirectoryRemove)
     def handle_directory_remove_new(self, request):
         dirdb = self.get(request['directory'])
-        version = dirdb.version
-        for idx in request['ids']:
-            _, version = dirdb.update(idx, removed=True)
+        _, version = dirdb.update_many(request['ids'], removed=True)
         return messages.PhoxResponse(version=version)
 
     @request_type(directory.DirectoryRestore)
     def handle_directory_restore(self, request):
         dirdb = self.get(request['directory'])
-        version = dirdb.version
-        for idx in request['ids']:
-            _, version = dirdb.update(idx, removed=False)
+        _, version = dirdb.update_many(request['ids'], removed=False)
         return messages.PhoxResponse(version=version)
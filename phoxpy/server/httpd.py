@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011 Alexander Shorin
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+"""HTTP front end for mock LIS servers."""
+
+import socket
+import threading
+import zlib
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from phoxpy import exceptions
+from phoxpy.http import gzip_compress
+from phoxpy import xml
+from phoxpy.messages import PhoxResponse
+
+__all__ = ['LisRequestHandler', 'LisHTTPServer', 'ThreadedLisHTTPServer',
+           'serve']
+
+
+def error_response(err):
+    """Wraps :exc:`~phoxpy.exceptions.LisBaseException` instance into
+    ``phox-response`` error message source."""
+    root = xml.Element('phox-response')
+    root.append(xml.encode(err))
+    doctype = ('phox-response', 'SYSTEM', 'phox.dtd')
+    return xml.dump(root, doctype=doctype)
+
+
+class LisRequestHandler(BaseHTTPRequestHandler):
+    """Passes POSTed phox requests to the bound LIS server instance.
+
+    Speaks HTTP/1.1, so connections are kept alive until client asks to close
+    them, if server supports it. Request bodies are accepted both with
+    `Content-Length` and with `chunked` transfer encoding, plain or gzip and
+    deflate compressed. Responses are sent chunked if server ``chunk_size`` is
+    set and client supports it, and gzip compressed if server ``compress``
+    option is set and client accepts it.
+    """
+
+    server_version = 'PhoxPyMockLIS'
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.read_body()
+        self.send_body(self.dispatch(body))
+
+    def read_body(self):
+        """Reads request body data."""
+        if self.headers.getheader('transfer-encoding') == 'chunked':
+            data = ''.join(self.read_chunks())
+        else:
+            length = int(self.headers.getheader('content-length') or 0)
+            data = self.rfile.read(length)
+        if self.headers.getheader('content-encoding') in ('gzip', 'deflate'):
+            # auto detect gzip or zlib header
+            data = zlib.decompress(data, 32 + zlib.MAX_WBITS)
+        return data
+
+    def read_chunks(self):
+        """Yields chunks of request body sent with `chunked` transfer
+        encoding."""
+        while True:
+            line = self.rfile.readline()
+            size = int(line.split(';', 1)[0].strip(), 16)
+            if not size:
+                # skip trailers till the final crlf
+                while self.rfile.readline() not in ('\r\n', '\n', ''):
+                    pass
+                break
+            yield self.rfile.read(size)
+            self.rfile.readline() # crlf
+
+    def dispatch(self, body):
+        """Dispatches phox request to LIS server and returns response source.
+        LIS errors are converted to the ``error`` responses, any other ones
+        are reported as :exc:`~phoxpy.exceptions.UnknownError`."""
+        try:
+            resp = self.server.lis.dispatch(body)
+        except exceptions.LisBaseException, err:
+            return error_response(err)
+        except Exception, err:
+            self.log_error('%s: %s', type(err).__name__, err)
+            return error_response(exceptions.UnknownError(str(err)))
+        if isinstance(resp, PhoxResponse):
+            resp = str(resp)
+        return resp
+
+    def send_body(self, data, status=200):
+        """Sends response headers and data back to client."""
+        chunk_size = self.server.chunk_size
+        chunked = chunk_size and self.request_version == 'HTTP/1.1'
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/xml')
+        accept = self.headers.getheader('accept-encoding') or ''
+        if self.server.compress and 'gzip' in accept:
+            data = gzip_compress(data)
+            self.send_header('Content-Encoding', 'gzip')
+        if not self.server.keep_alive:
+            self.send_header('Connection', 'close')
+            self.close_connection = 1
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if not chunked:
+            self.write(data)
+            return
+        for idx in xrange(0, len(data), chunk_size):
+            chunk = data[idx:idx + chunk_size]
+            self.write('%x\r\n%s\r\n' % (len(chunk), chunk))
+        self.write('0\r\n\r\n')
+
+    def write(self, data):
+        """Writes response data to client."""
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class LisHTTPServer(HTTPServer):
+    """HTTP server which exposes :class:`~phoxpy.server.main.BaseLisServer`
+    instance to the network. Handles requests one by one, so connections
+    are closed after each response to not block other clients.
+
+    :param lis: LIS server instance.
+    :type lis: :class:`~phoxpy.server.main.BaseLisServer`
+
+    :param address: Host and port pair to bind. Port ``0`` means any free one.
+    :type address: tuple
+
+    :param handler: Request handler class.
+
+    :param chunk_size: Send responses with `chunked` transfer encoding
+                       splitting data by specified amount of bytes.
+    :type chunk_size: int
+
+    :param verbose: Log each handled request to stderr.
+    :type verbose: bool
+
+    :param compress: Send gzip compressed responses to clients which accept
+                     them.
+    :type compress: bool
+    """
+    allow_reuse_address = True
+    request_queue_size = 128
+    #: Keep connections alive between requests.
+    keep_alive = False
+
+    def __init__(self, lis, address=('127.0.0.1', 0),
+                 handler=LisRequestHandler, chunk_size=None, verbose=False,
+                 compress=False):
+        HTTPServer.__init__(self, address, handler)
+        self.lis = lis
+        self.chunk_size = chunk_size
+        self.verbose = verbose
+        self.compress = compress
+
+    @property
+    def url(self):
+        """Server base URL."""
+        host, port = self.server_address[:2]
+        return 'http://%s:%d' % (host, port)
+
+
+class ThreadedLisHTTPServer(ThreadingMixIn, LisHTTPServer):
+    """:class:`LisHTTPServer` which handles each connection in separate
+    thread. Kept alive connections are shut down by :meth:`server_close`, so
+    their threads don't outlive the server waiting for the next request."""
+    daemon_threads = True
+    keep_alive = True
+
+    def __init__(self, *args, **kwargs):
+        LisHTTPServer.__init__(self, *args, **kwargs)
+        self._connections = set()
+        self._connections_lock = threading.Lock()
+
+    def process_request_thread(self, request, client_address):
+        with self._connections_lock:
+            self._connections.add(request)
+        try:
+            ThreadingMixIn.process_request_thread(self, request,
+                                                  client_address)
+        finally:
+            with self._connections_lock:
+                self._connections.discard(request)
+
+    def server_close(self):
+        LisHTTPServer.server_close(self)
+        with self._connections_lock:
+            connections = list(self._connections)
+        for conn in connections:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+
+def serve(lis, host='127.0.0.1', port=0, threaded=True, **options):
+    """Runs LIS server forever on specified address.
+
+    :param lis: LIS server instance.
+    :type lis: :class:`~phoxpy.server.main.BaseLisServer`
+
+    :param threaded: Handle connections in separate threads.
+    :type threaded: bool
+    """
+    if threaded:
+        cls = ThreadedLisHTTPServer
+    else:
+        cls = LisHTTPServer
+    httpd = cls(lis, (host, port), **options)
+    try:
+        httpd.serve_forever()
+    finally:
+        httpd.server_close()
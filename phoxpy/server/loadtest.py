@@ -0,0 +1,362 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011 Alexander Shorin
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+"""Load testing harness which drives many concurrent client sessions against
+:class:`~phoxpy.server.SimpleLISServer` exposed via real HTTP listener."""
+
+import math
+import random
+import socket
+import threading
+import time
+from phoxpy import client
+from phoxpy import http
+from phoxpy.modules import directory, requests
+from phoxpy.modules.auth import login, logout
+from phoxpy.server import SimpleLISServer
+from phoxpy.server.httpd import LisRequestHandler, ThreadedLisHTTPServer
+
+__all__ = ['FaultyRequestHandler', 'LoadTest', 'LoadTestReport',
+           'DEFAULT_MIX', 'percentile']
+
+#: Default operations mix as name to weight mapping.
+DEFAULT_MIX = {
+    'login': 1,
+    'directory-load': 4,
+    'directory-store': 2,
+    'request-info': 8,
+    'registration-journal': 2,
+}
+
+
+def percentile(values, pct):
+    """Returns `pct` percentile of `values` using nearest-rank method.
+
+    >>> percentile([1, 2, 3, 4, 5, 6, 7, 8, 9, 10], 90)
+    9
+    >>> percentile([], 50) is None
+    True
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    rank = int(math.ceil(pct / 100.0 * len(values))) - 1
+    return values[max(0, min(rank, len(values) - 1))]
+
+
+class FaultyRequestHandler(LisRequestHandler):
+    """Request handler which injects latency, bandwidth limits and errors
+    according to the ``faults`` options of the server instance."""
+
+    def dispatch(self, body):
+        faults = self.server.faults
+        if faults['latency']:
+            time.sleep(faults['latency'])
+        return LisRequestHandler.dispatch(self, body)
+
+    def send_body(self, data, status=200):
+        faults = self.server.faults
+        dice = faults['random'].random()
+        if dice < faults['drop_rate']:
+            self.close_connection = 1
+            self.wfile.flush()
+            self.connection.shutdown(socket.SHUT_RDWR)
+            return
+        if dice < faults['drop_rate'] + faults['error_rate']:
+            data, status = 'Injected server error', 500
+        LisRequestHandler.send_body(self, data, status)
+
+    def write(self, data):
+        bandwidth = self.server.faults['bandwidth']
+        if not bandwidth:
+            return LisRequestHandler.write(self, data)
+        # send data by 1/10 second portions
+        step = max(1, bandwidth // 10)
+        for idx in xrange(0, len(data), step):
+            chunk = data[idx:idx + step]
+            self.wfile.write(chunk)
+            time.sleep(len(chunk) / float(bandwidth))
+
+
+class LoadTestReport(object):
+    """Collects operation timings and errors of load test run."""
+
+    #: Reported percentiles.
+    percentiles = (50, 90, 95, 99)
+
+    def __init__(self):
+        self.timings = {}
+        self.errors = {}
+        self.elapsed = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, operation, seconds):
+        """Records succeeded `operation` timing."""
+        with self._lock:
+            self.timings.setdefault(operation, []).append(seconds)
+
+    def add_error(self, operation, err):
+        """Records failed `operation` with error instance."""
+        key = (operation, type(err).__name__)
+        with self._lock:
+            self.errors[key] = self.errors.get(key, 0) + 1
+
+    @property
+    def total(self):
+        """Total number of succeeded operations."""
+        return sum(map(len, self.timings.values()))
+
+    @property
+    def failed(self):
+        """Total number of failed operations."""
+        return sum(self.errors.values())
+
+    @property
+    def throughput(self):
+        """Succeeded operations per second."""
+        if not self.elapsed:
+            return 0.0
+        return self.total / self.elapsed
+
+    def latency(self, operation=None):
+        """Returns latency percentiles for `operation` or for all of them
+        as mapping of percentile to seconds."""
+        if operation is None:
+            values = sum(self.timings.values(), [])
+        else:
+            values = self.timings.get(operation, [])
+        return dict((pct, percentile(values, pct)) for pct in self.percentiles)
+
+    def summary(self):
+        """Returns human readable report as string."""
+        header = ['operation', 'count'] + ['p%d' % p for p in self.percentiles]
+        lines = ['%-24s' % header[0] + ''.join('%10s' % h for h in header[1:])]
+        rows = sorted(self.timings.items()) + [(None, None)]
+        for operation, values in rows:
+            if operation is None:
+                name, count = 'total', self.total
+            else:
+                name, count = operation, len(values)
+            latency = self.latency(operation)
+            cells = ['%10s' % '-' if latency[p] is None
+                     else '%10.1f' % (latency[p] * 1000)
+                     for p in self.percentiles]
+            lines.append('%-24s%10d' % (name, count) + ''.join(cells))
+        lines.append('')
+        lines.append('elapsed: %.3f s, throughput: %.1f ops/s, failed: %d'
+                     '' % (self.elapsed, self.throughput, self.failed))
+        for (operation, errname), count in sorted(self.errors.items()):
+            lines.append('  %s: %s x %d' % (operation, errname, count))
+        return '\n'.join(lines)
+
+
+class LoadTest(object):
+    """Runs mixed phox requests workload against local mock LIS server.
+
+    :param workers: Number of concurrent worker threads. Each worker holds
+                    own authorized :class:`~phoxpy.client.Session`.
+    :type workers: int
+
+    :param operations: Total number of operations to run across all workers.
+    :type operations: int
+
+    :param mix: Operations mix as name to weight mapping.
+                See :data:`DEFAULT_MIX` for supported operations.
+    :type mix: dict
+
+    :param latency: Injected server latency per request in seconds.
+    :type latency: float
+
+    :param bandwidth: Server response bandwidth limit in bytes per second.
+    :type bandwidth: int
+
+    :param error_rate: Probability of ``500`` HTTP error response.
+    :type error_rate: float
+
+    :param drop_rate: Probability of connection drop instead of response.
+    :type drop_rate: float
+
+    :param dir_size: Number of items in test directory.
+    :type dir_size: int
+
+    :param journal_size: Number of requests in registration journal.
+    :type journal_size: int
+
+    :param http_session: Custom HTTP session shared by all workers.
+    :type http_session: :class:`~phoxpy.http.Session`
+
+    :param seed: Random seed to make workload reproducible.
+
+    :param server_class: HTTP server class to expose LIS server with.
+                         Should be :class:`~phoxpy.server.httpd.LisHTTPServer`
+                         or subclass of it.
+    """
+    directory = 'service'
+    credentials = {
+        'login': 'loadtest',
+        'password': 'loadtest',
+        'client_id': 'loadtest-license'
+    }
+
+    def __init__(self, workers=10, operations=1000, mix=None,
+                 latency=0, bandwidth=None, error_rate=0, drop_rate=0,
+                 dir_size=100, journal_size=100, http_session=None,
+                 seed=None, server_class=ThreadedLisHTTPServer):
+        self.workers = workers
+        self.operations = operations
+        self.mix = sorted((mix or DEFAULT_MIX).items())
+        for name, weight in self.mix:
+            if not hasattr(self, 'op_' + name.replace('-', '_')):
+                raise ValueError('unknown operation %r' % name)
+        self.random = random.Random(seed)
+        self.lis = self.make_lis_server(dir_size, journal_size)
+        self.httpd = server_class(self.lis, handler=FaultyRequestHandler)
+        self.httpd.faults = {
+            'latency': latency,
+            'bandwidth': bandwidth,
+            'error_rate': error_rate,
+            'drop_rate': drop_rate,
+            'random': random.Random(seed)
+        }
+        self.http_session = http_session or http.Session()
+        self.report = LoadTestReport()
+        self._counter = iter(xrange(operations))
+        self._lock = threading.Lock()
+
+    def make_lis_server(self, dir_size, journal_size):
+        """Creates and populates mock LIS server."""
+        lis = SimpleLISServer('4.2', '31415')
+        lis.ext_auth.add_license(self.credentials['client_id'])
+        lis.ext_auth.add_user(self.credentials['login'],
+                              self.credentials['password'])
+        lis.ext_dirs.add(self.directory, *[
+            {'id': str(idx), 'code': 'S%d' % idx, 'name': u'Service %d' % idx}
+            for idx in xrange(1, dir_size + 1)
+        ])
+        for idx in xrange(1, journal_size + 1):
+            lis.ext_reqs.set({'id': str(idx), 'nr': '%08d' % idx})
+        self.dir_size = dir_size
+        self.journal_size = journal_size
+        return lis
+
+    def make_session(self):
+        """Returns new unauthorized client session."""
+        session = client.Session(**self.credentials)
+        session.bind_resource(self.httpd.url, self.http_session)
+        return session
+
+    def choose(self):
+        """Chooses next operation name according to the mix weights."""
+        with self._lock:
+            dice = self.random.uniform(0, sum(w for n, w in self.mix))
+        for name, weight in self.mix:
+            dice -= weight
+            if dice <= 0:
+                return name
+        return self.mix[-1][0]
+
+    def next_operation(self):
+        """Returns next operation name or ``None`` if workload is exhausted."""
+        with self._lock:
+            try:
+                self._counter.next()
+            except StopIteration:
+                return None
+        return self.choose()
+
+    def op_login(self, session):
+        session = self.make_session()
+        login(session)
+        logout(session)
+
+    def op_directory_load(self, session):
+        list(directory.load(session, self.directory))
+
+    def op_directory_store(self, session):
+        with self._lock:
+            idx = str(self.random.randint(1, self.dir_size))
+        directory.store(session, self.directory,
+                        {'id': idx, 'code': 'S' + idx, 'name': u'Updated'})
+
+    def op_request_info(self, session):
+        with self._lock:
+            idx = str(self.random.randint(1, self.journal_size))
+        requests.load(session, idx)
+
+    def op_registration_journal(self, session):
+        list(requests.select(session))
+
+    def worker(self):
+        """Worker thread routine."""
+        session = self.make_session()
+        while True:
+            name = self.next_operation()
+            if name is None:
+                break
+            handler = getattr(self, 'op_' + name.replace('-', '_'))
+            start = time.time()
+            try:
+                if not session.is_active():
+                    login(session)
+                handler(session)
+            except Exception, err:
+                self.report.add_error(name, err)
+            else:
+                self.report.add(name, time.time() - start)
+
+    def run(self):
+        """Runs load test and returns the report.
+
+        :rtype: :class:`LoadTestReport`
+        """
+        server = threading.Thread(target=self.httpd.serve_forever,
+                                  args=(0.05,))
+        server.daemon = True
+        server.start()
+        try:
+            threads = [threading.Thread(target=self.worker)
+                       for idx in xrange(self.workers)]
+            start = time.time()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.report.elapsed = time.time() - start
+        finally:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+        return self.report
+
+
+def main():
+    from optparse import OptionParser
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('-w', '--workers', type='int', default=10,
+                      help='concurrent workers count')
+    parser.add_option('-n', '--operations', type='int', default=1000,
+                      help='total operations to run')
+    parser.add_option('-l', '--latency', type='float', default=0,
+                      help='injected latency per request in seconds')
+    parser.add_option('-b', '--bandwidth', type='int', default=None,
+                      help='response bandwidth in bytes per second')
+    parser.add_option('-e', '--error-rate', type='float', default=0,
+                      help='probability of HTTP 500 response')
+    parser.add_option('-d', '--drop-rate', type='float', default=0,
+                      help='probability of connection drop')
+    parser.add_option('--dir-size', type='int', default=100,
+                      help='test directory items count')
+    parser.add_option('--journal-size', type='int', default=100,
+                      help='registration journal requests count')
+    parser.add_option('--seed', type='int', default=None,
+                      help='random seed')
+    options, args = parser.parse_args()
+    test = LoadTest(**vars(options))
+    print test.run().summary()
+
+if __name__ == '__main__':
+    main()
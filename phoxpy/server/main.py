@@ -8,27 +8,87 @@
 #
 
 import inspect
+import threading
 from phoxpy import exceptions
 from phoxpy import xml
+from phoxpy.mapping import Mapping, ObjectField
+from phoxpy.messages import Content, PhoxRequest
 
 
 def request_type(message):
+    """Marks extension method as request handler. Handler receives decoded
+    :class:`~phoxpy.messages.PhoxRequest` instance; raw XML sources are
+    decoded with `message` first. If `message` is
+    :class:`~phoxpy.messages.Content` subclass, request content values are
+    converted by its fields, so they have declared types even if XML has no
+    type markers."""
     def decorator(func, _message=message):
-        def wrapper(self, xmlsrc):
-            return func(self, _message.to_python(xmlsrc))
+        def wrapper(self, request):
+            if not isinstance(request, PhoxRequest):
+                request = _message.to_python(request)
+            if issubclass(_message, Content):
+                request.content = typed_content(_message, request.content)
+            return func(self, request)
         wrapper.__name__ = func.__name__
         wrapper.__doc__ = func.__doc__
         wrapper._is_handler = True
         return wrapper
     return decorator
 
+def typed_content(message, content):
+    """Converts values of decoded request `content` by fields of `message`
+    content type. Missing fields are not set to their defaults.
+
+    :param message: Request content type.
+    :type message: :class:`~phoxpy.messages.Content` subclass
+
+    :param content: Decoded request content.
+    :type content: :class:`~phoxpy.messages.Content`
+
+    :return: Content values.
+    :rtype: dict
+
+    :raises: :exc:`~phoxpy.exceptions.RequestParsingError` if some value
+             couldn't be converted.
+    """
+    fields = message._fields.values()
+    data = dict(content.unwrap())
+    if len(fields) == 1 and isinstance(fields[0], ObjectField) \
+            and fields[0].name not in data:
+        # content of single object field is unwrapped by the decoder
+        fields = fields[0].mapping._fields.values()
+    fields = dict((field.name, field) for field in fields)
+    for key, value in data.items():
+        field = fields.get(key)
+        if field is None or value is None:
+            continue
+        try:
+            data[key] = unwrap(field._set_value(value))
+        except (TypeError, ValueError), err:
+            raise exceptions.RequestParsingError('%s: %s' % (key, err))
+    return data
+
+def unwrap(value):
+    """Converts mappings in `value` to plain dicts recursively. Fields
+    without values are omitted."""
+    if isinstance(value, Mapping):
+        return dict((key, unwrap(item))
+                    for key, item in value.unwrap().items()
+                    if item is not None)
+    if isinstance(value, list):
+        return [unwrap(item) for item in value]
+    return value
+
 class ServerExtension(object):
+    """Base class for server extensions. Extension :attr:`lock` guards
+    compound operations with its state against concurrent handlers."""
 
     _version = '0.0'
     _buildnumber = '00000'
 
     def __init__(self, db):
         self._db = db
+        self.lock = threading.RLock()
 
     @property
     def db(self):
@@ -44,10 +104,13 @@ class ServerExtension(object):
 
 
 class BaseLisServer(object):
+    #: Reject requests with session ids which are not registered by ``auth``
+    #: extension.
+    check_sessions = False
 
     def __init__(self, version, buildnumber):
         self._db = {}
-        self._handlers = {}
+        self._routes = {}
         self._version = version
         self._buildnumber = buildnumber
         ServerExtension._version = version
@@ -57,14 +120,37 @@ class BaseLisServer(object):
     def db(self):
         return self._db
 
-    def dispatch(self, xmlstr):
-        root = xml.load(xmlstr)
-        assert 'type' in root.attrib
-        request_type = root.attrib['type'].replace('-', '_')
-        handler = 'handle_' + request_type
-        if handler not in self._handlers:
-            raise exceptions.NoProcessorError(handler)
-        return self._handlers[handler](root)
+    def dispatch(self, xmlsrc):
+        """Dispatches phox request to the related handler.
+
+        Request source is parsed only once: handler is picked by request type
+        on root element ``start`` event, before the rest of the document is
+        read, and then it receives message decoded from the same stream.
+
+        :param xmlsrc: Request XML source.
+        :type xmlsrc: str, file-like object or :class:`~phoxpy.xml.Element`
+
+        :return: Handler response.
+
+        :raises: :exc:`~phoxpy.exceptions.RequestParsingError` if request type
+                 is missing, :exc:`~phoxpy.exceptions.NoProcessorError` if
+                 there is no handler for it,
+                 :exc:`~phoxpy.exceptions.UnknownSession` if
+                 :attr:`check_sessions` is set and session id is not known.
+        """
+        stream = xml.make_stream(xmlsrc)
+        event, root = stream.next()
+        request_type = root.attrib.get('type')
+        if request_type is None:
+            raise exceptions.RequestParsingError('request type is missing')
+        handler = self._routes.get(request_type)
+        if handler is None:
+            raise exceptions.NoProcessorError(request_type)
+        if self.check_sessions and request_type != 'login':
+            sessions = self.db.get('auth', {}).get('sessions', ())
+            if root.attrib.get('sessionid') not in sessions:
+                raise exceptions.UnknownSession()
+        return handler(xml.decode_elem(stream, root))
 
     @property
     def build_number(self):
@@ -75,14 +161,18 @@ class BaseLisServer(object):
         return self._version
 
     def extend(self, namespace, extension):
-        dbleaf = self.db[namespace] = {}
-        instance = extension(dbleaf)
+        """Adds extension instance to the server and routes requests to its
+        handlers. Handler ``handle_foo_bar`` processes requests with type
+        ``foo-bar``. Extension storage is available as ``db[namespace]``."""
+        instance = extension({})
+        self.db[namespace] = instance.db
         setattr(self, 'ext_' + namespace, instance)
         for name, member in inspect.getmembers(instance):
             if not name.startswith('handle_'):
                 continue
             if not hasattr(member, '_is_handler'):
-                return
-            self._handlers[name] = member
+                continue
+            request_type = name[len('handle_'):].replace('_', '-')
+            self._routes[request_type] = member
 
 
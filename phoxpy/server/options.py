@@ -7,8 +7,7 @@
 # you should have received as part of this distribution.
 #
 
-from phoxpy.messages import PhoxResponse
-from phoxpy.messages import options
+from phoxpy.messages import PhoxRequest, PhoxResponse
 from phoxpy.server.main import ServerExtension, request_type
 
 __all__ = ['OptionsExt']
@@ -16,15 +15,18 @@ __all__ = ['OptionsExt']
 class OptionsExt(ServerExtension):
 
     def set(self, key, value):
-        self.db[key] = str(value)
+        with self.lock:
+            self.db[key] = str(value)
 
     def remove(self, key):
-        del self.db[key]
+        with self.lock:
+            del self.db[key]
 
-    @request_type(options.OptionsGet)
+    @request_type(PhoxRequest)
     def handle_options_get(self, request):
-        data = {'': [{'code': key, 'value': value}
-                     for key, value in self.db.items()]}
+        with self.lock:
+            data = {'': [{'code': key, 'value': value}
+                         for key, value in self.db.items()]}
         return PhoxResponse(
             sessionid=request.sessionid,
             **data
@@ -7,23 +7,37 @@
 # you should have received as part of this distribution.
 #
 
+import base64
 import time
-from random import randint
+from phoxpy import exceptions
 from phoxpy.messages import PhoxResponse
-from phoxpy.messages import requests
-from phoxpy.messages import journal
+from phoxpy.scheme import journal, requests
 from phoxpy.server.main import ServerExtension, request_type
+from phoxpy.server.storage import JournalStorage
+from phoxpy.xmlobjects import LazyObject
 
 __all__ = ['RequestsExt']
 
 class RequestsExt(ServerExtension):
 
+    def __init__(self, db):
+        super(RequestsExt, self).__init__(JournalStorage(db))
+        self.reports = {}
+
     def set(self, item, timestamp=None):
-        assert isinstance(item, dict)
-        if 'id' not in item:
-            item['id'] = str(randint(1, 10000))
-        item['timestamp'] = timestamp or int(time.time())
-        self.db[item['id']] = item
+        assert isinstance(item, (dict, LazyObject))
+        if isinstance(item, LazyObject):
+            item = item.copy()
+        with self.lock:
+            if 'id' not in item:
+                item['id'] = self.db.new_id()
+            item['timestamp'] = timestamp or int(time.time())
+            self.db.set(item)
+
+    def set_report(self, idx, data):
+        """Sets report data returned for the request."""
+        with self.lock:
+            self.reports[idx] = data
 
     @request_type(requests.RequestInfo)
     def handle_request_info(self, request):
@@ -32,15 +46,17 @@ class RequestsExt(ServerExtension):
             buildnumber=request.buildnumber,
             **self.db.get(request['request'], {}))
 
-    @request_type(journal.RegistrationJournalRequest)
+    @request_type(journal.RegistrationJournal)
     def handle_registration_journal(self, request):
-        data = []
-        for item in self.db.values():
-            emit = True
-            if request['lastTimestamp']:
-                if request['lastTimestamp'] > item['timestamp']:
-                    emit = False
-            if emit:
-                data.append(item)
+        with self.lock:
+            data = self.db.select(request.content.unwrap())
         return PhoxResponse(Request=data)
 
+    @request_type(requests.PrintRequestOld)
+    def handle_print_request_old(self, request):
+        idx = request['request']
+        with self.lock:
+            data = self.reports.get(idx)
+        if data is None:
+            raise exceptions.UnknownError('report for %s not found' % idx)
+        return PhoxResponse(base64String=base64.encodestring(data))
@@ -0,0 +1,408 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011 Alexander Shorin
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+"""Storage engines for mock LIS server extensions."""
+
+from bisect import bisect_left, bisect_right, insort
+from itertools import count
+from phoxpy.xmlobjects import LazyObject
+
+__all__ = ['JournalStorage', 'VersionedStore']
+
+
+class SortedIndex(object):
+    """Sorted list of ``(value, id)`` pairs which answers range and prefix
+    queries with binary search."""
+
+    def __init__(self):
+        self.pairs = []
+
+    def __len__(self):
+        return len(self.pairs)
+
+    def add(self, value, idx):
+        insort(self.pairs, (value, idx))
+
+    def extend(self, pairs):
+        self.pairs.extend(pairs)
+        self.pairs.sort()
+
+    def remove(self, value, idx):
+        pos = bisect_left(self.pairs, (value, idx))
+        if pos < len(self.pairs) and self.pairs[pos] == (value, idx):
+            del self.pairs[pos]
+
+    def bounds(self, low=None, high=None):
+        """Returns slice bounds for values between `low` and `high`
+        inclusively. ``None`` means unbounded."""
+        if low is None:
+            start = 0
+        else:
+            start = bisect_left(self.pairs, (low,))
+        if high is None:
+            stop = len(self.pairs)
+        else:
+            stop = bisect_left(self.pairs, (high,), start)
+            while stop < len(self.pairs) and self.pairs[stop][0] == high:
+                stop += 1
+        return start, stop
+
+    def prefix_bounds(self, prefix):
+        """Returns slice bounds for values which start with `prefix`."""
+        start = bisect_left(self.pairs, (prefix,))
+        stop = bisect_right(self.pairs, (prefix + u'\U0010ffff',), start)
+        return start, stop
+
+    def ids(self, start, stop):
+        return [idx for value, idx in self.pairs[start:stop]]
+
+
+class JournalStorage(object):
+    """Registration journal requests storage for
+    :class:`~phoxpy.server.requests.RequestsExt`.
+
+    Requests are kept sorted by ``timestamp`` and registration ``date``.
+    Requests with the same timestamp are ordered by their changes, so
+    timeline is iterated in order without sorting.
+    Equality indexes are maintained for fields listed in :attr:`indexes` and
+    case insensitive prefix indexes for :attr:`names`, so
+    :meth:`select` answers filtered queries by intersection of index lookups
+    instead of full scan.
+
+    :param items: Initial requests mapping by their ids.
+    :type items: dict
+    """
+    #: Registration journal filter keys to indexed request fields mapping.
+    #: Filter values are lists of acceptable ids or single value.
+    indexes = {
+        'departments': 'department',
+        'hospitals': 'hospital',
+        'states': 'state',
+        'customStates': 'customState',
+        'doctors': 'doctor',
+        'payCategories': 'payCategory',
+        'requestForms': 'requestForm',
+        'nr': 'nr',
+        'patientNr': 'patientNr',
+        'billNr': 'billNr',
+    }
+    #: Registration journal filter keys to prefix indexed request fields
+    #: mapping.
+    names = {
+        'lastName': 'lastName',
+        'firstName': 'firstName',
+        'middleName': 'middleName',
+    }
+    #: Request field with registration date.
+    date_field = 'date'
+
+    def __init__(self, items=None):
+        self._items = {}
+        self._timeline = SortedIndex()
+        self._dates = SortedIndex()
+        self._index = dict((key, {}) for key in self.indexes.values())
+        self._names = dict((key, SortedIndex()) for key in self.names.values())
+        self._last_id = 0
+        self._seq = {}
+        self._counter = count()
+        if items:
+            self.update(items.values())
+
+    def __getitem__(self, idx):
+        return self._items[idx]
+
+    def __contains__(self, idx):
+        return idx in self._items
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, idx, default=None):
+        return self._items.get(idx, default)
+
+    def keys(self):
+        """Returns request ids ordered by timestamp."""
+        return self._timeline.ids(0, len(self._timeline))
+
+    def values(self):
+        """Returns requests ordered by timestamp."""
+        return [self._items[idx] for idx in self.keys()]
+
+    def items(self):
+        return [(idx, self._items[idx]) for idx in self.keys()]
+
+    def new_id(self):
+        """Returns unused request id."""
+        while True:
+            self._last_id += 1
+            idx = str(self._last_id)
+            if idx not in self._items:
+                return idx
+
+    def set(self, item):
+        """Stores request replacing the old one with the same id."""
+        self.update([item])
+
+    def update(self, items):
+        """Stores batch of requests. Sorted indexes are rebuilt once per
+        batch, so bulk loading doesn't cost insertion per request. If batch
+        holds same id several times, the last request is stored."""
+        items = list(items)
+        if len(items) > 1:
+            last = dict((item['id'], pos) for pos, item in enumerate(items))
+            items = [item for pos, item in enumerate(items)
+                     if last[item['id']] == pos]
+        if len(items) == 1:
+            add = lambda index, value, idx: index.add(value, idx)
+        else:
+            pending = {}
+            add = lambda index, value, idx: \
+                pending.setdefault(index, []).append((value, idx))
+        for item in items:
+            idx = item['id']
+            if idx in self._items:
+                self.remove(idx)
+            self._items[idx] = item
+            self._seq[idx] = self._counter.next()
+            add(self._timeline, self._order(idx), idx)
+            if item.get(self.date_field) is not None:
+                add(self._dates, item[self.date_field], idx)
+            for field, index in self._index.items():
+                if item.get(field) is not None:
+                    index.setdefault(item[field], set()).add(idx)
+            for field, index in self._names.items():
+                if item.get(field) is not None:
+                    add(index, item[field].lower(), idx)
+        if len(items) > 1:
+            for index, pairs in pending.items():
+                index.extend(pairs)
+
+    def remove(self, idx):
+        """Removes request by id."""
+        self._timeline.remove(self._order(idx), idx)
+        item = self._items.pop(idx)
+        del self._seq[idx]
+        if item.get(self.date_field) is not None:
+            self._dates.remove(item[self.date_field], idx)
+        for field, index in self._index.items():
+            value = item.get(field)
+            if value is not None:
+                index[value].discard(idx)
+                if not index[value]:
+                    del index[value]
+        for field, index in self._names.items():
+            if item.get(field) is not None:
+                index.remove(item[field].lower(), idx)
+
+    def select(self, filter):
+        """Selects requests which match registration journal filter.
+
+        Empty filter values don't restrict selection. Lists of ids match
+        requests with any of them, ``departments`` could be also passed
+        as ``{'idList': [...]}`` object. Names are matched by case insensitive
+        prefix. ``lastTimestamp`` selects requests changed since it,
+        ``dateFrom`` and ``dateTill`` restrict registration date inclusively.
+
+        :param filter: Decoded registration journal filter.
+        :type filter: dict
+
+        :return: Matched requests ordered by timestamp.
+        :rtype: list
+        """
+        sets = []
+        for key, field in self.indexes.items():
+            values = filter.get(key)
+            if isinstance(values, dict):
+                values = values.get('idList')
+            if not values:
+                continue
+            if not isinstance(values, (list, tuple, set)):
+                values = [values]
+            index = self._index[field]
+            ids = set()
+            for value in values:
+                ids.update(index.get(value, ()))
+            sets.append(ids)
+        for key, field in self.names.items():
+            if filter.get(key):
+                index = self._names[field]
+                bounds = index.prefix_bounds(filter[key].lower())
+                sets.append(set(index.ids(*bounds)))
+
+        ranges = []
+        if filter.get('lastTimestamp'):
+            # timeline is ordered by (timestamp, change) pairs
+            low = filter['lastTimestamp']
+            ranges.append((self._timeline.bounds((low,)), self._timeline,
+                           'timestamp', low, None))
+        if filter.get('dateFrom') or filter.get('dateTill'):
+            low, high = filter.get('dateFrom'), filter.get('dateTill')
+            ranges.append((self._dates.bounds(low, high), self._dates,
+                           self.date_field, low, high))
+
+        if not sets and not ranges:
+            return self.values()
+
+        # only the narrowest range is taken from index, the rest ones are
+        # checked against already intersected requests
+        ranges.sort(key=lambda r: r[0][1] - r[0][0])
+        if ranges:
+            bounds, index = ranges.pop(0)[:2]
+            sets.append(set(index.ids(*bounds)))
+
+        sets.sort(key=len)
+        ids = sets[0]
+        for other in sets[1:]:
+            if not ids:
+                break
+            ids = ids.intersection(other)
+
+        items = [self._items[idx] for idx in ids]
+        for bounds, index, field, low, high in ranges:
+            items = [item for item in items
+                     if item.get(field) is not None
+                     and (low is None or low <= item[field])
+                     and (high is None or item[field] <= high)]
+        items.sort(key=lambda item: self._order(item['id']))
+        return items
+
+    def _order(self, idx):
+        return self._items[idx].get('timestamp', 0), self._seq[idx]
+
+
+class VersionedStore(object):
+    """Items storage with monotonic version and changelog.
+
+    Each :meth:`commit` stores batch of items as single new version and
+    records changed ids for it, so :meth:`changes` answers what was changed
+    since some version without scanning all items. Stored items are never
+    modified in place by the store itself: updates replace them with new
+    objects, so items already handed out stay consistent snapshots.
+
+    :param changelog_limit: Maximum number of versions to keep in changelog.
+                            ``None`` means unlimited.
+    :type changelog_limit: int
+    """
+
+    def __init__(self, changelog_limit=None):
+        self._items = {}
+        self._version = 0
+        self._versions = []
+        self._changelog = []
+        self._last_id = 0
+        self.changelog_limit = changelog_limit
+
+    def __getitem__(self, idx):
+        return self._items[idx]
+
+    def __contains__(self, idx):
+        return idx in self._items
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self._items)
+
+    @property
+    def version(self):
+        """Current store version."""
+        return self._version
+
+    def keys(self):
+        return self._items.keys()
+
+    def values(self):
+        return self._items.values()
+
+    def items(self):
+        return self._items.items()
+
+    def new_id(self):
+        """Returns unused item id."""
+        while True:
+            self._last_id += 1
+            idx = str(self._last_id)
+            if idx not in self._items:
+                return idx
+
+    def commit(self, items):
+        """Stores batch of items as single new version. Items are copied
+        before storing, so passed ones are left unchanged. Items without
+        ``id`` key get new one.
+
+        :param items: Items to store.
+        :type items: iterable of dict
+
+        :return: List of stored item ids and new version.
+        :rtype: tuple
+        """
+        copies = []
+        for item in items:
+            assert isinstance(item, (dict, LazyObject))
+            copies.append(dict(item))
+        return self._commit(copies)
+
+    def _commit(self, items):
+        ids = []
+        for item in items:
+            if 'id' not in item:
+                item['id'] = self.new_id()
+            elif isinstance(item['id'], basestring) and item['id'].isdigit():
+                self._last_id = max(self._last_id, int(item['id']))
+            self._items[item['id']] = item
+            ids.append(item['id'])
+        if not ids:
+            return ids, self._version
+        self._version += 1
+        self._versions.append(self._version)
+        self._changelog.append(ids)
+        limit = self.changelog_limit
+        if limit is not None and len(self._versions) > limit:
+            del self._versions[:-limit]
+            del self._changelog[:-limit]
+        return ids, self._version
+
+    def update(self, ids, **values):
+        """Updates items with `values` as single new version. Updated items
+        are stored as new objects.
+
+        :return: New version.
+        """
+        items = []
+        for idx in ids:
+            item = dict(self._items[idx])
+            item.update(values)
+            items.append(item)
+        return self._commit(items)[1]
+
+    def changes(self, since):
+        """Returns ids of items changed after `since` version ordered by
+        their last change.
+
+        :param since: Known version.
+        :type since: int
+
+        :return: List of ids or ``None`` if changelog doesn't cover `since`
+                 version anymore.
+        """
+        if self._versions and since < self._versions[0] - 1:
+            return None
+        seen = set()
+        ids = []
+        pos = bisect_right(self._versions, since)
+        for batch in reversed(self._changelog[pos:]):
+            for idx in reversed(batch):
+                if idx not in seen:
+                    seen.add(idx)
+                    ids.append(idx)
+        ids.reverse()
+        return ids
@@ -10,8 +10,11 @@
 import types
 import unittest
 from phoxpy import client
+from phoxpy import exceptions
 from phoxpy.server import MockHttpSession, SimpleLISServer
+from phoxpy.server.directory import DirectoryChanges
 from phoxpy.modules import directory
+from phoxpy.predicates import F
 
 class DirectoryTestCase(unittest.TestCase):
 
@@ -38,7 +41,7 @@ class DirectoryTestCase(unittest.TestCase):
         items = directory.items(self.session)
         self.assertTrue(isinstance(items, types.GeneratorType))
         items = list(items)
-        items_should_be = [('foo', 5), ('abc', 3)]
+        items_should_be = [('foo', 1), ('abc', 1)]
         self.assertEqual(sorted(items), sorted(items_should_be))
 
     def test_load_returns_generator(self):
@@ -52,6 +55,14 @@ class DirectoryTestCase(unittest.TestCase):
             sorted(self.db['foo'].values())
         )
 
+    def test_load_table(self):
+        self.db['foo']['42']['removed'] = True
+        table = directory.load_table(self.session, 'foo', fields=['id', 'foo'])
+        self.assertEqual(len(table), 4)
+        self.assertTrue('42' not in list(table['id']))
+        self.assertEqual(sorted(table['foo'].categories),
+                         ['bar', 'baz', 'oof', 'zoo'])
+
     def test_load_by_id(self):
         items = directory.load(self.session, 'foo', '42')
         self.assertEqual(items.next(), self.db['foo']['42'])
@@ -88,6 +99,56 @@ class DirectoryTestCase(unittest.TestCase):
         data = [self.db['foo']['42'], self.db['foo']['3.14']]
         self.assertEqual(sorted(items), sorted(data))
 
+    def test_load_lazy(self):
+        self.db['foo']['42']['removed'] = True
+        items = list(directory.load(self.session, 'foo', ['42', '3.14'],
+                                    lazy=True))
+        self.assertEqual(items, [self.db['foo']['3.14']])
+
+    def test_load_fields(self):
+        items = list(directory.load(self.session, 'abc', fields=['foo']))
+        self.assertEqual(sorted(items), [{'foo': 'a'}, {'foo': 'b'},
+                                         {'foo': 'c'}])
+
+    def test_load_fields_not_removed(self):
+        self.db['foo']['42']['removed'] = True
+        items = list(directory.load(self.session, 'foo', ['42', '3.14'],
+                                    fields=['id']))
+        self.assertEqual(items, [{'id': '3.14'}])
+        items = list(directory.load(self.session, 'foo', ['42', '3.14'],
+                                    fields=['id'], removed=True, lazy=True))
+        self.assertEqual(sorted(item['id'] for item in items), ['3.14', '42'])
+        self.assertEqual(sorted(map(len, items)), [1, 1])
+
+    def test_load_where(self):
+        items = list(directory.load(self.session, 'abc',
+                                    where=F('foo').in_(['a', 'c'])))
+        self.assertEqual(sorted(item['id'] for item in items), ['1', '3'])
+        self.assertTrue(all(type(item) is dict for item in items))
+
+    def test_load_where_fields(self):
+        items = list(directory.load(self.session, 'abc', fields=['id'],
+                                    where=F('foo') > 'a'))
+        self.assertEqual(sorted(items), [{'id': '2'}, {'id': '3'}])
+
+    def test_load_where_pushes_ids_to_server(self):
+        requests = []
+        dispatch = self.server.dispatch
+        def spy(body):
+            requests.append(body)
+            return dispatch(body)
+        self.server.dispatch = spy
+        where = F('id').in_(['1', '2']) & (F('foo') != 'a')
+        items = list(directory.load(self.session, 'abc', where=where))
+        self.assertEqual([item['id'] for item in items], ['2'])
+        self.assertTrue('<r i="1" />' in requests[-1]
+                        or '<r i="1"/>' in requests[-1], requests[-1])
+
+    def test_load_where_no_ids_left(self):
+        where = (F('id') == '1') & (F('id') == '2')
+        self.assertEqual(list(directory.load(self.session, 'abc',
+                                             where=where)), [])
+
     def test_store(self):
         item = self.db['foo']['42']
         self.assertTrue('source' not in item)
@@ -105,6 +166,45 @@ class DirectoryTestCase(unittest.TestCase):
         self.assertEqual(id, item['id'])
         self.assertEqual(item, self.db['employee']['42'])
 
+    def test_store_many(self):
+        items = [{'foo': str(idx)} for idx in range(5)]
+        ids, version = directory.store_many(self.session, 'abc', items,
+                                            batch_size=2, concurrency=1)
+        self.assertEqual(ids, [item['id'] for item in items])
+        self.assertEqual(version, self.db['abc'].version)
+        for item in items:
+            self.assertEqual(item, self.db['abc'][item['id']])
+
+    def test_store_many_concurrent(self):
+        items = ({'foo': str(idx)} for idx in range(20))
+        ids, version = directory.store_many(self.session, 'abc', items,
+                                            batch_size=7, concurrency=4)
+        self.assertEqual(len(set(ids)), 20)
+        self.assertEqual([self.db['abc'][idx]['foo'] for idx in ids],
+                         [str(idx) for idx in range(20)])
+        self.assertEqual(version, self.db['abc'].version)
+
+    def test_store_many_keeps_stored_ids_on_error(self):
+        dirdb = self.db['abc']
+        set_item = dirdb.set
+        def set(item):
+            if item['foo'] == '3':
+                raise exceptions.LisBaseException('abc')
+            return set_item(item)
+        dirdb.set = set
+        items = [{'foo': str(idx)} for idx in range(5)]
+        try:
+            directory.store_many(self.session, 'abc', items,
+                                 batch_size=2, concurrency=1)
+        except exceptions.LisBaseException, err:
+            pass
+        else:
+            self.fail('%s expected' % exceptions.LisBaseException)
+        self.assertEqual(err.ids, [items[0]['id'], items[1]['id'],
+                                   items[2]['id'], None])
+        self.assertEqual(err.version, dirdb.version)
+        self.assertTrue('id' not in items[4])
+
     def test_remove_by_id(self):
         old_version = self.db['foo'].version
         version = directory.remove(self.session, 'foo', '42')
@@ -120,6 +220,14 @@ class DirectoryTestCase(unittest.TestCase):
         self.assertTrue(self.db['foo']['42']['removed'])
         self.assertTrue(self.db['foo']['3.14']['removed'])
         self.assertEqual(version, self.db['foo'].version)
+        self.assertEqual(old_version + 1, version)
+
+    def test_remove_by_batches(self):
+        old_version = self.db['abc'].version
+        version = directory.remove(self.session, 'abc', ['1', '2', '3'],
+                                   batch_size=2)
+        for idx in '123':
+            self.assertTrue(self.db['abc'][idx]['removed'])
         self.assertEqual(old_version + 2, version)
 
     def test_remove_by_item(self):
@@ -137,17 +245,37 @@ class DirectoryTestCase(unittest.TestCase):
         assert directory.restore(self.session, 'foo', '42')
         self.assertTrue(not self.db['foo']['42'].get('removed', False))
 
+    def test_restore_by_batches(self):
+        directory.remove(self.session, 'abc', ['1', '2', '3'])
+        directory.restore(self.session, 'abc', ['1', '2', '3'], batch_size=2)
+        for idx in '123':
+            self.assertFalse(self.db['abc'][idx]['removed'])
+
     def test_changes(self):
         feed = directory.changes(self.session)
         self.assertTrue(isinstance(feed, types.GeneratorType))
         data = [feed.next(), feed.next()]
-        self.assertEqual(sorted([('foo', 5), ('abc', 3)]), sorted(data))
+        self.assertEqual(sorted([('foo', 1), ('abc', 1)]), sorted(data))
         self.db['abc'].set({'foo': 'bar'})
-        self.assertEqual(('abc', 4), feed.next())
+        self.assertEqual(('abc', 2), feed.next())
 
     def test_specific_changes(self):
-        feed = directory.changes(self.session, init_versions={'foo': 2})
-        self.assertEqual(('foo', 5), feed.next())
+        self.db['foo'].set({'foo': 'bar'})
+        feed = directory.changes(self.session, init_versions={'foo': 1})
+        self.assertEqual(('foo', 2), feed.next())
+
+    def test_server_changes(self):
+        directory.remove(self.session, 'abc', ['3', '1'])
+        self.db['abc'].set({'id': '2', 'foo': 'bar'})
+        msg = DirectoryChanges(name='abc', version=2)
+        resp = self.session.request(
+            body=msg.to_message(type='directory-changes'))
+        self.assertEqual(resp['version'], 3)
+        self.assertEqual(resp['ids'], ['2'])
+        msg = DirectoryChanges(name='abc', version=1)
+        resp = self.session.request(
+            body=msg.to_message(type='directory-changes'))
+        self.assertEqual(resp['ids'], ['3', '1', '2'])
 
 if __name__ == '__main__':
     unittest.main()
@@ -7,9 +7,15 @@
 # you should have received as part of this distribution.
 #
 
+import os
+import shutil
+import tempfile
 import types
 import unittest
+from cStringIO import StringIO
 from phoxpy import client
+from phoxpy import exceptions
+from phoxpy import xml
 from phoxpy.server import MockHttpSession, SimpleLISServer
 from phoxpy.modules import requests
 
@@ -32,6 +38,13 @@ class RequestsTestCase(unittest.TestCase):
         req = requests.load(self.session, 'foo')
         self.assertEqual(req['data'], 1)
 
+    def test_load_stored_lazy_item(self):
+        self.server.ext_reqs.set(
+            xml.decode('<o id="baz"><f n="data" t="I" v="3"/></o>', lazy=True))
+        self.assertEqual(type(self.server.ext_reqs.db['baz']), dict)
+        req = requests.load(self.session, 'baz')
+        self.assertEqual(req['data'], 3)
+
     def test_load_shares_no_header_info(self):
         req = requests.load(self.session, 'foo')
         self.assertTrue('sessionid' not in req)
@@ -44,6 +57,18 @@ class RequestsTestCase(unittest.TestCase):
             sorted(list(items))
         )
 
+    def test_load_fields(self):
+        req = requests.load(self.session, 'foo', fields=['id'])
+        self.assertEqual(req, {'id': 'foo'})
+
+    def test_select_fields(self):
+        items = requests.select(self.session, fields=['data'])
+        self.assertEqual(sorted(items), [{'data': 1}, {'data': 2}])
+
+    def test_select_table(self):
+        table = requests.select_table(self.session, fields={'data': 'int'})
+        self.assertEqual(sorted(table['data']), [1, 2])
+
     def test_changes(self):
         items = requests.changes(self.session, 123)
         self.assertTrue(isinstance(items, types.GeneratorType))
@@ -55,5 +80,93 @@ class RequestsTestCase(unittest.TestCase):
         foo_new = items.next()
         self.assertEqual('foo', foo_new['id'])
 
+    def test_changes_with_same_timestamp(self):
+        self.server.ext_reqs.set({'id': 'baz', 'data': 3}, 100)
+        self.server.ext_reqs.set({'id': 'qux', 'data': 4}, 100)
+        items = requests.changes(self.session, 50)
+        self.assertEqual([items.next()['id'] for idx in range(2)],
+                         ['baz', 'qux'])
+
+
+class Output(object):
+
+    def __init__(self, write):
+        self.write = write
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class ReportTestCase(unittest.TestCase):
+
+    def setUp(self):
+        server = SimpleLISServer('4.2', '31415')
+        server.ext_auth.add_license('foo-bar-baz')
+        server.ext_auth.add_user('John', 'Doe')
+        self.reports = {}
+        for idx in range(10):
+            data = os.urandom(1000 * idx + 1)
+            self.reports[str(idx)] = data
+            server.ext_reqs.set_report(str(idx), data)
+        session = client.Session(login='John', password='Doe',
+                                 client_id='foo-bar-baz')
+        session.open('localhost', http_session=MockHttpSession(server))
+        self.session = session
+        self.server = server
+
+    def test_report(self):
+        report = requests.report(self.session, '5', 'pdf')
+        self.assertEqual(report.read(), self.reports['5'])
+
+    def test_save_report_by_chunks(self):
+        chunks = []
+        size = requests.save_report(self.session, '9', chunks.append)
+        self.assertEqual(size, len(self.reports['9']))
+        self.assertEqual(''.join(chunks), self.reports['9'])
+        self.assertTrue(len(chunks) > 1 or
+                        size < requests.REPORT_CHUNK_SIZE * 3 / 4)
+
+    def test_unsupported_format(self):
+        self.assertRaises(ValueError, requests.save_report,
+                          self.session, '1', StringIO(), 'doc')
+
+    def test_report_many(self):
+        path = tempfile.mkdtemp()
+        try:
+            sizes = requests.report_many(self.session, iter(self.reports),
+                                         path, concurrency=3)
+            self.assertEqual(sorted(sizes), sorted(self.reports))
+            for idx, data in self.reports.items():
+                self.assertEqual(sizes[idx], len(data))
+                with open(os.path.join(path, idx + '.pdf'), 'rb') as fobj:
+                    self.assertEqual(fobj.read(), data)
+        finally:
+            shutil.rmtree(path)
+
+    def test_report_many_pool(self):
+        outputs = {}
+        def output(idx):
+            outputs[idx] = []
+            return Output(outputs[idx].append)
+        pool = client.SessionPool(
+            'localhost', {'login': 'John', 'password': 'Doe',
+                          'client_id': 'foo-bar-baz'},
+            size=2, http_session=MockHttpSession(self.server))
+        requests.report_many(pool, ['1', '2', '3'], output, 'fp3')
+        for idx in ['1', '2', '3']:
+            self.assertEqual(''.join(outputs[idx]), self.reports[idx])
+
+    def test_report_many_error(self):
+        outputs = {}
+        def output(idx):
+            outputs[idx] = Output(lambda chunk: None)
+            return outputs[idx]
+        self.assertRaises(exceptions.UnknownError, requests.report_many,
+                          self.session, ['1', 'missed', '2'], output)
+        self.assertEqual(sorted(outputs), ['1', '2', 'missed'])
+        self.assertTrue(all(item.closed for item in outputs.values()))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011 Alexander Shorin
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+
+import socket
+import threading
+import unittest
+from httplib import HTTPConnection
+from StringIO import StringIO
+from phoxpy import client
+from phoxpy import exceptions
+from phoxpy import http
+from phoxpy.messages import PhoxRequest
+from phoxpy.modules import directory
+from phoxpy.server import SimpleLISServer
+from phoxpy.server.httpd import LisHTTPServer, ThreadedLisHTTPServer
+
+
+class HTTPServerTestCase(unittest.TestCase):
+
+    server_class = ThreadedLisHTTPServer
+    chunk_size = None
+    compress = False
+    compress_threshold = None
+
+    def setUp(self):
+        lis = SimpleLISServer('4.2', '31415')
+        lis.ext_auth.add_license('foo-bar-baz')
+        lis.ext_auth.add_user('John', 'Doe')
+        lis.ext_dirs.add('foo', {'id': '1', 'foo': 'bar'})
+        self.lis = lis
+        self.httpd = self.server_class(lis, chunk_size=self.chunk_size,
+                                       compress=self.compress)
+        thread = threading.Thread(target=self.httpd.serve_forever,
+                                  args=(0.05,))
+        thread.daemon = True
+        thread.start()
+        self.session = client.Session(login='John', password='Doe',
+                                      client_id='foo-bar-baz')
+        self.http_session = http.Session(
+            compression=self.compress,
+            compress_threshold=self.compress_threshold)
+        self.session.open(self.httpd.url, http_session=self.http_session)
+
+    def tearDown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def test_request(self):
+        items = list(directory.load(self.session, 'foo'))
+        self.assertEqual(items, [{'id': '1', 'foo': 'bar'}])
+
+    def test_lis_error(self):
+        self.session.close()
+        self.session.id = 'foo'
+        self.assertRaises(exceptions.UnknownSession, self.session.close)
+
+    def test_unknown_error(self):
+        msg = PhoxRequest(type='directory-remove', directory='foo')
+        self.assertRaises(exceptions.UnknownError,
+                          self.session.request, body=msg)
+
+    def test_keep_alive(self):
+        conn = HTTPConnection(self.httpd.server_address[0],
+                              self.httpd.server_address[1])
+        body = str(PhoxRequest(type='directory-versions'))
+        for idx in range(3):
+            conn.request('POST', '/', body)
+            resp = conn.getresponse()
+            self.assertEqual(resp.status, 200)
+            self.assertTrue('versions' in resp.read())
+        conn.close()
+
+    def test_chunked_request(self):
+        body = StringIO(str(PhoxRequest(type='directory-versions')))
+        status, headers, data = self.http_session.request(
+            'POST', self.httpd.url, body=body)
+        self.assertEqual(status, 200)
+        self.assertTrue('versions' in data.read())
+
+    def test_concurrent_requests(self):
+        errors = []
+        def worker():
+            try:
+                for idx in range(10):
+                    directory.store(self.session, 'foo', {'foo': 'baz'})
+            except Exception, err:
+                errors.append(err)
+        threads = [threading.Thread(target=worker) for idx in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(self.lis.ext_dirs['foo'].version, 51)
+
+
+class ChunkedHTTPServerTestCase(HTTPServerTestCase):
+
+    chunk_size = 16
+
+    def test_chunked_response(self):
+        conn = HTTPConnection(self.httpd.server_address[0],
+                              self.httpd.server_address[1])
+        conn.request('POST', '/', str(PhoxRequest(type='directory-versions')))
+        resp = conn.getresponse()
+        self.assertEqual(resp.getheader('transfer-encoding'), 'chunked')
+        self.assertTrue('versions' in resp.read())
+        conn.close()
+
+
+class CompressedHTTPServerTestCase(HTTPServerTestCase):
+
+    chunk_size = 1024
+    compress = True
+    compress_threshold = 0
+
+    def test_compressed_response(self):
+        conn = HTTPConnection(self.httpd.server_address[0],
+                              self.httpd.server_address[1])
+        conn.request('POST', '/', str(PhoxRequest(type='directory-versions')),
+                     {'Accept-Encoding': 'gzip'})
+        resp = conn.getresponse()
+        self.assertEqual(resp.getheader('content-encoding'), 'gzip')
+        data = http.DecompressingBody(resp, 'gzip').read()
+        self.assertTrue('versions' in data)
+        conn.close()
+
+    def test_compressed_request(self):
+        body = str(PhoxRequest(type='directory-versions'))
+        conn = HTTPConnection(self.httpd.server_address[0],
+                              self.httpd.server_address[1])
+        conn.request('POST', '/', http.gzip_compress(body),
+                     {'Content-Encoding': 'gzip'})
+        resp = conn.getresponse()
+        self.assertTrue('versions' in resp.read())
+        conn.close()
+
+
+class ThreadedHTTPServerTestCase(HTTPServerTestCase):
+
+    def test_half_open_circuit_probe(self):
+        policy = http.RetryPolicy(max_retries=0, breaker_threshold=1,
+                                  breaker_timeout=0)
+        self.http_session.retry_policy = policy
+        breaker = policy.breaker('%s:%d' % self.httpd.server_address)
+        breaker.failure()
+        self.assertEqual(breaker.state, breaker.OPEN)
+        items = list(directory.load(self.session, 'foo'))
+        self.assertEqual(items, [{'id': '1', 'foo': 'bar'}])
+        self.assertEqual(breaker.state, breaker.CLOSED)
+
+    def test_retry_refused_connection(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        policy = http.RetryPolicy(backoff=0, max_retries=2,
+                                  breaker_threshold=5)
+        session = http.Session(retry_policy=policy)
+        self.assertRaises(socket.error, session.request, 'GET',
+                          self.httpd.url)
+        breaker = policy.breaker('%s:%d' % self.httpd.server_address)
+        self.assertEqual(breaker.failures, 3)
+
+    def test_server_close_drops_kept_alive_connections(self):
+        conn = HTTPConnection(self.httpd.server_address[0],
+                              self.httpd.server_address[1])
+        conn.request('POST', '/', str(PhoxRequest(type='directory-versions')))
+        resp = conn.getresponse()
+        resp.read()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        conn.sock.settimeout(1)
+        self.assertEqual(conn.sock.recv(1), '')
+        conn.close()
+
+
+class SingleThreadedHTTPServerTestCase(HTTPServerTestCase):
+
+    server_class = LisHTTPServer
+
+
+if __name__ == '__main__':
+    unittest.main()
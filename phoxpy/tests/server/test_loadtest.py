@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011 Alexander Shorin
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+
+import unittest
+from phoxpy.server import loadtest
+
+
+class PercentileTestCase(unittest.TestCase):
+
+    def test_median(self):
+        self.assertEqual(loadtest.percentile([3, 1, 2], 50), 2)
+
+    def test_top(self):
+        self.assertEqual(loadtest.percentile(range(100), 100), 99)
+
+    def test_empty(self):
+        self.assertEqual(loadtest.percentile([], 99), None)
+
+
+class LoadTestCase(unittest.TestCase):
+
+    def test_run(self):
+        test = loadtest.LoadTest(workers=4, operations=40, seed=42,
+                                 dir_size=10, journal_size=10)
+        report = test.run()
+        self.assertEqual(report.total, 40)
+        self.assertEqual(report.failed, 0)
+        self.assertTrue(report.throughput > 0)
+        self.assertTrue(report.latency()[99] >= report.latency()[50])
+
+    def test_run_with_injected_errors(self):
+        test = loadtest.LoadTest(workers=2, operations=20, seed=42,
+                                 error_rate=1, mix={'request-info': 1})
+        report = test.run()
+        self.assertEqual(report.total, 0)
+        self.assertEqual(report.errors, {('request-info', 'HTTPError'): 20})
+
+    def test_report_summary(self):
+        test = loadtest.LoadTest(workers=1, operations=5, seed=42,
+                                 mix={'login': 1})
+        summary = test.run().summary()
+        self.assertTrue('login' in summary)
+        self.assertTrue('throughput' in summary)
+
+    def test_summary_without_timings(self):
+        report = loadtest.LoadTestReport()
+        report.add_error('login', ValueError())
+        total = report.summary().splitlines()[1]
+        self.assertEqual(total.split(), ['total', '0', '-', '-', '-', '-'])
+        self.assertTrue('login: ValueError x 1' in report.summary())
+
+    def test_fail_on_unknown_operation(self):
+        self.assertRaises(ValueError, loadtest.LoadTest, mix={'foo': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
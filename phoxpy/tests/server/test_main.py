@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011 Alexander Shorin
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+
+import unittest
+from StringIO import StringIO
+from phoxpy import exceptions
+from phoxpy.mapping import IntegerField, LongField, Mapping, ObjectField
+from phoxpy.messages import PhoxRequest, PhoxRequestContent, PhoxResponse
+from phoxpy.server import SimpleLISServer
+from phoxpy.server.main import BaseLisServer, ServerExtension, request_type
+
+
+class Typed(PhoxRequestContent):
+    answer = IntegerField()
+    since = ObjectField(Mapping.build(stamp=LongField()))
+
+
+class DummyExt(ServerExtension):
+
+    @request_type(PhoxRequest)
+    def handle_foo_bar(self, request):
+        self.db['request'] = request
+        return PhoxResponse(answer=request['answer'])
+
+    @request_type(Typed)
+    def handle_typed(self, request):
+        self.db['request'] = request
+        return PhoxResponse(answer=request['answer'])
+
+
+class DispatchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = BaseLisServer('4.2', '31415')
+        self.server.extend('dummy', DummyExt)
+
+    def test_route_by_type(self):
+        msg = PhoxRequest(type='foo-bar', answer=42)
+        resp = self.server.dispatch(str(msg))
+        self.assertEqual(resp['answer'], 42)
+
+    def test_handler_receives_decoded_message(self):
+        self.server.dispatch(str(PhoxRequest(type='foo-bar', answer=42)))
+        request = self.server.db['dummy']['request']
+        self.assertTrue(isinstance(request, PhoxRequest))
+        self.assertEqual(request.type, 'foo-bar')
+
+    def test_dispatch_stream(self):
+        data = StringIO(str(PhoxRequest(type='foo-bar', answer=42)))
+        resp = self.server.dispatch(data)
+        self.assertEqual(resp['answer'], 42)
+
+    def test_dispatch_element(self):
+        msg = PhoxRequest(type='foo-bar', answer=42)
+        resp = self.server.dispatch(msg.to_xml())
+        self.assertEqual(resp['answer'], 42)
+
+    def test_handler_accepts_xml_source(self):
+        msg = str(PhoxRequest(type='foo-bar', answer=42))
+        resp = self.server.ext_dummy.handle_foo_bar(msg)
+        self.assertEqual(resp['answer'], 42)
+
+    def test_typed_content(self):
+        resp = self.server.dispatch(
+            '<phox-request type="typed"><content><f n="answer" v="42"/>'
+            '<o n="since"><f n="stamp" v="100"/></o><f n="extra" v="1"/>'
+            '</content></phox-request>')
+        self.assertEqual(resp['answer'], 42)
+        request = self.server.db['dummy']['request']
+        self.assertEqual(request['since'], {'stamp': 100L})
+        self.assertEqual(request['extra'], '1')
+
+    def test_typed_content_invalid_value(self):
+        self.assertRaises(exceptions.RequestParsingError, self.server.dispatch,
+                          '<phox-request type="typed"><content>'
+                          '<f n="answer" v="foo"/></content></phox-request>')
+
+    def test_journal_filter_without_type_markers(self):
+        server = SimpleLISServer('4.2', '31415')
+        server.ext_reqs.set({'id': '1'}, 100)
+        server.ext_reqs.set({'id': '2'}, 200)
+        resp = server.dispatch(
+            '<phox-request type="registration-journal"><content>'
+            '<o n="filter"><f n="lastTimestamp" v="150"/></o>'
+            '</content></phox-request>')
+        self.assertEqual([item['id'] for item in resp['Request']], ['2'])
+
+    def test_no_processor(self):
+        self.assertRaises(exceptions.NoProcessorError, self.server.dispatch,
+                          str(PhoxRequest(type='bar-baz')))
+
+    def test_no_processor_before_parsing_whole_request(self):
+        self.assertRaises(exceptions.NoProcessorError, self.server.dispatch,
+                          '<phox-request type="bar-baz"><content>')
+
+    def test_missed_request_type(self):
+        self.assertRaises(exceptions.RequestParsingError, self.server.dispatch,
+                          '<phox-request><content/></phox-request>')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011 Alexander Shorin
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+
+import datetime
+import unittest
+from phoxpy import xml
+from phoxpy.server.directory import DirectoryItem
+from phoxpy.server.storage import JournalStorage, VersionedStore
+
+
+def ids(items):
+    return [item['id'] for item in items]
+
+
+class JournalStorageTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.db = JournalStorage()
+        self.db.set({'id': '1', 'timestamp': 30, 'hospital': '10',
+                     'department': '5', 'state': '1', 'nr': '0001',
+                     'lastName': u'Иванов',
+                     'date': datetime.datetime(2012, 1, 1)})
+        self.db.set({'id': '2', 'timestamp': 10, 'hospital': '10',
+                     'department': '6', 'state': '2', 'nr': '0002',
+                     'lastName': u'Петров',
+                     'date': datetime.datetime(2012, 1, 2)})
+        self.db.set({'id': '3', 'timestamp': 20, 'hospital': '11',
+                     'department': '5', 'state': '1', 'nr': '0003',
+                     'lastName': u'Иваненко',
+                     'date': datetime.datetime(2012, 1, 3)})
+
+    def test_values_ordered_by_timestamp(self):
+        self.assertEqual(ids(self.db.values()), ['2', '3', '1'])
+
+    def test_empty_filter(self):
+        self.assertEqual(ids(self.db.select({'states': [], 'nr': None})),
+                         ['2', '3', '1'])
+
+    def test_select_by_list(self):
+        self.assertEqual(ids(self.db.select({'hospitals': ['10']})), ['2', '1'])
+
+    def test_select_by_departments_object(self):
+        filter = {'departments': {'operator': 'OR', 'idList': ['5']}}
+        self.assertEqual(ids(self.db.select(filter)), ['3', '1'])
+
+    def test_select_by_nr(self):
+        self.assertEqual(ids(self.db.select({'nr': '0002'})), ['2'])
+
+    def test_select_by_name_prefix(self):
+        self.assertEqual(ids(self.db.select({'lastName': u'иван'})), ['3', '1'])
+
+    def test_intersection(self):
+        filter = {'hospitals': ['10'], 'states': ['1', '2'],
+                  'departments': {'idList': ['5']}}
+        self.assertEqual(ids(self.db.select(filter)), ['1'])
+
+    def test_no_matches(self):
+        filter = {'hospitals': ['11'], 'states': ['2']}
+        self.assertEqual(self.db.select(filter), [])
+
+    def test_last_timestamp(self):
+        self.assertEqual(ids(self.db.select({'lastTimestamp': 20})), ['3', '1'])
+
+    def test_dates_range(self):
+        filter = {'dateFrom': datetime.datetime(2012, 1, 2),
+                  'dateTill': datetime.datetime(2012, 1, 3)}
+        self.assertEqual(ids(self.db.select(filter)), ['2', '3'])
+
+    def test_ranges_with_indexes(self):
+        filter = {'dateTill': datetime.datetime(2012, 1, 2),
+                  'lastTimestamp': 15, 'hospitals': ['10']}
+        self.assertEqual(ids(self.db.select(filter)), ['1'])
+
+    def test_update_reindexes(self):
+        self.db.set({'id': '1', 'timestamp': 5, 'hospital': '11'})
+        self.assertEqual(ids(self.db.values()), ['1', '2', '3'])
+        self.assertEqual(ids(self.db.select({'hospitals': ['10']})), ['2'])
+        self.assertEqual(ids(self.db.select({'lastName': u'Иван'})), ['3'])
+
+    def test_same_timestamp_ordered_by_changes(self):
+        self.db.set({'id': '9', 'timestamp': 20})
+        self.db.set({'id': '0', 'timestamp': 20})
+        self.assertEqual(ids(self.db.values()), ['2', '3', '9', '0', '1'])
+        self.db.set({'id': '3', 'timestamp': 20})
+        self.assertEqual(ids(self.db.select({'lastTimestamp': 20})),
+                         ['9', '0', '3', '1'])
+
+    def test_update_with_repeated_id(self):
+        self.db.update([{'id': '4', 'timestamp': 40, 'hospital': '12'},
+                        {'id': '5', 'timestamp': 40},
+                        {'id': '4', 'timestamp': 50, 'hospital': '13'}])
+        self.assertEqual(ids(self.db.values()), ['2', '3', '1', '5', '4'])
+        self.assertEqual(self.db['4']['hospital'], '13')
+        self.assertEqual(self.db.select({'hospitals': ['12']}), [])
+        self.assertEqual(ids(self.db.select({'lastTimestamp': 40})),
+                         ['5', '4'])
+
+    def test_remove(self):
+        self.db.remove('3')
+        self.assertTrue('3' not in self.db)
+        self.assertEqual(ids(self.db.select({'hospitals': ['11']})), [])
+
+    def test_new_id(self):
+        self.assertEqual(self.db.new_id(), '4')
+        self.assertEqual(self.db.new_id(), '5')
+
+
+class VersionedStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.db = VersionedStore()
+
+    def test_commit_allocates_monotonic_ids(self):
+        ids, version = self.db.commit([{'id': '41'}, {}, {}])
+        self.assertEqual(ids, ['41', '42', '43'])
+        self.assertEqual(version, 1)
+
+    def test_commit_is_single_version(self):
+        self.db.commit([{}, {}])
+        self.db.commit([{}])
+        self.assertEqual(self.db.version, 2)
+
+    def test_empty_commit_keeps_version(self):
+        self.assertEqual(self.db.commit([]), ([], 0))
+
+    def test_commit_copies_items(self):
+        item = {'foo': 'bar'}
+        ids, version = self.db.commit([item])
+        self.assertEqual(item, {'foo': 'bar'})
+        self.assertEqual(self.db[ids[0]], {'id': ids[0], 'foo': 'bar'})
+        self.assertTrue(self.db[ids[0]] is not item)
+
+    def test_commit_lazy_items(self):
+        item = xml.decode('<o id="7"><f n="foo" t="I" v="1"/></o>', lazy=True)
+        ids, version = self.db.commit([item])
+        self.assertEqual(ids, ['7'])
+        self.assertEqual(type(self.db['7']), dict)
+        self.assertEqual(self.db['7'], {'id': '7', 'foo': 1})
+
+    def test_update_replaces_items(self):
+        ids, version = self.db.commit([{'foo': 'bar'}])
+        item = self.db[ids[0]]
+        version = self.db.update(ids, foo='baz')
+        self.assertEqual(version, 2)
+        self.assertEqual(item['foo'], 'bar')
+        self.assertEqual(self.db[ids[0]]['foo'], 'baz')
+
+    def test_changes(self):
+        self.db.commit([{'id': '1'}, {'id': '2'}])
+        self.db.commit([{'id': '3'}])
+        self.db.update(['1'], foo='bar')
+        self.assertEqual(self.db.changes(0), ['2', '3', '1'])
+        self.assertEqual(self.db.changes(1), ['3', '1'])
+        self.assertEqual(self.db.changes(3), [])
+
+    def test_changelog_limit(self):
+        self.db.changelog_limit = 2
+        for idx in range(5):
+            self.db.commit([{'id': str(idx)}])
+        self.assertEqual(self.db.changes(3), ['3', '4'])
+        self.assertEqual(self.db.changes(2), None)
+
+
+class DirectoryItemTestCase(unittest.TestCase):
+
+    def test_init(self):
+        dirdb = DirectoryItem('foo', {'id': '1'}, {'id': '2'})
+        self.assertEqual(dirdb.name, 'foo')
+        self.assertEqual(sorted(dirdb.keys()), ['1', '2'])
+        self.assertEqual(dirdb.version, 1)
+
+    def test_update_many(self):
+        dirdb = DirectoryItem('foo', {'id': '1'}, {'id': '2'})
+        ids, version = dirdb.update_many(['1', '2'], removed=True)
+        self.assertEqual(version, 2)
+        self.assertTrue(dirdb['1']['removed'])
+        self.assertEqual(dirdb.changes(1), ['1', '2'])
+
+    def test_get_by_lazy_item(self):
+        dirdb = DirectoryItem('foo', {'id': '1', 'foo': 'bar'})
+        item = xml.decode('<o id="1"/>', lazy=True)
+        self.assertEqual(dirdb.get(item), {'id': '1', 'foo': 'bar'})
+
+
+if __name__ == '__main__':
+    unittest.main()
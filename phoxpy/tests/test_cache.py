@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011 Alexander Shorin
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+
+import threading
+import time
+import unittest
+from phoxpy import cache
+from phoxpy.messages import PhoxRequest
+
+
+class RequestKeyTestCase(unittest.TestCase):
+
+    def test_ignore_session_id(self):
+        first = PhoxRequest(type='options-get', sessionid='1')
+        second = PhoxRequest(type='options-get', sessionid='2')
+        self.assertEqual(cache.request_key(first), cache.request_key(second))
+
+    def test_differ_by_content(self):
+        first = PhoxRequest(type='request-info', request='1')
+        second = PhoxRequest(type='request-info', request='2')
+        self.assertNotEqual(cache.request_key(first),
+                            cache.request_key(second))
+
+    def test_keep_message_session_id(self):
+        msg = PhoxRequest(type='options-get', sessionid='1')
+        cache.request_key(msg)
+        self.assertEqual(msg.sessionid, '1')
+
+
+class SingleFlightTestCase(unittest.TestCase):
+
+    def test_share_call(self):
+        flight = cache.SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+        def func():
+            calls.append(1)
+            started.set()
+            release.wait()
+            return 42
+        results = []
+        leader = threading.Thread(
+            target=lambda: results.append(flight.do('key', func)))
+        leader.start()
+        started.wait()
+        followers = [threading.Thread(
+            target=lambda: results.append(flight.do('key', func)))
+            for idx in range(5)]
+        for thread in followers:
+            thread.start()
+        time.sleep(0.05)
+        release.set()
+        for thread in [leader] + followers:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(results),
+                         [(42, False)] + [(42, True)] * 5)
+        self.assertEqual(len(flight), 0)
+
+    def test_propagate_error(self):
+        flight = cache.SingleFlight()
+        def func():
+            raise ValueError('boom')
+        self.assertRaises(ValueError, flight.do, 'key', func)
+        self.assertEqual(flight.do('key', lambda: 1), (1, False))
+
+
+class ResponseCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = cache.ResponseCache({'foo': 10, 'bar': 10}, max_size=10)
+        self.now = 0
+        self.cache.clock = lambda: self.now
+
+    def fetch(self, key, data, reqtype='foo'):
+        return self.cache.fetch(key, reqtype, lambda: data, lambda x: x)
+
+    def test_hit(self):
+        self.assertEqual(self.fetch('a', 'xxx'), 'xxx')
+        self.assertEqual(self.fetch('a', 'yyy'), 'xxx')
+        self.assertEqual(self.cache.stats()['hits'], 1)
+        self.assertEqual(self.cache.stats()['misses'], 1)
+        self.assertEqual(self.cache.hit_rate, 0.5)
+
+    def test_expire(self):
+        self.fetch('a', 'xxx')
+        self.now = 10
+        self.assertEqual(self.fetch('a', 'yyy'), 'yyy')
+        self.assertEqual(self.cache.size, 3)
+
+    def test_evict_least_recently_used(self):
+        self.fetch('a', 'xxxx')
+        self.fetch('b', 'yyyy')
+        self.fetch('a', '')
+        self.fetch('c', 'zzzz')
+        self.assertTrue('a' in self.cache)
+        self.assertFalse('b' in self.cache)
+        self.assertEqual(self.cache.size, 8)
+        self.assertEqual(self.cache.evictions, 1)
+
+    def test_skip_too_large(self):
+        self.fetch('a', 'x' * 11)
+        self.assertEqual(len(self.cache), 0)
+
+    def test_dont_store_undecodable(self):
+        def decode(data):
+            raise ValueError(data)
+        self.assertRaises(ValueError, self.cache.fetch, 'a', 'foo',
+                          lambda: 'xxx', decode)
+        self.assertEqual(len(self.cache), 0)
+
+    def test_invalidate(self):
+        self.fetch('a', 'xxx', 'foo')
+        self.fetch('b', 'yyy', 'bar')
+        self.cache.invalidate('foo')
+        self.assertFalse('a' in self.cache)
+        self.assertTrue('b' in self.cache)
+        self.assertEqual(self.cache.size, 3)
+        self.cache.clear()
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.cache.size, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
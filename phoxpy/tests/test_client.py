@@ -7,9 +7,18 @@
 # you should have received as part of this distribution.
 #
 
+import threading
+import time
 import unittest
+from phoxpy import cache
 from phoxpy import client
+from phoxpy import exceptions
+from phoxpy import http
+from phoxpy import xml
+from phoxpy.modules import directory
+from phoxpy.modules import requests
 from phoxpy.server import MockHttpSession, SimpleLISServer
+from phoxpy.server.httpd import error_response
 
 
 class SessionTestCase(unittest.TestCase):
@@ -44,6 +53,381 @@ class SessionTestCase(unittest.TestCase):
         session.close()
         self.assertFalse(session.is_active())
 
+    def test_intern_responses(self):
+        self.server.ext_dirs.add('foo', {'id': '1', 'state': 'DONE'})
+        session = client.Session(login='John', password='Doe',
+                                 client_id='foo-bar-baz',
+                                 intern=xml.InternTable())
+        session.open('localhost', http_session=self.http_session)
+        first = list(directory.load(session, 'foo'))[0]
+        second = list(directory.load(session, 'foo'))[0]
+        self.assertEqual(first, {'id': '1', 'state': 'DONE'})
+        self.assertTrue(first['state'] is second['state'])
+
+
+class RetryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = SimpleLISServer('4.2', '31415')
+        self.server.ext_auth.add_license('foo-bar-baz')
+        self.server.ext_auth.add_user('John', 'Doe')
+        self.server.ext_dirs.add('foo', {'id': '1', 'foo': 'bar'})
+        policy = http.RetryPolicy(backoff=0, breaker_threshold=None)
+        self.http_session = MockHttpSession(self.server, policy)
+        self.session = client.Session(login='John', password='Doe',
+                                      client_id='foo-bar-baz')
+        self.session.open('localhost', http_session=self.http_session)
+        self.failures = 0
+        dispatch = self.server.dispatch
+        def flaky_dispatch(xmlsrc):
+            if self.failures:
+                self.failures -= 1
+                raise exceptions.HibernateError('try later')
+            return dispatch(xmlsrc)
+        self.server.dispatch = flaky_dispatch
+
+    def test_retry_transient_error(self):
+        self.failures = 2
+        items = list(directory.load(self.session, 'foo'))
+        self.assertEqual(len(items), 1)
+        self.assertEqual(self.failures, 0)
+
+    def test_fail_after_max_retries(self):
+        self.failures = 4
+        self.assertRaises(exceptions.HibernateError,
+                          list, directory.load(self.session, 'foo'))
+
+    def test_dont_retry_not_idempotent_request(self):
+        self.failures = 1
+        self.assertRaises(exceptions.HibernateError, directory.store,
+                          self.session, 'foo', {'id': '1', 'foo': 'baz'})
+        self.assertEqual(self.server.ext_dirs['foo']['1']['foo'], 'bar')
+
+    def test_retry_request_marked_idempotent(self):
+        msg = directory.DirectoryRemove(directory='foo', ids=['1'])
+        msg = msg.to_message(type='directory-remove-new')
+        self.failures = 1
+        self.assertRaises(exceptions.HibernateError,
+                          self.session.request, body=msg)
+        self.assertFalse(self.server.ext_dirs['foo']['1'].get('removed'))
+        self.failures = 1
+        self.session.request(body=msg, idempotent=True)
+        self.assertTrue(self.server.ext_dirs['foo']['1']['removed'])
+
+    def test_dont_retry_permanent_error(self):
+        calls = []
+        def deny(xmlsrc):
+            calls.append(xmlsrc)
+            raise exceptions.AccessDeny('no way')
+        self.server.dispatch = deny
+        self.assertRaises(exceptions.AccessDeny,
+                          list, directory.load(self.session, 'foo'))
+        self.assertEqual(len(calls), 1)
+
+
+class CacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = SimpleLISServer('4.2', '31415')
+        self.server.ext_auth.add_license('foo-bar-baz')
+        self.server.ext_auth.add_user('John', 'Doe')
+        self.server.ext_dirs.add('foo', {'id': '1', 'foo': 'bar'})
+        self.http_session = MockHttpSession(self.server)
+        self.session = client.Session(login='John', password='Doe',
+                                      client_id='foo-bar-baz', cache=True)
+        self.session.open('localhost', http_session=self.http_session)
+        self.calls = []
+        dispatch = self.server.dispatch
+        def counting_dispatch(xmlsrc):
+            self.calls.append(xmlsrc)
+            return dispatch(xmlsrc)
+        self.server.dispatch = counting_dispatch
+
+    def test_cache_read_only_requests(self):
+        first = dict(directory.items(self.session))
+        second = dict(directory.items(self.session))
+        self.assertEqual(first, second)
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(self.session.cache.hits, 1)
+
+    def test_dont_cache_other_requests(self):
+        list(directory.load(self.session, 'foo'))
+        list(directory.load(self.session, 'foo'))
+        self.assertEqual(len(self.calls), 2)
+
+    def test_invalidate_on_store(self):
+        version = dict(directory.items(self.session))['foo']
+        directory.store(self.session, 'foo', {'id': '1', 'foo': 'baz'})
+        self.assertEqual(dict(directory.items(self.session))['foo'],
+                         version + 1)
+
+    def test_share_cache_between_sessions(self):
+        other = client.Session(login='John', password='Doe',
+                               client_id='foo-bar-baz',
+                               cache=self.session.cache)
+        other.open('localhost', http_session=self.http_session)
+        del self.calls[:]
+        dict(directory.items(self.session))
+        dict(directory.items(other))
+        self.assertEqual(len(self.calls), 1)
+
+    def test_dont_cache_errors(self):
+        dispatch = self.server.dispatch
+        def deny(xmlsrc):
+            dispatch(xmlsrc)
+            return error_response(exceptions.AccessDeny('no way'))
+        self.server.dispatch = deny
+        for idx in range(2):
+            self.assertRaises(exceptions.LisBaseException, dict,
+                              directory.items(self.session))
+        self.assertEqual(len(self.session.cache), 0)
+        self.assertEqual(len(self.calls), 2)
+
+
+class CoalesceTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = SimpleLISServer('4.2', '31415')
+        self.server.ext_auth.add_license('foo-bar-baz')
+        self.server.ext_auth.add_user('John', 'Doe')
+        self.server.ext_dirs.add('foo', {'id': '1', 'foo': 'bar'})
+        self.server.ext_reqs.set({'id': '1', 'nr': '42'})
+        self.http_session = MockHttpSession(self.server)
+        self.session = client.Session(login='John', password='Doe',
+                                      client_id='foo-bar-baz', coalesce=True)
+        self.session.open('localhost', http_session=self.http_session)
+        self.calls = []
+        self.release = threading.Event()
+        dispatch = self.server.dispatch
+        def slow_dispatch(xmlsrc):
+            self.calls.append(xmlsrc)
+            self.release.wait()
+            return dispatch(xmlsrc)
+        self.server.dispatch = slow_dispatch
+
+    def run_threads(self, func, count=5):
+        results = [None] * count
+        def worker(idx):
+            results[idx] = func()
+        threads = [threading.Thread(target=worker, args=(idx,))
+                   for idx in range(count)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.05)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_share_response(self):
+        results = self.run_threads(lambda: requests.load(self.session, '1'))
+        self.assertEqual(len(self.calls), 1)
+        for result in results:
+            self.assertEqual(result['nr'], '42')
+        self.assertEqual(len(set(map(id, results))), len(results))
+
+    def test_share_pristine_response(self):
+        changed = threading.Event()
+        class LateFlight(cache.SingleFlight):
+            def do(self, key, func):
+                result, shared = super(LateFlight, self).do(key, func)
+                if shared:
+                    changed.wait()
+                return result, shared
+        self.session.flight = LateFlight()
+        def load():
+            result = requests.load(self.session, '1')
+            nr = result['nr']
+            result['nr'] = 'changed'
+            changed.set()
+            return nr
+        results = self.run_threads(load)
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(results, ['42'] * 5)
+
+    def test_share_response_data(self):
+        results = self.run_threads(
+            lambda: list(directory.load(self.session, 'foo')))
+        self.assertEqual(len(self.calls), 1)
+        for result in results:
+            self.assertEqual(result, [{'id': '1', 'foo': 'bar'}])
+
+    def test_dont_coalesce_sequential_requests(self):
+        self.release.set()
+        requests.load(self.session, '1')
+        requests.load(self.session, '1')
+        self.assertEqual(len(self.calls), 2)
+
+    def test_dont_coalesce_changes(self):
+        results = self.run_threads(
+            lambda: directory.store(self.session, 'foo', {'foo': 'baz'}))
+        self.assertEqual(len(self.calls), 5)
+        self.assertEqual(len(set(idx for idx, version in results)), 5)
+
+
+class ReloginTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = SimpleLISServer('4.2', '31415')
+        self.server.check_sessions = True
+        self.server.ext_auth.add_license('foo-bar-baz')
+        self.server.ext_auth.add_user('John', 'Doe')
+        self.server.ext_dirs.add('foo', {'id': '1', 'foo': 'bar'})
+        self.http_session = MockHttpSession(self.server)
+        self.types = []
+        dispatch = self.server.dispatch
+        def tracking_dispatch(xmlsrc):
+            self.types.append(xml.load(xmlsrc).get('type'))
+            return dispatch(xmlsrc)
+        self.server.dispatch = tracking_dispatch
+
+    def make_session(self, **options):
+        session = client.Session(login='John', password='Doe',
+                                 client_id='foo-bar-baz', **options)
+        session.open('localhost', http_session=self.http_session)
+        self.addCleanup(session.stop_keepalive)
+        return session
+
+    def test_raise_without_relogin(self):
+        session = self.make_session()
+        self.server.ext_auth.expire()
+        self.assertRaises(exceptions.UnknownSession,
+                          list, directory.load(session, 'foo'))
+
+    def test_relogin_and_replay(self):
+        session = self.make_session(relogin=True)
+        sessionid = session.id
+        self.server.ext_auth.expire()
+        items = list(directory.load(session, 'foo'))
+        self.assertEqual(items, [{'id': '1', 'foo': 'bar'}])
+        self.assertNotEqual(session.id, sessionid)
+        self.assertEqual(self.types,
+                         ['login', 'directory', 'login', 'directory'])
+
+    def test_single_concurrent_relogin(self):
+        session = self.make_session(relogin=True)
+        self.server.ext_auth.expire()
+        errors = []
+        def worker():
+            try:
+                list(directory.load(session, 'foo'))
+            except Exception, err:
+                errors.append(err)
+        threads = [threading.Thread(target=worker) for idx in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(self.types.count('login'), 2)
+
+    def test_keepalive_pings_idle_session(self):
+        session = self.make_session(keepalive=0.01)
+        time.sleep(0.1)
+        self.assertTrue(session.keepalive_request in self.types)
+        session.close()
+        count = len(self.types)
+        time.sleep(0.05)
+        self.assertEqual(len(self.types), count)
+
+    def test_keepalive_bypass_cache(self):
+        session = self.make_session(keepalive=0.01, cache=True)
+        dict(directory.items(session))
+        time.sleep(0.1)
+        self.assertTrue(self.types.count('directory-versions') > 1)
+
+    def test_keepalive_relogin(self):
+        session = self.make_session(keepalive=0.01, relogin=True)
+        self.server.ext_auth.expire()
+        time.sleep(0.1)
+        self.assertEqual(self.types.count('login'), 2)
+        self.assertTrue(session.id in self.server.ext_auth.db['sessions'])
+
+
+class SessionPoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = SimpleLISServer('4.2', '31415')
+        self.server.check_sessions = True
+        self.server.ext_auth.add_license('foo-bar-baz')
+        self.server.ext_auth.add_license('baz-bar-foo')
+        self.server.ext_auth.add_user('John', 'Doe')
+        self.server.ext_auth.add_user('Jane', 'Roe')
+        self.server.ext_dirs.add('foo', {'id': '1', 'foo': 'bar'})
+        self.http_session = MockHttpSession(self.server)
+        self.credentials = {'login': 'John', 'password': 'Doe',
+                            'client_id': 'foo-bar-baz'}
+        self.pool = client.SessionPool(
+            'localhost',
+            [{'login': 'John', 'password': 'Doe', 'client_id': 'foo-bar-baz'},
+             {'login': 'Jane', 'password': 'Roe', 'client_id': 'baz-bar-foo'}],
+            size=4, http_session=self.http_session)
+
+    def test_login_on_first_use(self):
+        self.assertFalse(any(s.is_active() for s in self.pool.sessions))
+        with self.pool.session() as session:
+            self.assertTrue(session.is_active())
+        self.assertEqual(len(self.server.ext_auth.db['sessions']), 1)
+
+    def test_credentials_round_robin(self):
+        logins = [session.credentials['login']
+                  for session in self.pool.sessions]
+        self.assertEqual(logins, ['John', 'Jane', 'John', 'Jane'])
+
+    def test_spread_load(self):
+        used = [self.pool.call(lambda session: session)
+                for idx in range(8)]
+        self.assertEqual(used, self.pool.sessions * 2)
+        self.assertEqual(len(self.server.ext_auth.db['sessions']), 4)
+
+    def test_relogin_expired_session(self):
+        pool = client.SessionPool('localhost', self.credentials,
+                                  http_session=self.http_session)
+        items = pool.call(directory.load, 'foo')
+        self.assertEqual(items, [{'id': '1', 'foo': 'bar'}])
+        sessionid = pool.sessions[0].id
+        self.server.ext_auth.expire()
+        self.assertEqual(pool.call(directory.load, 'foo'), items)
+        self.assertNotEqual(pool.sessions[0].id, sessionid)
+
+    def test_relogin_after_context_error(self):
+        pool = client.SessionPool('localhost', self.credentials,
+                                  http_session=self.http_session)
+        with pool.session() as session:
+            pass
+        self.server.ext_auth.expire()
+        def load():
+            with pool.session() as session:
+                return list(directory.load(session, 'foo'))
+        self.assertRaises(exceptions.UnknownSession, load)
+        self.assertFalse(pool.sessions[0].is_active())
+        self.assertEqual(load(), [{'id': '1', 'foo': 'bar'}])
+
+    def test_concurrent_workers(self):
+        results = []
+        def worker():
+            for idx in range(10):
+                results.append(self.pool.call(directory.load, 'foo'))
+        threads = [threading.Thread(target=worker) for idx in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(results), 80)
+        self.assertEqual(len(self.server.ext_auth.db['sessions']), 4)
+
+    def test_acquire_timeout(self):
+        sessions = [self.pool.acquire() for idx in range(4)]
+        self.assertRaises(Exception, self.pool.acquire, 0.01)
+        for session in sessions:
+            self.pool.release(session)
+
+    def test_close(self):
+        self.pool.call(directory.load, 'foo')
+        self.pool.close()
+        self.assertFalse(any(s.is_active() for s in self.pool.sessions))
+        self.assertEqual(len(self.server.ext_auth.db['sessions']), 0)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011 Alexander Shorin
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+
+import datetime
+import unittest
+from StringIO import StringIO
+from phoxpy import columnar
+from phoxpy import exceptions
+from phoxpy import mapping
+from phoxpy import xml
+
+XML = '''<phox-response>
+<content><o>
+<f n="version" t="I" v="3"/>
+<s n="items">
+<o id="1"><f n="count" t="I" v="5"/><f n="price" t="F" v="1.5"/>
+<f n="name" v="foo"/><r n="kind" i="k1"/>
+<f n="date" t="D" v="01.02.2011 03:04:05"/>
+<s n="tags"><f v="a"/></s></o>
+<o id="2"><f n="count" t="I" v="7"/><f n="name" v="bar"/>
+<f n="removed" t="B" v="true"/></o>
+<o id="3"><f n="name" v="foo"/><f n="extra" t="I" v="1"/></o>
+</s>
+</o></content>
+</phox-response>'''
+
+
+class Item(mapping.Mapping):
+    count = mapping.IntegerField()
+    name = mapping.TextField()
+    kind = mapping.RefField()
+    tags = mapping.ListField(mapping.TextField())
+
+
+class BuildTestCase(unittest.TestCase):
+
+    def test_infer_columns(self):
+        table = columnar.build(XML, 'items')
+        self.assertEqual(len(table), 3)
+        self.assertEqual(table.names, ['id', 'count', 'price', 'name', 'kind',
+                                       'date', 'removed', 'extra'])
+        self.assertEqual(table['count'].kind, 'int')
+        self.assertEqual(table['price'].kind, 'float')
+        self.assertEqual(table['date'].kind, 'datetime')
+        self.assertEqual(table['removed'].kind, 'bool')
+        self.assertEqual(table['kind'].kind, 'text')
+
+    def test_values(self):
+        table = columnar.build(XML, 'items')
+        self.assertEqual(list(table['count']), [5, 7, None])
+        self.assertEqual(list(table['price']), [1.5, None, None])
+        self.assertEqual(list(table['kind']), ['k1', None, None])
+        self.assertEqual(list(table['extra']), [None, None, 1])
+        self.assertEqual(list(table['removed']), [None, True, None])
+        self.assertEqual(table['date'][0],
+                         datetime.datetime(2011, 2, 1, 3, 4, 5))
+
+    def test_text_dictionary(self):
+        table = columnar.build(XML, 'items')
+        column = table['name']
+        self.assertEqual(column.categories, ['foo', 'bar'])
+        self.assertEqual(list(column.data), [0, 1, 0])
+
+    def test_skip_removed(self):
+        table = columnar.build(XML, 'items', removed=False)
+        self.assertEqual(list(table['id']), ['1', '3'])
+
+    def test_fields_names(self):
+        table = columnar.build(XML, 'items', ['id', 'count'])
+        self.assertEqual(table.names, ['id', 'count'])
+
+    def test_fields_mapping(self):
+        table = columnar.build(XML, 'items', Item)
+        self.assertEqual(sorted(table.names), ['count', 'kind', 'name'])
+        self.assertEqual(list(table['count']), [5, 7, None])
+
+    def test_fields_kinds(self):
+        table = columnar.build(XML, 'items', {'count': 'float'})
+        self.assertEqual(list(table['count']), [5.0, 7.0, None])
+
+    def test_unknown_kind(self):
+        self.assertRaises(ValueError, columnar.build, XML, 'items',
+                          {'count': 'complex'})
+
+    def test_repeated_field(self):
+        xmlsrc = ('<s n="items">'
+                  '<o id="1"><f n="a" t="I" v="1"/><f n="a" t="I" v="2"/></o>'
+                  '<o id="2"><f n="a" t="I" v="3"/></o>'
+                  '</s>')
+        table = columnar.build(xmlsrc, 'items')
+        self.assertEqual(len(table['id']), len(table['a']))
+        self.assertEqual(list(table['a']), [2, 3])
+        self.assertEqual(list(table['a']),
+                         [item['a'] for item in xml.decode(xmlsrc)])
+
+    def test_missed_sequence(self):
+        table = columnar.build(XML, 'foo')
+        self.assertEqual(len(table), 0)
+
+    def test_error(self):
+        xmlsrc = ('<phox-response><error code="500" description="foo"/>'
+                  '</phox-response>')
+        self.assertRaises(exceptions.LisBaseException,
+                          columnar.build, xmlsrc, 'items')
+
+
+class ExportTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.table = columnar.build(XML, 'items')
+
+    def test_rows(self):
+        rows = list(self.table.rows())
+        self.assertEqual(rows[2][:4], ('3', None, None, 'foo'))
+
+    def test_csv(self):
+        output = StringIO()
+        columnar.build(XML, 'items', ['id', 'name', 'date']).to_csv(output)
+        self.assertEqual(output.getvalue().splitlines(), [
+            'id,name,date',
+            '1,foo,2011-02-01 03:04:05',
+            '2,bar,',
+            '3,foo,'
+        ])
+
+    def test_dump_load(self):
+        output = StringIO()
+        self.table.dump(output)
+        table = columnar.Table.load(StringIO(output.getvalue()))
+        self.assertEqual(table.names, self.table.names)
+        self.assertEqual(list(table.rows()), list(self.table.rows()))
+        self.assertEqual(table['name'].categories, ['foo', 'bar'])
+
+    def test_load_invalid(self):
+        self.assertRaises(ValueError, columnar.Table.load, StringIO('foo'))
+
+    def test_numpy(self):
+        if columnar.numpy is None:
+            return
+        arrays = self.table.to_numpy()
+        self.assertEqual(arrays['count'].sum(), 12)
+        self.assertEqual(list(arrays['removed']), [False, True, False])
+        self.assertEqual(str(arrays['date'][0]), '2011-02-01T03:04:05')
+
+
+if __name__ == '__main__':
+    unittest.main()
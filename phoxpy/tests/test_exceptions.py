@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011 Alexander Shorin
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+
+import unittest
+from phoxpy import exceptions
+from phoxpy.xmlcodec import PhoxResponseCodec
+
+
+class ExceptionsTestCase(unittest.TestCase):
+
+    def tearDown(self):
+        exceptions.REGISTRY.pop(9000, None)
+
+    def test_registry(self):
+        self.assertTrue(exceptions.get_error_class(501)
+                        is exceptions.UnknownSession)
+        self.assertTrue(exceptions.get_error_class(9000)
+                        is exceptions.LisBaseException)
+
+    def test_register_subclass(self):
+        class CustomError(exceptions.LisRequestError):
+            code = 9000
+        self.assertTrue(exceptions.get_error_class(9000) is CustomError)
+        self.assertTrue(CustomError.permanent)
+
+    def test_from_code(self):
+        err = exceptions.from_code(103, 'try later')
+        self.assertTrue(isinstance(err, exceptions.HibernateError))
+        self.assertEqual(err.description, 'try later')
+        err = exceptions.from_code(9000, 'custom')
+        self.assertEqual(type(err), exceptions.LisBaseException)
+        self.assertEqual(err.code, 9000)
+
+    def test_metadata(self):
+        self.assertTrue(exceptions.HibernateError.retryable)
+        self.assertTrue(exceptions.UnknownSession.invalidates_session)
+        self.assertTrue(exceptions.NotAuthorized.invalidates_session)
+        self.assertTrue(exceptions.AccessDeny.permanent)
+        self.assertFalse(exceptions.UnknownError.retryable)
+        self.assertFalse(exceptions.UnknownError.permanent)
+
+    def test_decode_error_response(self):
+        xmlsrc = ('<phox-response><error code="9000" description="oops"/>'
+                  '</phox-response>')
+        try:
+            PhoxResponseCodec.to_python(xmlsrc)
+        except exceptions.LisBaseException, err:
+            self.assertEqual(err.code, 9000)
+            self.assertEqual(err.description, 'oops')
+        else:
+            self.fail('LisBaseException expected')
+
+
+if __name__ == '__main__':
+    unittest.main()
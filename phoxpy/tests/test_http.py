@@ -9,12 +9,15 @@
 
 import errno
 import httplib as _httplib
+import io
 import socket
 import unittest
+import zlib
 try:
     from cStringIO import StringIO
 except ImportError:
     from StringIO import StringIO
+from phoxpy import exceptions
 from phoxpy import http
 
 http.CHUNK_SIZE = 16 * 1024 # reduce chunk size
@@ -24,6 +27,7 @@ class DummyHTTPConnection(object):
         self.headers = {}
         self.data = []
         self.request = None
+        self.sock = None
 
     def putrequest(self, *args, **kwargs):
         self.request = args, kwargs
@@ -83,6 +87,20 @@ class DummyHttpResponse(object):
         self.fp.read()
 
 
+class DummySocket(object):
+    def __init__(self, data):
+        self.stream = io.BytesIO(data)
+        self.received = []
+
+    def recv(self, size):
+        return self.stream.read(size)
+
+    def recv_into(self, buffer, nbytes=0):
+        size = self.stream.readinto(buffer)
+        self.received.append(size)
+        return size
+
+
 class Chain(object):
 
     def __init__(self, *funcs):
@@ -519,14 +537,14 @@ class SessionRequestsTestCase(SessionTestCase):
         session._send_request = _HTTP_RESPONSES['chunked']
         status, headers, data = session.request('GET', 'base/res')
         self.assertTrue(isinstance(data, http.ResponseBody))
-        self.assertEqual(list(data), ['foo', 'bar', 'baz'])
+        self.assertEqual(list(data), ['foobarbaz'])
 
     def test_chunked_response_could_read_once(self):
         session = http.Session()
         session._send_request = _HTTP_RESPONSES['chunked']
         status, headers, data = session.request('GET', 'base/res')
         self.assertTrue(isinstance(data, http.ResponseBody))
-        self.assertEqual(list(data), ['foo', 'bar', 'baz'])
+        self.assertEqual(list(data), ['foobarbaz'])
         self.assertEqual(list(data), [])
 
     def test_make_request_with_empty_body(self):
@@ -545,7 +563,7 @@ class SessionRequestsTestCase(SessionTestCase):
         self.assertEqual(resp.getheader('a'), 'b')
 
     def test_make_chunked_request(self):
-        session = http.Session()
+        session = http.Session(buffer_size=http.CHUNK_SIZE)
         data = StringIO('xx' * (http.CHUNK_SIZE))
         headers = {'Transfer-Encoding': 'chunked'}
         conn = DummyHTTPConnection(data='OK')
@@ -603,6 +621,146 @@ class SessionRequestsTestCase(SessionTestCase):
             self.assertRaises(socket.error, session.request,
                               'GET', '/foo/bar', None, {})
 
+    def test_dont_retry_not_idempotent_request(self):
+        calls = []
+        def getresponse():
+            calls.append(True)
+            raise socket.error(errno.ECONNRESET)
+        session = http.Session()
+        conn = DummyHTTPConnection()
+        conn.getresponse = getresponse
+        session._conns['/foo/bar'] = set([conn])
+        self.assertRaises(socket.error, session.request,
+                          'POST', '/foo/bar', 'data', {})
+        self.assertEqual(len(calls), 1)
+
+    def test_retry_not_idempotent_request_on_connect_error(self):
+        def getresponse(_=[]):
+            if not _:
+                _.append(True)
+                raise socket.error(errno.ECONNREFUSED)
+            return _HTTP_RESPONSES['small_data']()
+        session = http.Session()
+        conn = DummyHTTPConnection()
+        conn.getresponse = getresponse
+        session._conns['/foo/bar'] = set([conn])
+        session.request('POST', '/foo/bar', 'data', {})
+
+
+class RetryPolicyTestCase(unittest.TestCase):
+
+    def failing(self, *errors):
+        errors = list(errors)
+        def func():
+            func.calls += 1
+            if errors:
+                raise errors.pop(0)
+            return 'ok'
+        func.calls = 0
+        return func
+
+    def test_exponential_delays(self):
+        policy = http.RetryPolicy(max_retries=4, backoff=1, factor=2,
+                                  max_delay=5, jitter=0)
+        delays = [policy.delay(idx) for idx in range(5)]
+        self.assertEqual(delays, [1, 2, 4, 5, None])
+
+    def test_jitter(self):
+        policy = http.RetryPolicy(backoff=1, jitter=0.5)
+        for idx in range(100):
+            delay = policy.delay(0)
+            self.assertTrue(0.5 <= delay <= 1, delay)
+
+    def test_static_delays(self):
+        policy = http.RetryPolicy(delays=[0, 3])
+        self.assertEqual([policy.delay(idx) for idx in range(3)], [0, 3, None])
+
+    def test_retry_transient_errors(self):
+        policy = http.RetryPolicy(backoff=0)
+        func = self.failing(socket.error(errno.ECONNRESET),
+                            socket.error(errno.ETIMEDOUT))
+        self.assertEqual(policy.call(func, idempotent=True), 'ok')
+        self.assertEqual(func.calls, 3)
+
+    def test_dont_retry_other_errors(self):
+        policy = http.RetryPolicy(backoff=0)
+        func = self.failing(socket.error(errno.EBADF))
+        self.assertRaises(socket.error, policy.call, func, idempotent=True)
+        self.assertEqual(func.calls, 1)
+
+    def test_retry_errors_marked_retryable(self):
+        class Flaky(exceptions.LisBaseException):
+            code = 9001
+            retryable = True
+        policy = http.RetryPolicy(backoff=0)
+        func = self.failing(exceptions.HibernateError(), Flaky())
+        self.assertEqual(policy.call(func, idempotent=True), 'ok')
+        self.assertEqual(func.calls, 3)
+        func = self.failing(exceptions.AccessDeny())
+        self.assertRaises(exceptions.AccessDeny, policy.call, func,
+                          idempotent=True)
+        self.assertEqual(func.calls, 1)
+
+    def test_retryable_codes(self):
+        policy = http.RetryPolicy(backoff=0, retryable_codes=[400])
+        func = self.failing(exceptions.AccessDeny())
+        self.assertEqual(policy.call(func, idempotent=True), 'ok')
+        func = self.failing(exceptions.HibernateError())
+        self.assertRaises(exceptions.HibernateError, policy.call, func,
+                          idempotent=True)
+
+    def test_deadline(self):
+        policy = http.RetryPolicy(backoff=10, jitter=0, deadline=1)
+        func = self.failing(socket.error(errno.ECONNRESET))
+        self.assertRaises(socket.error, policy.call, func, idempotent=True)
+        self.assertEqual(func.calls, 1)
+
+    def test_budget(self):
+        budget = http.RetryBudget(ratio=0, reserve=1)
+        policy = http.RetryPolicy(backoff=0, budget=budget)
+        func = self.failing(*[socket.error(errno.ECONNRESET)] * 3)
+        self.assertRaises(socket.error, policy.call, func, idempotent=True)
+        self.assertEqual(func.calls, 2)
+
+    def test_budget_deposit_once_for_nested_calls(self):
+        budget = http.RetryBudget(ratio=0.5, reserve=10)
+        budget.balance = 0
+        policy = http.RetryPolicy(backoff=0, budget=budget)
+        inner = lambda: policy.call(lambda: 'ok', idempotent=True)
+        self.assertEqual(policy.call(inner, idempotent=True), 'ok')
+        self.assertEqual(budget.balance, 0.5)
+        policy.call(inner, idempotent=True)
+        self.assertEqual(budget.balance, 1)
+
+    def test_idempotent_requests(self):
+        policy = http.RetryPolicy()
+        self.assertTrue(policy.is_idempotent('directory'))
+        self.assertFalse(policy.is_idempotent('directory-save'))
+        self.assertFalse(policy.is_idempotent('directory-remove'))
+        self.assertFalse(policy.is_idempotent('login'))
+        self.assertFalse(policy.is_idempotent(None))
+
+    def test_circuit_breaker(self):
+        policy = http.RetryPolicy(max_retries=0, breaker_threshold=2,
+                                  breaker_timeout=60)
+        for idx in range(2):
+            func = self.failing(socket.error(errno.ECONNREFUSED))
+            self.assertRaises(socket.error, policy.call, func, 'localhost')
+        func = self.failing()
+        self.assertRaises(http.CircuitOpen, policy.call, func, 'localhost')
+        self.assertEqual(func.calls, 0)
+        self.assertEqual(policy.call(func, 'otherhost'), 'ok')
+
+    def test_circuit_breaker_probe(self):
+        policy = http.RetryPolicy(max_retries=0, breaker_threshold=1,
+                                  breaker_timeout=0)
+        func = self.failing(socket.error(errno.ECONNREFUSED))
+        self.assertRaises(socket.error, policy.call, func, 'localhost')
+        breaker = policy.breaker('localhost')
+        self.assertEqual(breaker.state, breaker.OPEN)
+        self.assertEqual(policy.call(func, 'localhost'), 'ok')
+        self.assertEqual(breaker.state, breaker.CLOSED)
+
 
 class ResponseBodyTestCase(unittest.TestCase):
 
@@ -643,7 +801,7 @@ class ResponseBodyTestCase(unittest.TestCase):
         self.assertTrue(rbody.is_chunked_transfer())
 
     def test_iterate_over_lines_of_chunks(self):
-        """should iterate over lines for each chunk in chunked response"""
+        """should iterate over lines of chunked response data"""
         resp = DummyHttpResponse(
             status=200,
             data='\r\n'.join(['\r\n'.join([hex(len(c)), c])
@@ -651,7 +809,17 @@ class ResponseBodyTestCase(unittest.TestCase):
             headers={'Transfer-Encoding': 'chunked'}
         )
         rbody = http.ResponseBody(resp, lambda: None)
-        self.assertEqual(list(rbody), ['foo', 'bar', 'bar', 'baz'])
+        self.assertEqual(list(rbody), ['foobar\n', 'barbaz'])
+
+    def test_iterate_over_lines_across_chunks(self):
+        """should join lines split by chunk boundaries"""
+        resp = DummyHttpResponse(
+            status=200,
+            data='5\r\nhello\r\n6\r\n world\r\n3\r\n\nab\r\n0\r\n\r\n',
+            headers={'Transfer-Encoding': 'chunked'}
+        )
+        rbody = http.ResponseBody(resp, lambda: None)
+        self.assertEqual(list(rbody), ['hello world\n', 'ab'])
 
     def test_iterate_over_lines(self):
         """should iterate over lines of data for regular response"""
@@ -693,6 +861,215 @@ class ResponseBodyTestCase(unittest.TestCase):
         rbody.close()
         self.assertEqual(callback.count, 1)
 
+    def chunked(self, *chunks):
+        data = ''.join('%x;ext=1\r\n%s\r\n' % (len(c), c) for c in chunks)
+        resp = DummyHttpResponse(200, data + '0\r\n\r\n',
+                                 {'Transfer-Encoding': 'chunked'})
+        return resp
+
+    def test_read_chunked_across_boundaries(self):
+        """should read chunked data by any portions"""
+        rbody = http.ResponseBody(self.chunked('foo', 'bar', 'baz'), None)
+        self.assertEqual(rbody.read(2), 'fo')
+        self.assertEqual(rbody.read(5), 'obarb')
+        self.assertEqual(rbody.read(), 'az')
+        self.assertTrue(rbody.is_closed())
+
+    def test_readinto(self):
+        """should fill preallocated buffer with decoded data"""
+        rbody = http.ResponseBody(self.chunked('foo', 'bar', 'baz'), None)
+        buf = bytearray(4)
+        data = []
+        while True:
+            size = rbody.readinto(buf)
+            if not size:
+                break
+            data.append(str(buf[:size]))
+        self.assertEqual(data, ['foob', 'arba', 'z'])
+
+    def test_readinto_raw(self):
+        """should fill buffer with data of regular response"""
+        rbody = http.ResponseBody(DummyHttpResponse(200, 'foo-bar'), None)
+        buf = bytearray(16)
+        self.assertEqual(rbody.readinto(buf), 7)
+        self.assertEqual(str(buf[:7]), 'foo-bar')
+        self.assertEqual(rbody.readinto(buf), 0)
+
+    def test_readinto_buffered_stream(self):
+        """should read directly into buffer if stream supports it"""
+        import io
+        resp = self.chunked('foo', 'bar')
+        resp.fp = io.BytesIO(resp.fp.getvalue())
+        rbody = http.ResponseBody(resp, None)
+        buf = bytearray(8)
+        self.assertEqual(rbody.readinto(buf), 6)
+        self.assertEqual(str(buf[:6]), 'foobar')
+
+    def test_readinto(self):
+        """should fill preallocated buffer with decoded data"""
+        rbody = http.ResponseBody(self.chunked('foo', 'bar', 'baz'), None)
+        buf = bytearray(4)
+        data = []
+        while True:
+            size = rbody.readinto(buf)
+            if not size:
+                break
+            data.append(str(buf[:size]))
+        self.assertEqual(data, ['foob', 'arba', 'z'])
+
+    def test_readinto_raw(self):
+        """should fill buffer with data of regular response"""
+        rbody = http.ResponseBody(DummyHttpResponse(200, 'foo-bar'), None)
+        buf = bytearray(16)
+        self.assertEqual(rbody.readinto(buf), 7)
+        self.assertEqual(str(buf[:7]), 'foo-bar')
+        self.assertEqual(rbody.readinto(buf), 0)
+
+    def test_readinto_buffered_stream(self):
+        """should read directly into buffer if stream supports it"""
+        resp = self.chunked('foo', 'bar')
+        resp.fp = io.BytesIO(resp.fp.getvalue())
+        rbody = http.ResponseBody(resp, None)
+        buf = bytearray(8)
+        self.assertEqual(rbody.readinto(buf), 6)
+        self.assertEqual(str(buf[:6]), 'foobar')
+
+    def test_readinto_socket_file(self):
+        """should receive data into buffer by socket of socket file"""
+        resp = self.chunked('foo', 'bar')
+        sock = DummySocket(resp.fp.getvalue())
+        resp.fp = socket._fileobject(sock, 'rb', 0)
+        rbody = http.ResponseBody(resp, None)
+        buf = bytearray(8)
+        self.assertEqual(rbody.readinto(buf), 6)
+        self.assertEqual(str(buf[:6]), 'foobar')
+        self.assertEqual(sock.received, [3, 3])
+
+    def test_readinto_content_length(self):
+        """should not read past content length of regular response"""
+        resp = DummyHttpResponse(200, 'foo-bar-baz')
+        resp.fp = io.BytesIO(resp.fp.getvalue())
+        resp.length = 7
+        rbody = http.ResponseBody(resp, None)
+        buf = bytearray(16)
+        self.assertEqual(rbody.readinto(buf), 7)
+        self.assertEqual(str(buf[:7]), 'foo-bar')
+        self.assertEqual(resp.length, 0)
+        self.assertEqual(rbody.readinto(buf), 0)
+
+    def test_bounded_reads(self):
+        """should not read more than buffer size from connection at once"""
+        resp = self.chunked('x' * 100)
+        fp, reads = resp.fp, []
+        class RecordingFile(object):
+            readline = fp.readline
+            def read(self, size=-1):
+                reads.append(size)
+                return fp.read(size)
+        resp.fp = RecordingFile()
+        rbody = http.ResponseBody(resp, None, buffer_size=16)
+        self.assertEqual(rbody.read(), 'x' * 100)
+        self.assertTrue(max(reads) <= 16)
+
+    def test_callback_on_end_of_data(self):
+        """should call callback once all data has been read"""
+        calls = []
+        rbody = http.ResponseBody(self.chunked('foo'), lambda: calls.append(1))
+        rbody.read(3)
+        self.assertEqual(calls, [])
+        rbody.read(1)
+        self.assertEqual(calls, [1])
+        rbody.close()
+        self.assertEqual(calls, [1])
+
+    def test_readline_chunked(self):
+        """should read lines across chunk boundaries"""
+        rbody = http.ResponseBody(self.chunked('foo\nb', 'ar\n', 'baz'), None)
+        self.assertEqual(list(rbody.readlines()), ['foo\n', 'bar\n', 'baz'])
+
+
+class DecompressingBodyTestCase(unittest.TestCase):
+
+    data = '\n'.join(['line %d' % idx for idx in range(10000)])
+
+    def test_gzip(self):
+        resp = DummyHttpResponse(200, http.gzip_compress(self.data))
+        body = http.DecompressingBody(resp, 'gzip')
+        self.assertEqual(body.read(), self.data)
+        self.assertTrue(body.is_closed())
+
+    def test_deflate(self):
+        resp = DummyHttpResponse(200, zlib.compress(self.data))
+        body = http.DecompressingBody(resp, 'deflate')
+        self.assertEqual(body.read(), self.data)
+
+    def test_raw_deflate(self):
+        zobj = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+        resp = DummyHttpResponse(200, zobj.compress(self.data) + zobj.flush())
+        body = http.DecompressingBody(resp, 'deflate')
+        self.assertEqual(body.read(), self.data)
+
+    def test_read_chunks(self):
+        resp = DummyHttpResponse(200, http.gzip_compress(self.data))
+        body = http.DecompressingBody(resp, 'gzip')
+        chunks = []
+        while True:
+            chunk = body.read(100)
+            if not chunk:
+                break
+            self.assertTrue(len(chunk) <= 100)
+            chunks.append(chunk)
+        self.assertEqual(''.join(chunks), self.data)
+
+    def test_iterate_over_lines(self):
+        resp = DummyHttpResponse(200, http.gzip_compress(self.data))
+        body = http.DecompressingBody(resp, 'gzip')
+        self.assertEqual(list(body), self.data.splitlines(True))
+
+    def test_readline_size(self):
+        data = 'x' * 100000 + '\nfoo\nbar'
+        resp = DummyHttpResponse(200, http.gzip_compress(data))
+        body = http.DecompressingBody(resp, 'gzip')
+        self.assertEqual(body.readline(10), 'x' * 10)
+        self.assertTrue(len(body._buffer) < 10)
+        self.assertEqual(body.readline(), 'x' * 99990 + '\n')
+        self.assertEqual(body.readline(10), 'foo\n')
+        self.assertEqual(body.readline(2), 'ba')
+        self.assertEqual(body.readline(-1), 'r')
+        self.assertEqual(body.readline(), '')
+
+    def test_callback(self):
+        calls = []
+        resp = DummyHttpResponse(200, http.gzip_compress(self.data))
+        body = http.DecompressingBody(resp, 'gzip', lambda: calls.append(1))
+        body.close()
+        body.close()
+        self.assertEqual(calls, [1])
+
+    def test_handle_compressed_response(self):
+        session = http.Session()
+        resp = DummyHttpResponse(200, http.gzip_compress(self.data),
+                                 {'Content-Encoding': 'gzip'})
+        status, headers, data = session._handle_response(
+            'GET', resp, lambda: None)
+        self.assertTrue(isinstance(data, http.DecompressingBody))
+        self.assertEqual(data.read(), self.data)
+
+    def test_accept_encoding(self):
+        session = http.Session(compression=True)
+        headers = session._prerare_request('GET', 'foo', None, None, None)[3]
+        self.assertEqual(headers['Accept-Encoding'], 'gzip, deflate')
+
+    def test_compress_request_body(self):
+        session = http.Session(compress_threshold=100)
+        res = session._prerare_request('POST', 'foo', self.data, None, None)
+        body, headers = res[2:4]
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        self.assertEqual(headers['Content-Length'], str(len(body)))
+        self.assertEqual(zlib.decompress(body, 16 + zlib.MAX_WBITS), self.data)
+        res = session._prerare_request('POST', 'foo', 'small', None, None)
+        self.assertTrue('Content-Encoding' not in res[3])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011 Alexander Shorin
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+
+import unittest
+from StringIO import StringIO
+from phoxpy import client
+from phoxpy import parallel
+from phoxpy import xml
+from phoxpy.modules import directory
+from phoxpy.server import MockHttpSession, SimpleLISServer
+from phoxpy.xmlcodec import DirectoryResponseCodec
+
+
+class SplitTestCase(unittest.TestCase):
+
+    def test_split_items(self):
+        skeleton, parts = parallel.split(
+            '<o><s n="a"><o><f n="x" v="1"/></o><o/><o n="x"></o></s></o>', 2)
+        self.assertEqual(skeleton, '<o><s n="a" phoxpy-part="0"></s></o>')
+        self.assertEqual(parts, [['<o><f n="x" v="1"/></o><o/>',
+                                  '<o n="x"></o>']])
+
+    def test_keep_nested_sequences(self):
+        xmlsrc = '<s n="a"><s><f v="1"/><f v="2"/></s><s/></s>'
+        skeleton, parts = parallel.split(xmlsrc, 1)
+        self.assertEqual(parts, [['<s><f v="1"/><f v="2"/></s>', '<s/>']])
+
+    def test_keep_small_sequences(self):
+        xmlsrc = '<o><s n="a"><f v="1"/></s><s n="b"><f/><f/></s></o>'
+        skeleton, parts = parallel.split(xmlsrc, 1, min_items=2)
+        self.assertEqual(skeleton,
+                         '<o><s n="a"><f v="1"/></s>'
+                         '<s n="b" phoxpy-part="0"></s></o>')
+        self.assertEqual(parts, [['<f/>', '<f/>']])
+
+    def test_skip_comments_and_quoted_brackets(self):
+        xmlsrc = ('<?xml version="1.0"?><!-- <s> --><s n="a">'
+                  '<f v="a > b"/><!-- </s> --><f v=\'/>\'/></s>')
+        skeleton, parts = parallel.split(xmlsrc, 1)
+        self.assertEqual(parts, [['<f v="a > b"/>',
+                                  '<!-- </s> --><f v=\'/>\'/>']])
+
+    def test_split_blocks(self):
+        xmlsrc = ('<?xml version="1.0"?>\n<!-- <s> --><o><s n="a">'
+                  '<f v="a > b"/><!-- </s> --><f v=\'/>\'/>'
+                  '<![CDATA[ <o> ]]><f/></s><s n="b"><f/></s></o>')
+        for size in (1, 2, 7, len(xmlsrc)):
+            blocks = [xmlsrc[idx:idx + size]
+                      for idx in xrange(0, len(xmlsrc), size)]
+            parts = []
+            skeleton = parallel.split_blocks(
+                blocks, lambda idx, chunk: parts.append((idx, chunk)), 2)
+            self.assertEqual(
+                (skeleton, [[chunk for idx, chunk in parts]]),
+                parallel.split(xmlsrc, 2))
+
+
+class ParallelDecoderTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.decoder = parallel.ParallelDecoder(processes=2, chunk_size=3)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.decoder.close()
+
+    def make_response(self, count):
+        items = [{'id': str(idx), 'name': u'Услуга %d' % idx,
+                  'tags': ['a', 'b']}
+                 for idx in xrange(count)]
+        root = xml.Element('phox-response')
+        content = xml.encode({'version': 1, 'items': items})
+        content.tag = 'content'
+        root.append(content)
+        return xml.dump(root), items
+
+    def test_decode(self):
+        xmlsrc, items = self.make_response(10)
+        stream = self.decoder.make_stream(StringIO(xmlsrc))
+        self.assertTrue(stream.parts)
+        resp = xml.decode(stream)
+        self.assertEqual(resp['items'], items)
+        self.assertEqual(resp['version'], 1)
+
+    def test_decode_projected(self):
+        xmlsrc, items = self.make_response(10)
+        stream = xml.project(self.decoder.make_stream(xmlsrc), ['id'], 3)
+        self.assertTrue(stream.parts)
+        resp = xml.decode(stream)
+        self.assertEqual(resp['items'], [{'id': item['id']} for item in items])
+
+    def test_decode_while_reading(self):
+        xmlsrc, items = self.make_response(10)
+        events = []
+        class Source(object):
+            def __init__(self, data):
+                self.data = data
+            def read(self, size):
+                data, self.data = self.data[:50], self.data[50:]
+                events.append('read')
+                return data
+        class Task(object):
+            def __init__(self, func, args):
+                self.result = func(*args)
+            def get(self):
+                return self.result
+        class Pool(object):
+            def apply_async(self, func, args):
+                events.append('task')
+                return Task(func, args)
+        decoder = parallel.ParallelDecoder(chunk_size=3)
+        decoder._pool = Pool()
+        stream = decoder.make_stream(Source(xmlsrc))
+        self.assertEqual(events.count('task'), 4)
+        self.assertTrue(events.index('task') < len(events) / 2)
+        self.assertEqual(xml.decode(stream)['items'], items)
+
+    def test_decode_small(self):
+        xmlsrc, items = self.make_response(2)
+        stream = self.decoder.make_stream(xmlsrc)
+        self.assertFalse(getattr(stream, 'parts', None))
+        self.assertEqual(xml.decode(stream)['items'], items)
+
+    def test_session_request(self):
+        server = SimpleLISServer('4.2', '31415')
+        server.ext_auth.add_license('foo-bar-baz')
+        server.ext_auth.add_user('John', 'Doe')
+        server.ext_dirs.add('foo', *[{'id': str(idx), 'name': u'Имя'}
+                                     for idx in xrange(1, 11)])
+        session = client.Session(login='John', password='Doe',
+                                 client_id='foo-bar-baz')
+        session.open('localhost', http_session=MockHttpSession(server))
+        msg = directory.DirectoryLoad(name='foo').to_message(type='directory')
+        resp = session.request(body=msg, wrapper=DirectoryResponseCodec)
+        expected = list(resp['foo'])
+        resp = session.request(body=msg, wrapper=DirectoryResponseCodec,
+                               parallel=self.decoder)
+        items = list(resp['foo'])
+        self.assertEqual(items, expected)
+        self.assertEqual(items[0]['name'], u'Имя')
+
+
+class DefaultDecoderTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.decoder = parallel._default_decoder
+        self.register = parallel.atexit.register
+        self.registered = []
+        parallel._default_decoder = None
+        parallel.atexit.register = self.registered.append
+
+    def tearDown(self):
+        parallel._default_decoder = self.decoder
+        parallel.atexit.register = self.register
+
+    def test_close_at_exit(self):
+        decoder = parallel.default_decoder()
+        self.assertTrue(parallel.default_decoder() is decoder)
+        self.assertEqual(self.registered, [decoder.close])
+
+
+if __name__ == '__main__':
+    unittest.main()
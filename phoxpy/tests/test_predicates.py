@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011 Alexander Shorin
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+
+import unittest
+from phoxpy.predicates import F
+from phoxpy.xmlcodec import Reference
+
+
+class PredicatesTestCase(unittest.TestCase):
+
+    obj = {'id': '1', 'code': 'A1', 'price': 15,
+           'department': Reference('7'),
+           'groups': [Reference('2'), Reference('3')]}
+
+    def test_equality(self):
+        self.assertTrue((F('code') == 'A1')(self.obj))
+        self.assertFalse((F('code') != 'A1')(self.obj))
+        self.assertTrue((F('missed') == None)(self.obj))
+
+    def test_ranges(self):
+        self.assertTrue((F('price') >= 15)(self.obj))
+        self.assertFalse((F('price') < 15)(self.obj))
+        self.assertTrue(F('price').between(10, 20)(self.obj))
+        self.assertTrue(F('price').between(high=15)(self.obj))
+        self.assertFalse(F('price').between(16)(self.obj))
+        self.assertFalse((F('missed') < 1)(self.obj))
+
+    def test_references(self):
+        self.assertTrue(F('department').in_(['7', '8'])(self.obj))
+        self.assertTrue(F('groups').contains('3', '4')(self.obj))
+        self.assertFalse(F('groups').contains('4')(self.obj))
+        self.assertFalse(F('missed').contains('4')(self.obj))
+
+    def test_combinators(self):
+        match = (F('code') == 'B') | ~F('removed') & F('price').exists()
+        self.assertTrue(match(self.obj))
+        self.assertFalse((~match)(self.obj))
+        self.assertEqual(match.fields, set(['code', 'removed', 'price']))
+
+    def test_ids(self):
+        self.assertEqual((F('id') == '1').ids(), set(['1']))
+        self.assertEqual(F('code').in_(['1']).ids(), None)
+        match = F('id').in_(['1', '2']) & (F('code') == 'A1')
+        self.assertEqual(match.ids(), set(['1', '2']))
+        match = F('id').in_(['1', '2']) & F('id').in_(['2', '3'])
+        self.assertEqual(match.ids(), set(['2']))
+        match = (F('id') == '1') | (F('id') == '2')
+        self.assertEqual(match.ids(), set(['1', '2']))
+        match = (F('id') == '1') | (F('code') == 'A1')
+        self.assertEqual(match.ids(), None)
+        self.assertEqual((F('id') != '1').ids(), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
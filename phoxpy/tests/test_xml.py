@@ -7,9 +7,17 @@
 # you should have received as part of this distribution.
 #
 
+import collections
+import json
+import os
+import pickle
+import subprocess
+import sys
+import threading
 import unittest
 from StringIO import StringIO
 from phoxpy import xml
+from phoxpy.xmlobjects import Attribute, Reference, LazyObject
 
 class XMLTestsMixIn(object):
 
@@ -130,6 +138,47 @@ class XMLTestsMixIn(object):
             self.assertEqual(expected_output[idx], (event, tagname))
 
 
+    def test_decode(self):
+        data = {'items': [{'id': '1', 'name': u'\u0438\u043c\u044f',
+                           'dep': Reference('42'), 'tags': ['a', 'b']}],
+                'count': 1}
+        xmlsrc = xml.dump(xml.encode(data))
+        self.assertEqual(xml.decode(xmlsrc), data)
+        self.assertEqual(xml.decode(xmlsrc, lazy=True), data)
+        self.assertEqual(xml.decode(xml.make_stream(xmlsrc, pull=True)), data)
+
+    def test_decode_projection(self):
+        xmlsrc = ('<o><s n="items"><o id="1"><f n="a" v="1"/>'
+                  '<o n="c"><f n="a" v="2"/><f n="d" v="3"/></o></o>'
+                  '</s><f n="b" v="5"/></o>')
+        for lazy in (False, True):
+            stream = xml.make_stream(xmlsrc, lazy=lazy)
+            obj = xml.decode(xml.project(stream, ['a'], 2))
+            self.assertEqual(obj, {'items': [{'a': '1'}], 'b': '5'})
+
+    def test_decode_passthrough(self):
+        data = {'items': [{'id': 1, 'blob': u'\u0438\u043c\u044f',
+                           'name': u'\u0438\u043c\u044f'}]}
+        xmlsrc = xml.dump(xml.encode(data))
+        expected = {'items': [{'id': '1', 'blob': '\xd0\xb8\xd0\xbc\xd1\x8f',
+                               'name': u'\u0438\u043c\u044f'}]}
+        for lazy in (False, True):
+            stream = xml.make_stream(xmlsrc, lazy=lazy)
+            obj = xml.decode(xml.passthrough(stream, ['id', 'blob']))
+            self.assertEqual(obj, expected)
+        stream = xml.make_stream(xmlsrc, pull=True)
+        self.assertEqual(xml.decode(xml.passthrough(stream, ['id', 'blob'])),
+                         expected)
+        # passed through values lose their types, but not content
+        data['items'][0]['id'] = '1'
+        self.assertEqual(xml.decode(xml.dump(xml.encode(obj))), data)
+
+    def test_dump_single_declaration(self):
+        xmlsrc = xml.dump(xml.encode(u'\u0438\u043c\u044f'))
+        self.assertEqual(xmlsrc.count('<?xml'), 1)
+        self.assertTrue('\xe8\xec\xff' in xmlsrc)
+
+
 class LxmlTestCase(unittest.TestCase, XMLTestsMixIn):
 
     def test_dump_element(self):
@@ -174,5 +223,359 @@ class LxmlTestCase(unittest.TestCase, XMLTestsMixIn):
         )
 
 
+class CElementTreeTestCase(unittest.TestCase, XMLTestsMixIn):
+
+    backend = 'cElementTree'
+
+    def setUp(self):
+        xml.use(self.backend)
+
+    def tearDown(self):
+        xml.use('lxml')
+
+
+class ExpatTestCase(CElementTreeTestCase):
+
+    backend = 'expat'
+
+    def test_pull_elements(self):
+        stream = xml.pull(StringIO("<?xml version='1.0' encoding='Windows-1251'?>"
+                                   "<s><f n='a' v='\xcf\xf0'/></s>"))
+        event, root = stream.next()
+        event, elem = stream.next()
+        self.assertTrue(isinstance(elem, xml.PullElement))
+        self.assertTrue(elem.getparent() is root)
+        self.assertEqual(elem.get('v'), u'\u041f\u0440')
+        self.assertEqual(type(elem.get('n')), str)
+
+
+class UseTestCase(unittest.TestCase):
+
+    def test_unknown_backend(self):
+        self.assertRaises(ValueError, xml.use, 'minidom')
+        self.assertEqual(xml._using, 'lxml')
+
+
+class InternTestCase(unittest.TestCase):
+
+    xmlsrc = ('<s>'
+              '<o id="1"><f n="state" v="DONE"/><r n="dep" i="42"/></o>'
+              '<o id="2"><f n="state" v="DONE"/><r n="dep" i="42"/></o>'
+              '</s>')
+
+    def test_deduplicate_values(self):
+        first, second = list(xml.decode(self.xmlsrc, intern=True))
+        self.assertEqual(first, {'id': '1', 'state': 'DONE', 'dep': '42'})
+        self.assertTrue(first['state'] is second['state'])
+        self.assertTrue(first['dep'] is second['dep'])
+        self.assertTrue(isinstance(second['dep'], Reference))
+        self.assertTrue(isinstance(second['id'], Attribute))
+        keys = dict((key, key) for key in first)
+        for key in second:
+            self.assertTrue(keys[key] is key)
+
+    def test_no_interning_by_default(self):
+        first, second = list(xml.decode(self.xmlsrc))
+        self.assertFalse(first['dep'] is second['dep'])
+
+    def test_shared_table(self):
+        table = xml.InternTable()
+        first = list(xml.decode(self.xmlsrc, intern=table))
+        second = list(xml.decode(self.xmlsrc, intern=table))
+        self.assertTrue(first[0]['dep'] is second[1]['dep'])
+
+    def test_keep_reference_and_string_apart(self):
+        table = xml.InternTable()
+        self.assertEqual(type(table('42')), str)
+        self.assertEqual(type(table('42', Reference)), Reference)
+        self.assertEqual(type(table('42')), str)
+
+    def test_size_limit(self):
+        table = xml.InternTable(size=2, max_length=3)
+        for value in ['ab', 'cd', 'ef', 'long']:
+            table(unicode(value))
+        self.assertEqual(len(table), 1)
+        self.assertTrue(table(unicode('ef')) is table(unicode('ef')))
+        self.assertTrue(table(unicode('long')) is not table(unicode('long')))
+        self.assertTrue(table(unicode('ab')) is table(unicode('ab')))
+        self.assertEqual(len(table), 2)
+
+    def test_shared_between_threads(self):
+        table = xml.InternTable()
+        values = [unicode(idx) for idx in range(1000)]
+        results = []
+        def worker():
+            results.append([table(unicode(value)) for value in values])
+        interval = sys.getcheckinterval()
+        sys.setcheckinterval(1)
+        try:
+            threads = [threading.Thread(target=worker) for idx in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setcheckinterval(interval)
+        self.assertEqual(len(table), len(values))
+        for result in results[1:]:
+            for first, other in zip(results[0], result):
+                self.assertTrue(first is other)
+
+
+class LazyDecodeTestCase(unittest.TestCase):
+
+    xmlsrc = ('<s>'
+              '<o id="1"><f n="count" t="I" v="5"/><r n="dep" i="42"/>'
+              '<s n="tags"><f v="a"/><o><f n="x" t="B" v="true"/></o></s>'
+              '<o n="info"><f n="name" v="foo"/></o></o>'
+              '</s>')
+
+    def decode(self, **options):
+        return list(xml.decode(self.xmlsrc, lazy=True, **options))[0]
+
+    def raw(self, obj, key):
+        return obj._fields[key]
+
+    def test_lazy_object(self):
+        obj = self.decode()
+        self.assertTrue(isinstance(obj, LazyObject))
+        self.assertEqual(sorted(obj), ['count', 'dep', 'id', 'info', 'tags'])
+        self.assertTrue(isinstance(self.raw(obj, 'count'), xml.ElementType))
+        self.assertTrue(isinstance(self.raw(obj, 'id'), Attribute))
+
+    def test_decode_on_access(self):
+        obj = self.decode()
+        self.assertEqual(obj['count'], 5)
+        self.assertEqual(self.raw(obj, 'count'), 5)
+        self.assertTrue(isinstance(self.raw(obj, 'tags'), xml.ElementType))
+        self.assertTrue(isinstance(obj.get('dep'), Reference))
+        self.assertEqual(obj.get('missed', 42), 42)
+
+    def test_nested_values(self):
+        obj = self.decode()
+        self.assertEqual(obj['tags'], ['a', {'x': True}])
+        self.assertEqual(obj['info'], {'name': 'foo'})
+
+    def test_same_as_eager(self):
+        eager = list(xml.decode(self.xmlsrc))[0]
+        self.assertEqual(self.decode(), eager)
+        self.assertEqual(eager, self.decode())
+        self.assertEqual(sorted(self.decode().items()), sorted(eager.items()))
+        self.assertEqual(self.decode().copy(), eager)
+        self.assertEqual(repr(self.decode()), repr(eager))
+
+    def test_dict_copies(self):
+        eager = list(xml.decode(self.xmlsrc))[0]
+        self.assertEqual(dict(self.decode()), eager)
+        data = {}
+        data.update(self.decode())
+        self.assertEqual(data, eager)
+        self.assertEqual((lambda **kwargs: kwargs)(**self.decode()), eager)
+        self.assertEqual(type(dict(self.decode())['count']), int)
+
+    def test_encode(self):
+        eager = list(xml.decode(self.xmlsrc))[0]
+        self.assertEqual(xml.dump(xml.encode(self.decode())),
+                         xml.dump(xml.encode(eager)))
+
+    def test_pop(self):
+        obj = self.decode()
+        self.assertEqual(obj.pop('count'), 5)
+        self.assertFalse('count' in obj)
+        self.assertEqual(obj.pop('count', None), None)
+
+    def test_pickle(self):
+        obj = pickle.loads(pickle.dumps(self.decode(), 2))
+        self.assertEqual(type(obj), dict)
+        self.assertEqual(obj['count'], 5)
+
+    def test_mapping(self):
+        obj = self.decode()
+        self.assertTrue(isinstance(obj, collections.MutableMapping))
+        self.assertFalse(isinstance(obj, dict))
+
+    def test_json(self):
+        eager = list(xml.decode(self.xmlsrc))[0]
+        self.assertEqual(json.loads(json.dumps(self.decode(), default=dict)),
+                         json.loads(json.dumps(eager)))
+
+    def test_skip_comments(self):
+        obj = xml.decode('<o><!-- foo --><f n="x" v="1"/></o>', lazy=True)
+        self.assertEqual(obj, {'x': '1'})
+
+    def test_unnamed_field(self):
+        self.assertRaises(ValueError, xml.decode, '<o><f v="1"/></o>',
+                          lazy=True)
+
+    def test_intern(self):
+        table = xml.InternTable()
+        first, second = self.decode(intern=table), self.decode(intern=table)
+        self.assertTrue(first['dep'] is second['dep'])
+
+
+class ProjectionTestCase(unittest.TestCase):
+
+    xmlsrc = ('<o><s n="items">'
+              '<o id="1"><f n="a" v="1"/><s n="b"><f v="x"/></s>'
+              '<o n="c"><f n="a" v="2"/><f n="d" v="3"/></o></o>'
+              '</s><f n="a" v="4"/><f n="b" v="5"/></o>')
+
+    def test_project_items(self):
+        obj = xml.decode(xml.project(self.xmlsrc, ['a', 'c'], 2))
+        self.assertEqual(obj, {'items': [{'a': '1', 'c': {'a': '2', 'd': '3'}}],
+                               'a': '4', 'b': '5'})
+
+    def test_project_attributes(self):
+        obj = xml.decode(xml.project(self.xmlsrc, ['id'], 2))
+        self.assertEqual(obj['items'], [{'id': '1'}])
+
+    def test_project_root(self):
+        obj = xml.decode(xml.project(self.xmlsrc, ['b'], 0))
+        self.assertEqual(obj, {'b': '5'})
+
+    def test_project_lazy(self):
+        stream = xml.project(xml.make_stream(self.xmlsrc, lazy=True), ['a'], 2)
+        obj = xml.decode(stream)
+        self.assertEqual(obj['items'], [{'a': '1'}])
+        self.assertEqual(obj['b'], '5')
+
+    def test_project_lazy_parts(self):
+        stream = xml.make_stream('<o><s n="items" phoxpy-part="0"></s></o>')
+        if not isinstance(stream, xml.Stream):
+            stream = xml.Stream(stream)
+        item = xml.decode('<o><f n="a" v="1"/><f n="b" v="2"/></o>', lazy=True)
+        stream.parts = {'0': iter([[item]])}
+        obj = xml.decode(xml.project(stream, ['a'], 2))
+        self.assertEqual(obj['items'], [{'a': '1'}])
+
+
+class WhereTestCase(unittest.TestCase):
+
+    xmlsrc = ('<o><s n="items">'
+              '<o id="1"><f n="a" t="I" v="1"/><f n="b" v="x"/></o>'
+              '<o id="2"><f n="a" t="I" v="2"/><f n="b" v="y"/>'
+              '<s n="c"><o><f n="a" t="I" v="1"/></o></s></o>'
+              '</s></o>')
+
+    def test_where_items(self):
+        stream = xml.where(self.xmlsrc, lambda obj: obj['a'] > 1, 2)
+        obj = xml.decode(stream)
+        self.assertEqual([item['id'] for item in obj['items']], ['2'])
+        self.assertEqual(obj['items'][0]['c'], [{'a': 1}])
+
+    def test_where_lazy_decodes_only_used_fields(self):
+        stream = xml.make_stream(self.xmlsrc, lazy=True)
+        seen = []
+        def match(obj):
+            seen.append(obj)
+            return obj['a'] == 2
+        obj = xml.decode(xml.where(stream, match, 2))
+        items = obj['items']
+        self.assertEqual(len(seen), 2)
+        self.assertTrue(isinstance(seen[0]._fields['b'], xml.ElementType))
+        self.assertEqual(len(items), 1)
+        self.assertEqual(items[0]['c'], [{'a': 1}])
+
+    def test_where_with_project_lazy(self):
+        stream = xml.make_stream(self.xmlsrc, lazy=True)
+        stream = xml.project(stream, ['a', 'c'], 2)
+        stream = xml.where(stream, lambda obj: obj['a'] == 2, 2)
+        obj = xml.decode(stream)
+        self.assertEqual(obj['items'], [{'a': 2, 'c': [{'a': 1}]}])
+
+
+class PullTestCase(unittest.TestCase):
+
+    def test_events(self):
+        src = ("<?xml version='1.0' encoding='utf-8'?>\n"
+               "<foo><bar />something<baz><!--comment--><boo>42</boo></baz>"
+               "</foo>")
+        events = [(event, elem.tag) for event, elem in xml.pull(StringIO(src))]
+        expected = [(event, elem.tag)
+                    for event, elem in xml.parse(StringIO(src))]
+        self.assertEqual(events, expected)
+
+    def test_elements(self):
+        src = ("<?xml version='1.0' encoding='Windows-1251'?>\n"
+               "<s><f n='a' v='\xcf\xf0\xe8\xe2\xe5\xf2'/><f n='b'/></s>")
+        stream = xml.pull(StringIO(src), chunk_size=8)
+        event, root = stream.next()
+        event, elem = stream.next()
+        self.assertTrue(elem.getparent() is root)
+        self.assertEqual(elem.get('v'), u'\u041f\u0440\u0438\u0432\u0435\u0442')
+        self.assertEqual(type(elem.get('n')), str)
+        self.assertEqual([event for event, elem in stream],
+                         ['end', 'start', 'end', 'end'])
+
+    def test_decode_same_as_parse(self):
+        data = {'items': [{'id': str(idx), 'name': u'\u0438\u043c\u044f',
+                           'values': [idx, None, True]}
+                          for idx in range(100)]}
+        src = xml.dump(xml.encode(data))
+        self.assertEqual(xml.decode(xml.pull(StringIO(src), chunk_size=100)),
+                         xml.decode(xml.parse(StringIO(src))))
+
+    def check_constant_memory(self, *args):
+        # Set PHOXPY_MEMORY_TEST_SIZE=1073741824 to decode 1 GB journal.
+        size = int(os.environ.get('PHOXPY_MEMORY_TEST_SIZE', 8 * 1024 * 1024))
+        root = os.path.dirname(os.path.dirname(os.path.dirname(
+            os.path.abspath(__file__))))
+        env = dict(os.environ, PYTHONPATH=root)
+        proc = subprocess.Popen([sys.executable, '-c', MEMORY_TEST_SCRIPT,
+                                 str(size)] + list(args),
+                                env=env, stdout=subprocess.PIPE)
+        output = proc.communicate()[0]
+        self.assertEqual(proc.returncode, 0)
+        count, growth = map(int, output.split())
+        self.assertTrue(count * 400 > size, count)
+        # ru_maxrss is in kilobytes
+        self.assertTrue(growth < 16 * 1024, growth)
+
+    def test_constant_memory(self):
+        self.check_constant_memory('pull')
+
+    def test_constant_memory_parse(self):
+        self.check_constant_memory()
+
+MEMORY_TEST_SCRIPT = """
+import resource, sys
+from phoxpy import xml
+from phoxpy.xmlcodec import DirectoryResponseCodec
+
+class Journal(object):
+    item = ('<o><f n="id" v="%d"/><f n="nr" t="S" v="%010d"/>'
+            '<f n="patient" v="\\xcf\\xe0\\xf6\\xe8\\xe5\\xed\\xf2 %d"/>'
+            '<r n="hospital" i="%d"/><f n="timestamp" t="L" v="1300000000"/>'
+            '<s n="targets"><r i="1"/><r i="2"/></s></o>')
+
+    def __init__(self, size):
+        self.left = size
+        self.idx = 0
+        self.buffer = ("<?xml version='1.0' encoding='Windows-1251'?>"
+                       "<phox-response><content><o>"
+                       "<f n='version' t='I' v='1'/><s n='Request'>")
+
+    def read(self, size):
+        while len(self.buffer) < size and self.left > 0:
+            item = self.item % ((self.idx,) * 4)
+            self.idx += 1
+            self.left -= len(item)
+            self.buffer += item
+            if self.left <= 0:
+                self.buffer += '</s></o></content></phox-response>'
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+stream = xml.make_stream(Journal(int(sys.argv[1])), pull='pull' in sys.argv)
+resp = DirectoryResponseCodec.to_python(stream)
+items = resp['Request']
+items.next()
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+count = 1 + sum(1 for item in items)
+after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print count, after - before
+"""
+
+
 if __name__ == '__main__':
     unittest.main()
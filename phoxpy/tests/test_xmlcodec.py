@@ -54,7 +54,22 @@ class XMLDecodeTestCase(unittest.TestCase):
     def test_decode_date(self):
         value = xml.decode('<f t="D" v="14.02.2009 02:30:31" />')
         self.assertEqual(value, datetime.datetime(2009, 2, 14, 2, 30, 31))
-        
+
+    def test_decode_date_without_padding(self):
+        value = xml.decode('<f t="D" v="4.2.2009 2:30:31" />')
+        self.assertEqual(value, datetime.datetime(2009, 2, 4, 2, 30, 31))
+
+    def test_fail_decode_invalid_date(self):
+        self.assertRaises(ValueError, xml.decode,
+                          '<f t="D" v="31.02.2009 02:30:31" />')
+        self.assertRaises(ValueError, xml.decode,
+                          '<f t="D" v="14.02.2009T02:30:31" />')
+
+    def test_decode_date_cached(self):
+        xmlcodec.datetime_cache.clear()
+        src = '<f t="D" v="14.02.2009 02:30:31" />'
+        self.assertTrue(xml.decode(src) is xml.decode(src))
+
     def test_decode_reference(self):
         value = xml.decode('<r i="42" />')
         self.assertTrue(isinstance(value, xmlcodec.Reference))
@@ -198,6 +213,11 @@ class XMLEncodeTestCase(unittest.TestCase):
         self.assertTrue('v' in elem.attrib)
         self.assertEqual(elem.attrib['v'], 'foo')
 
+    def test_encode_utf8_string(self):
+        elem = xml.encode('\xd0\xb8\xd0\xbc\xd1\x8f')
+        self.assertEqual(elem.attrib['v'], u'\u0438\u043c\u044f')
+        self.assertEqual(xml.decode(xml.dump(elem)), u'\u0438\u043c\u044f')
+
     def test_encode_ref(self):
         elem = xml.encode(xmlcodec.Reference('foo'))
         self.assertTrue(isinstance(elem, xml.ElementType))
@@ -220,7 +240,12 @@ class XMLEncodeTestCase(unittest.TestCase):
         self.assertEqual(elem.attrib['t'], 'D')
         self.assertTrue('v' in elem.attrib)
         self.assertEqual(elem.attrib['v'], '14.02.2009 02:31:30')
-        
+
+    def test_encode_date(self):
+        elem = xml.encode(datetime.date(1812, 9, 7))
+        self.assertEqual(elem.attrib['t'], 'D')
+        self.assertEqual(elem.attrib['v'], '07.09.1812 00:00:00')
+
     def test_encode_empty_list(self):
         elem = xml.encode(list())
         self.assertTrue(isinstance(elem, xml.ElementType))
@@ -317,5 +342,31 @@ class XMLEncodeTestCase(unittest.TestCase):
         self.assertEqual(elem.attrib['description'], 'foobarbaz')
 
 
+class LRUCacheTestCase(unittest.TestCase):
+
+    def test_get_set(self):
+        cache = xmlcodec.LRUCache(2)
+        cache.set('foo', 1)
+        self.assertEqual(cache.get('foo'), 1)
+        self.assertEqual(cache.get('bar', 42), 42)
+
+    def test_discard_least_recently_used(self):
+        cache = xmlcodec.LRUCache(2)
+        for key in ['a', 'b', 'c', 'd', 'e']:
+            cache.set(key, key)
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.get('c'), 'c')
+        cache.set('f', 'f')
+        # recently used item survives while other ones of its age are gone
+        self.assertEqual(cache.get('c'), 'c')
+        self.assertEqual(cache.get('d'), None)
+
+    def test_disabled(self):
+        cache = xmlcodec.LRUCache(0)
+        cache.set('foo', 1)
+        self.assertEqual(cache.get('foo'), None)
+        self.assertEqual(len(cache), 0)
+
+
 if __name__ == '__main__':
     unittest.main()
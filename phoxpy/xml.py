@@ -8,29 +8,45 @@
 #
 """An abstraction layer over various ElementTree-based XML modules."""
 
+from __future__ import absolute_import
+import re
+import threading
 import lxml.etree as xml
 from StringIO import StringIO
+from xml.etree import cElementTree
+from xml.parsers import expat
 
 __all__ = ['ENCODING', 'DEFAULT_DECODER', 'DEFAULT_ENCODER',
            'Element', 'ElementTree', 'ElementType', 'ElementTreeType',
-           'use', 'dump', 'load', 'parse',
-           'decode', 'encode']
-
-_using = 'lxml'
-_initialized = True
-_Element = xml.Element
-_ElementTree = xml.ElementTree
-_load = xml.fromstring
-_dump = xml.tostring
-_parse = xml.iterparse
+           'InternTable', 'Stream', 'TreeStream', 'PullElement', 'BACKENDS',
+           'use', 'dump', 'load', 'parse', 'pull', 'project', 'where',
+           'passthrough', 'decode', 'encode']
+
+_using = None
+_initialized = False
+_Element = None
+_ElementTree = None
+_load = None
+_dump = None
+_parse = None
+_pull = None
 #: Type of :class:`~phoxpy.xml.Element` realization.
-ElementType = type(xml.Element('x'))
+ElementType = None
 #: Type of :class:`~phoxpy.xml.ElementTree` realization.
-ElementTreeType = type(xml.ElementTree(xml.Element('x')))
+ElementTreeType = None
+#: Available XML backends. See :func:`use`.
+BACKENDS = ('lxml', 'cElementTree', 'expat')
 #: Default XML encoding.
 ENCODING = 'Windows-1251' # there is 2011 year, but we still have to use
                           # something not like utf-8
 
+#: Number of bytes read from file at once by :func:`pull`.
+PULL_CHUNK_SIZE = 4 * 1024
+
+#: Attribute which marks sequences cut off from the source for separate
+#: decoding. See :class:`Stream` ``parts`` option.
+PART_ATTR = 'phoxpy-part'
+
 _TAGS = {}
 _TAGS_BY_TYPE = {}
 _TAGS_BY_PYTYPE = {}
@@ -53,23 +69,323 @@ def register_fallback_codec(codec):
     """Registers fallback codec."""
     _TAGS[None] = codec()
 
-def make_stream(xmlsrc):
-    """Wraps XML source to generator of events and XML element instances."""
+class InternTable(object):
+    """Deduplicates decoded strings, so equal field names, references and
+    values share single object instead of allocating new one for each
+    occurrence. Byte strings are also interned by :func:`intern`, so they
+    are compared by identity on dict lookups.
+
+    Table could be used for single decoding or shared between many of them.
+    It's safe to share it between threads: lookups are lock free, new values
+    are stored under the lock.
+
+    :param size: Maximum number of stored values. When table is full, it's
+                 cleared before storing new value, so values of recent
+                 decodings are still deduplicated.
+    :type size: int
+
+    :param max_length: Longer strings are not stored since they rarely repeat.
+    :type max_length: int
+    """
+    def __init__(self, size=100000, max_length=64):
+        self.size = size
+        self.max_length = max_length
+        self._tables = {}
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    def __call__(self, value, factory=None):
+        """Returns shared instance of `value` converted by `factory`."""
+        try:
+            return self._tables[factory][value]
+        except KeyError:
+            pass
+        result = value if factory is None else factory(value)
+        if len(value) > self.max_length:
+            return result
+        if type(result) is str:
+            result = intern(result)
+        with self._lock:
+            if self._count >= self.size:
+                self._tables = {}
+                self._count = 0
+            table = self._tables.setdefault(factory, {})
+            if value in table:
+                # another thread has stored it meanwhile
+                return table[value]
+            table[value] = result
+            self._count += 1
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._tables = {}
+            self._count = 0
+
+
+class Stream(object):
+    """Iterator over XML parser events and elements which carries decoding
+    options for codecs.
+
+    :param events: Events and elements iterator.
+
+    :param intern: Table to deduplicate decoded strings by.
+    :type intern: :class:`InternTable`
+
+    :param parts: Already decoded items of sequences which were cut off from
+                  the source by their part ids. Each of them is iterable of
+                  items lists. See :mod:`phoxpy.parallel` for details.
+    :type parts: dict
+    """
+    #: Objects are decoded lazy. Only streams which could skip subtrees
+    #: support this.
+    lazy = False
+    #: Names of fields to decode for objects at :attr:`fields_depth`.
+    fields = None
+    #: Depth of projected objects, root element has zero one.
+    fields_depth = None
+    #: Predicate which objects at :attr:`match_depth` should match to be
+    #: yielded by sequences.
+    match = None
+    #: Depth of filtered objects, root element has zero one.
+    match_depth = None
+    #: Depth of the root element in the original tree.
+    base_depth = 0
+    #: Names of fields which values are passed through as UTF-8 byte strings
+    #: without type conversion and interning.
+    raw = None
+
+    def __init__(self, events, intern=None, parts=None):
+        self.events = iter(events)
+        self.intern = intern
+        self.parts = parts
+
+    def __iter__(self):
+        # codecs iterate underlying events directly, without extra call
+        return self.events
+
+    def next(self):
+        return self.events.next()
+
+    def projection(self, elem):
+        """Returns names of fields to decode for object `elem` or ``None`` if
+        all of them are needed."""
+        if self.fields is None:
+            return None
+        if self.depth(elem) == self.fields_depth:
+            return self.fields
+        return None
+
+    def items_projection(self, elem):
+        """Returns names of fields to keep for items of sequence `elem` or
+        ``None`` if all of them are needed."""
+        if self.fields is None:
+            return None
+        if self.depth(elem) + 1 == self.fields_depth:
+            return self.fields
+        return None
+
+    def selection(self, elem):
+        """Returns predicate for items of sequence `elem` or ``None`` if all
+        of them are needed."""
+        if self.match is None:
+            return None
+        if self.depth(elem) + 1 == self.match_depth:
+            return self.match
+        return None
+
+    def depth(self, elem):
+        """Returns depth of element in the tree."""
+        depth = self.base_depth
+        parent = elem.getparent()
+        while parent is not None:
+            depth += 1
+            parent = parent.getparent()
+        return depth
+
+
+class TreeStream(Stream):
+    """Stream of events for already parsed XML tree. Unlike parser events
+    it allows to :meth:`skip` subtrees, so codecs are able to decode objects
+    lazy: keeping their elements and decoding fields on demand.
+
+    :param root: Root element.
+    :type root: :class:`~phoxpy.xml.Element`
+    """
+    lazy = True
+
+    def __init__(self, root, intern=None, parts=None):
+        self.intern = intern
+        self.parts = parts
+        self._start = root
+        self._stack = []
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if self._start is not None:
+            elem, self._start = self._start, None
+            self._stack.append((elem, iter(elem)))
+            return 'start', elem
+        if not self._stack:
+            raise StopIteration
+        elem, children = self._stack[-1]
+        for child in children:
+            if isinstance(child.tag, basestring):
+                self._start = child
+                return self.next()
+        self._stack.pop()
+        return 'end', elem
+
+    def depth(self, elem):
+        """Returns depth of started element or of just ended one. Unlike
+        parents of elements, stack of them is available for all backends."""
+        stack = self._stack
+        for idx in xrange(len(stack) - 1, -1, -1):
+            if stack[idx][0] is elem:
+                return self.base_depth + idx
+        return self.base_depth + len(stack)
+
+    def skip(self):
+        """Skips children of the last started element, so the next event
+        will be his end."""
+        elem, children = self._stack[-1]
+        self._stack[-1] = elem, iter(())
+
+    def substream(self, elem, depth):
+        """Returns stream for subtree `elem` with the same decoding options.
+        `depth` is depth of `elem` parent in the original tree."""
+        stream = self.__class__(elem, self.intern)
+        stream.fields = self.fields
+        stream.fields_depth = self.fields_depth
+        stream.match = self.match
+        stream.match_depth = self.match_depth
+        stream.raw = self.raw
+        stream.base_depth = depth + 1
+        return stream
+
+
+def make_stream(xmlsrc, intern=None, lazy=False, pull=False):
+    """Wraps XML source to generator of events and XML element instances.
+
+    :param intern: Deduplicate decoded strings by specified
+                   :class:`InternTable` or by new one if ``True``.
+
+    :param lazy: Parse whole XML tree and decode objects as
+                 :class:`~phoxpy.xmlobjects.LazyObject` which keep their
+                 elements and convert fields on first access.
+
+    :param pull: Parse XML source by :func:`pull` which doesn't build tree
+                 at all instead of :func:`parse`.
+    """
+    if intern is True:
+        intern = InternTable()
+    if intern is False:
+        intern = None
+    if lazy and not isinstance(xmlsrc, Stream):
+        if isinstance(xmlsrc, basestring):
+            root = _load(xmlsrc)
+        elif hasattr(xmlsrc, 'read'):
+            root = _load(xmlsrc.read())
+        elif isinstance(xmlsrc, ElementType):
+            root = xmlsrc
+        else:
+            raise TypeError('unable to decode %r lazy' % xmlsrc)
+        return TreeStream(root, intern)
+    events = _pull if pull else _parse
     if isinstance(xmlsrc, basestring):
-        stream = parse(StringIO(xmlsrc))
+        stream = events(StringIO(xmlsrc))
     elif hasattr(xmlsrc, 'read'):
-        stream = parse(xmlsrc)
+        stream = events(xmlsrc)
     elif isinstance(xmlsrc, ElementType):
-        stream = parse(StringIO(_dump(xmlsrc)))
+        stream = events(StringIO(_dump(xmlsrc)))
     else:
         stream = xmlsrc
+    if intern is not None:
+        stream = Stream(stream, intern)
+    return stream
+
+def project(xmlsrc, fields, depth):
+    """Wraps XML source to stream which decodes only specified fields of
+    objects at `depth`. Other fields are skipped without decoding.
+
+    :param fields: Names of fields and attributes to decode.
+    :type fields: iterable
+
+    :param depth: Depth of projected objects, root element has zero one.
+    :type depth: int
+
+    >>> decode(project('<s><o><f n="a" v="1"/><f n="b" v="2"/></o></s>',
+    ...                ['a'], 1)).next()
+    {'a': '1'}
+    """
+    stream = make_stream(xmlsrc)
+    if not isinstance(stream, Stream):
+        stream = Stream(stream)
+    stream.fields = frozenset(fields)
+    stream.fields_depth = depth
+    return stream
+
+def where(xmlsrc, match, depth):
+    """Wraps XML source to stream which sequences yield only objects at
+    `depth` that match the predicate.
+
+    :param match: Callable which takes decoded object and returns ``True``
+                  if it should be yielded. See :mod:`phoxpy.predicates`.
+
+    :param depth: Depth of filtered objects, root element has zero one.
+    :type depth: int
+
+    Objects are matched after decoding. For lazy streams only fields used by
+    predicate are converted, so other ones of mismatched objects are never
+    decoded.
+
+    >>> list(decode(where('<s><o><f n="a" v="1"/></o><o><f n="a" v="2"/></o>'
+    ...                   '</s>', lambda obj: obj['a'] == '2', 1)))
+    [{'a': '2'}]
+    """
+    stream = make_stream(xmlsrc)
+    if not isinstance(stream, Stream):
+        stream = Stream(stream)
+    stream.match = match
+    stream.match_depth = depth
     return stream
 
-def decode(xmlsrc):
+def passthrough(xmlsrc, fields):
+    """Wraps XML source to stream which passes values of specified fields
+    through as UTF-8 byte strings. They are neither converted to their types
+    nor interned, so large opaque values like encoded files or settings
+    blobs are kept as received and could be sent back without decoding.
+
+    :param fields: Names of fields to pass through.
+    :type fields: iterable
+
+    >>> decode(passthrough('<o><f n="a" t="I" v="1"/><f n="b" v="\\xd0\\xaf"/>'
+    ...                    '</o>', ['a', 'b']))
+    {'a': '1', 'b': '\\xd0\\xaf'}
+    """
+    stream = make_stream(xmlsrc)
+    if not isinstance(stream, Stream):
+        stream = Stream(stream)
+    stream.raw = frozenset(fields)
+    return stream
+
+def decode(xmlsrc, intern=None, lazy=False):
     """Decodes xml source to Python object.
 
     :param xmlsrc: XML data source.
 
+    :param intern: Deduplicate decoded strings by specified
+                   :class:`InternTable` or by new one if ``True``.
+
+    :param lazy: Decode objects as :class:`~phoxpy.xmlobjects.LazyObject`
+                 which convert their fields on first access.
+                 See :func:`make_stream` for details.
+
     +-------------------------------------+----------------------------+-------+
     | XML Tag                             | Python type                | Notes |
     +=====================================+============================+=======+
@@ -108,7 +424,7 @@ def decode(xmlsrc):
 
     For ``f`` tags value is searched in ``v`` attribute.
     """
-    stream = make_stream(xmlsrc)
+    stream = make_stream(xmlsrc, intern, lazy)
     for obj in decode_stream(stream):
         return obj
 
@@ -255,12 +571,142 @@ def parse(fileobj):
     and elements. When `end` event occurred, emitted element cleaned up with all
     attributes, inner nodes and siblings.
 
+    With backends other than ``lxml`` it's the same as :func:`pull`.
+
     :param fileobj: File-like object.
 
     :yields: 2-element tuple of event name and :class:`~phoxpy.xml.Element`
              instance.
     """
-    for event, elem in _parse(fileobj, ('start', 'end')):
+    return _parse(fileobj)
+
+def pull(fileobj, chunk_size=PULL_CHUNK_SIZE):
+    """Parse file like object with xml data yielding events (`start` and `end`)
+    and elements like :func:`parse` does, but without building tree at all:
+    elements are :class:`PullElement` instances which reference only their
+    ancestors, so memory use doesn't depend on length of sequences.
+
+    :param fileobj: File-like object.
+
+    :param chunk_size: Number of bytes to read at once.
+    :type chunk_size: int
+
+    :yields: 2-element tuple of event name and :class:`PullElement` instance.
+    """
+    return _pull(fileobj, chunk_size)
+
+class PullElement(object):
+    """Element emitted by :func:`pull`. It knows only own tag, attributes,
+    parent and first child, so no tree is built while parsing. Like etree
+    elements emitted by :func:`parse`, it counts children which are already
+    parsed.
+    """
+    __slots__ = ('tag', 'attrib', '_parent', '_first', '_count')
+
+    def __init__(self, tag, attrib, parent=None):
+        self.tag = tag
+        self.attrib = attrib
+        self._parent = parent
+        self._first = None
+        self._count = 0
+
+    def __repr__(self):
+        return '<PullElement %s at 0x%x>' % (self.tag, id(self))
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, idx):
+        if idx != 0 or self._first is None:
+            raise IndexError('only first child is available')
+        return self._first
+
+    def get(self, key, default=None):
+        return self.attrib.get(key, default)
+
+    def getparent(self):
+        return self._parent
+
+
+class _PullTarget(object):
+    """Parser target which creates :class:`PullElement` instances."""
+    def __init__(self):
+        self._current = None
+
+    def start(self, tag, attrib):
+        for key, value in attrib.iteritems():
+            # keep ASCII values as byte strings like etree does
+            try:
+                attrib[key] = str(value)
+            except UnicodeEncodeError:
+                pass
+        parent = self._current
+        elem = self._current = PullElement(tag, attrib, parent)
+        if parent is not None:
+            if parent._first is None:
+                parent._first = elem
+            parent._count += 1
+        return elem
+
+    def end(self, tag):
+        elem = self._current
+        self._current = elem._parent
+        return elem
+
+    def close(self):
+        self._current = None
+
+
+class _EventsTarget(_PullTarget):
+    """Parser target which collects events for parsers without events
+    queue."""
+    def __init__(self):
+        super(_EventsTarget, self).__init__()
+        self.events = []
+
+    def pop(self):
+        """Returns collected events and starts new list of them."""
+        events, self.events = self.events, []
+        return events
+
+    def start(self, tag, attrib):
+        self.events.append(('start', _PullTarget.start(self, tag, attrib)))
+
+    def end(self, tag):
+        self.events.append(('end', _PullTarget.end(self, tag)))
+
+
+_NON_ASCII = re.compile(r'[\x80-\xff]')
+
+class _ExpatTarget(_EventsTarget):
+    """Collects events from expat parser which returns UTF-8 strings."""
+    def start(self, tag, attrib):
+        for key, value in attrib.iteritems():
+            if _NON_ASCII.search(value) is not None:
+                attrib[key] = value.decode('utf-8')
+        parent = self._current
+        elem = self._current = PullElement(tag, attrib, parent)
+        if parent is not None:
+            if parent._first is None:
+                parent._first = elem
+            parent._count += 1
+        self.events.append(('start', elem))
+
+
+def _feed(feed, close, events, fileobj, chunk_size):
+    while True:
+        data = fileobj.read(chunk_size)
+        if data:
+            feed(data)
+        else:
+            close()
+        for item in events():
+            yield item
+        if not data:
+            break
+
+def _lxml_parse(fileobj):
+    for event, elem in xml.iterparse(fileobj, ('start', 'end')):
         yield event, elem
         if event == 'end':
             elem.clear()
@@ -268,6 +714,79 @@ def parse(fileobj):
                 del elem.getparent()[0]
             del elem
 
+def _lxml_dump(elem, encoding=None):
+    return xml.tostring(elem, encoding=encoding, xml_declaration=False)
+
+class _DumpTarget(object):
+    """File-like object which ``write`` method is set on demand."""
+
+def _etree_dump(elem, encoding=None):
+    data = []
+    target = _DumpTarget()
+    target.write = data.append
+    cElementTree.ElementTree(elem).write(target, encoding,
+                                         xml_declaration=False)
+    return ''.join(data)
+
+def _lxml_pull(fileobj, chunk_size=PULL_CHUNK_SIZE):
+    parser = xml.XMLPullParser(events=('start', 'end'), target=_PullTarget())
+    return _feed(parser.feed, parser.close, parser.read_events, fileobj,
+                 chunk_size)
+
+def _etree_pull(fileobj, chunk_size=PULL_CHUNK_SIZE):
+    target = _EventsTarget()
+    parser = cElementTree.XMLParser(target=target)
+    return _feed(parser.feed, parser.close, target.pop, fileobj, chunk_size)
+
+def _expat_pull(fileobj, chunk_size=PULL_CHUNK_SIZE):
+    target = _ExpatTarget()
+    parser = expat.ParserCreate()
+    parser.returns_unicode = False
+    parser.StartElementHandler = target.start
+    parser.EndElementHandler = target.end
+    return _feed(lambda data: parser.Parse(data, False),
+                 lambda: parser.Parse('', True),
+                 target.pop, fileobj, chunk_size)
+
+def use(name):
+    """Switches XML backend:
+
+    - ``lxml``: :mod:`lxml.etree` elements. Streams are parsed by
+      ``iterparse`` which cleans up the tree behind, :func:`pull` uses
+      ``XMLPullParser`` with parser target.
+    - ``cElementTree``: :mod:`xml.etree.cElementTree` elements. Streams are
+      always parsed by ``XMLParser`` with parser target, like :func:`pull`
+      does.
+    - ``expat``: :mod:`xml.etree.cElementTree` elements. Streams are parsed
+      by bare :mod:`xml.parsers.expat` parser which handlers create
+      :class:`PullElement` instances.
+
+    :param name: Backend name. See :data:`BACKENDS`.
+    :type name: str
+
+    :raises: :exc:`ValueError` if backend is unknown.
+    """
+    global _using, _initialized, _Element, _ElementTree, _load, _dump, \
+           _parse, _pull, ElementType, ElementTreeType
+    if name == 'lxml':
+        etree, _pull = xml, _lxml_pull
+        _parse, _dump = _lxml_parse, _lxml_dump
+    elif name == 'cElementTree':
+        etree, _pull = cElementTree, _etree_pull
+        _parse, _dump = _etree_pull, _etree_dump
+    elif name == 'expat':
+        etree, _pull = cElementTree, _expat_pull
+        _parse, _dump = _expat_pull, _etree_dump
+    else:
+        raise ValueError('unknown XML backend %r' % name)
+    _Element = etree.Element
+    _ElementTree = etree.ElementTree
+    _load = etree.fromstring
+    ElementType = type(etree.Element('x'))
+    ElementTreeType = type(etree.ElementTree(etree.Element('x')))
+    _using = name
+    _initialized = True
+
 def dump(xmlsrc, doctype=None, encoding=None):
     """Dump module with very limited support of doctype setting
     and force xml declaration definition.
@@ -295,7 +814,6 @@ def dump(xmlsrc, doctype=None, encoding=None):
         doctype = ''
     if isinstance(xmlsrc, ElementTreeType):
         xmlsrc = xmlsrc.getroot()
-    xmlstr = _dump(xmlsrc, encoding=encoding)
-    if encoding.lower() not in ('us-ascii', 'utf-8'):
-        xmlstr = ''.join(xmlstr.split('\n', 1)[1])
-    return ''.join([xml_declaration, doctype, xmlstr])
+    return ''.join([xml_declaration, doctype, _dump(xmlsrc, encoding)])
+
+use('lxml')
@@ -9,12 +9,156 @@
 """XML decoder/encoder for phox.dtd schema."""
 
 import datetime
+import re
 from types import GeneratorType
 from . import exceptions
 from . import xml
 from .mapping import Mapping
 from .messages import Content, PhoxEvent, PhoxRequest, PhoxResponse
 from .xmlobjects import Attribute, Reference
+from .xmlobjects import LazyObject
+
+#: Phox datetime values format.
+DATETIME_FORMAT = '%d.%m.%Y %H:%M:%S'
+
+
+class LRUCache(object):
+    """Small cache which discards least recently used items.
+
+    Items are kept in two generations: when current one is full, it becomes
+    the old one and the previous old generation is dropped. Items found in
+    old generation are moved to the current one. This approximates LRU
+    without ordering bookkeeping on each lookup, and since only atomic dict
+    operations are used it doesn't need a lock.
+
+    :param size: Maximum number of items per generation. ``0`` disables cache.
+    :type size: int
+    """
+    def __init__(self, size):
+        self.size = size
+        self._current = {}
+        self._old = {}
+
+    def __len__(self):
+        return len(self._current) + len(self._old)
+
+    def get(self, key, default=None):
+        value = self._current.get(key)
+        if value is not None:
+            return value
+        value = self._old.get(key)
+        if value is None:
+            return default
+        self.set(key, value)
+        return value
+
+    def set(self, key, value):
+        if not self.size:
+            return
+        if len(self._current) >= self.size:
+            self._old, self._current = self._current, {}
+        self._current[key] = value
+
+    def clear(self):
+        self._current, self._old = {}, {}
+
+#: Recently decoded datetime values. Timestamps repeat heavily within
+#: registration journal, so there is no need to parse them again.
+datetime_cache = LRUCache(256)
+
+_DATETIME_RE = re.compile(r'(\d\d)\.(\d\d)\.(\d{4}) (\d\d):(\d\d):(\d\d)\Z')
+
+def parse_datetime(value):
+    """Parses phox datetime value of :const:`DATETIME_FORMAT` format.
+
+    Values with zero padded fields are parsed by precompiled pattern, any
+    others are passed to :meth:`datetime.datetime.strptime`.
+
+    >>> parse_datetime('14.02.2009 02:31:30')
+    datetime.datetime(2009, 2, 14, 2, 31, 30)
+    >>> parse_datetime('4.2.2009 2:31:30')
+    datetime.datetime(2009, 2, 4, 2, 31, 30)
+    """
+    result = datetime_cache.get(value)
+    if result is not None:
+        return result
+    match = _DATETIME_RE.match(value)
+    if match is not None:
+        day, month, year, hour, minute, second = match.groups()
+        result = datetime.datetime(int(year), int(month), int(day),
+                                   int(hour), int(minute), int(second))
+    else:
+        result = datetime.datetime.strptime(value, DATETIME_FORMAT)
+    datetime_cache.set(value, result)
+    return result
+
+def format_datetime(value):
+    """Formats :class:`datetime.datetime` or :class:`datetime.date` value
+    to :const:`DATETIME_FORMAT` string.
+
+    >>> format_datetime(datetime.datetime(2009, 2, 14, 2, 31, 30))
+    '14.02.2009 02:31:30'
+    >>> format_datetime(datetime.date(1812, 9, 7))
+    '07.09.1812 00:00:00'
+    """
+    # isoformat is much faster than strftime and works for any year
+    if isinstance(value, datetime.datetime):
+        text = value.isoformat(' ')
+    else:
+        text = value.isoformat() + ' 00:00:00'
+    return '%s.%s.%s%s' % (text[8:10], text[5:7], text[:4], text[10:19])
+
+
+def interned(stream, value, factory=None):
+    """Converts `value` by `factory` deduplicating result by
+    :class:`~phoxpy.xml.InternTable` of the `stream` if it has one."""
+    table = getattr(stream, 'intern', None)
+    if table is not None:
+        return table(value, factory)
+    elif factory is not None:
+        return factory(value)
+    return value
+
+
+def raw_value(elem):
+    """Returns value of field `elem` as UTF-8 byte string without type
+    conversion. See :func:`~phoxpy.xml.passthrough`."""
+    value = elem.get('v')
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    return value
+
+
+_NON_ASCII = re.compile(r'[\x80-\xff]')
+
+def text_value(value):
+    """Converts value to text of XML attribute. Byte strings are taken as
+    UTF-8 ones and ASCII of them are kept as is, so passed through values
+    aren't copied to unicode just to be encoded back.
+
+    >>> text_value(42)
+    u'42'
+    >>> text_value('foo')
+    'foo'
+    >>> text_value('\\xd0\\xaf')
+    u'\\u042f'
+    """
+    if isinstance(value, str):
+        if _NON_ASCII.search(value) is not None:
+            return value.decode('utf-8')
+        return value
+    return unicode(value)
+
+
+def skip(stream, curelem):
+    """Skips events of `curelem` subtree without decoding it."""
+    if hasattr(stream, 'skip'):
+        stream.skip()
+        stream.next()
+        return
+    for event, elem in stream:
+        if event == 'end' and elem is curelem:
+            break
 
 
 class BaseCodec(object):
@@ -24,6 +168,8 @@ class BaseCodec(object):
     tagname = None
     #: XML stored value type marker.
     typemarker = None
+    #: Deduplicate decoded values.
+    interning = False
 
     @classmethod
     def to_python(cls, xmlsrc):
@@ -70,6 +216,8 @@ class BaseCodec(object):
         for event, elem in stream:
             assert elem is curelem and event == 'end', (event, elem, curelem)
             value = elem.attrib.get('v')
+            if self.interning and value is not None:
+                return interned(stream, value)
             return value
 
     def encode(self, encode, name=None, value=None, **attrs):
@@ -78,7 +226,7 @@ class BaseCodec(object):
         if name is not None:
             elem.attrib['n'] = name
         if value is not None:
-            elem.attrib['v'] = unicode(value)
+            elem.attrib['v'] = text_value(value)
         if self.typemarker is not None:
             elem.attrib['t'] = self.typemarker
         elem.attrib.update(attrs)
@@ -112,6 +260,7 @@ class FieldCodec(BaseCodec):
     """Base codec for primitive types that described by `f` named XML tag."""
     __slots__ = ()
     tagname = 'f'
+    interning = True
 
 
 class BooleanCodec(FieldCodec):
@@ -130,6 +279,7 @@ class BooleanCodec(FieldCodec):
     'false'
     """
     __slots__ = ()
+    interning = False
     typemarker = 'B'
 
     def decode(self, decode, stream, curelem):
@@ -160,6 +310,7 @@ class IntegerCodec(FieldCodec):
     '42'
     """
     __slots__ = ()
+    interning = False
     typemarker = 'I'
 
     def decode(self, decode, stream, curelem):
@@ -181,6 +332,7 @@ class LongIntegerCodec(FieldCodec):
     '42'
     """
     __slots__ = ()
+    interning = False
     typemarker = 'L'
 
     def decode(self, decode, stream, curelem):
@@ -202,6 +354,7 @@ class FloatCodec(FieldCodec):
     '3.14'
     """
     __slots__ = ()
+    interning = False
     typemarker = 'F'
 
     def decode(self, decode, stream, curelem):
@@ -239,14 +392,15 @@ class DateTimeCodec(FieldCodec):
     '14.02.2009 02:31:30'
     """
     __slots__ = ()
+    interning = False
     typemarker = 'D'
 
     def decode(self, decode, stream, curelem):
         value = super(DateTimeCodec, self).decode(decode, stream, curelem)
-        return datetime.datetime.strptime(value, '%d.%m.%Y %H:%M:%S')
+        return parse_datetime(value)
 
     def encode(self, encode, name, value, **attrs):
-        value = value.strftime('%d.%m.%Y %H:%M:%S')
+        value = format_datetime(value)
         return super(DateTimeCodec, self).encode(encode, name, value, **attrs)
 
 
@@ -267,7 +421,7 @@ class ReferenceCodec(BaseCodec):
     def decode(self, decode, stream, curelem):
         for event, elem in stream:
             assert elem is curelem and event == 'end', (event, elem)
-            return Reference(elem.attrib['i'])
+            return interned(stream, elem.attrib['i'], Reference)
 
     def encode(self, encode, name=None, value=None, **attrs):
         attrs['i'] = unicode(value)
@@ -293,6 +447,26 @@ class ListCodec(BaseCodec):
     tagname = 's'
 
     def decode(self, decode, stream, curelem):
+        match = None
+        if getattr(stream, 'match', None) is not None:
+            match = stream.selection(curelem)
+        parts = getattr(stream, 'parts', None)
+        if parts and xml.PART_ATTR in curelem.attrib:
+            # items are decoded by workers before projection is known
+            fields = stream.items_projection(curelem)
+            for items in parts.pop(curelem.attrib[xml.PART_ATTR]):
+                for item in items:
+                    if fields is not None \
+                            and isinstance(item, (dict, LazyObject)):
+                        item = dict((key, item[key])
+                                    for key in item.keys()
+                                    if key in fields)
+                    if match is None or match(item):
+                        yield item
+        if match is not None:
+            for item in self.decode_matched(decode, stream, curelem, match):
+                yield item
+            return
         for event, elem in stream:
             if event == 'start':
                 yield decode(stream, elem)
@@ -300,6 +474,18 @@ class ListCodec(BaseCodec):
                 assert elem is curelem
                 break
 
+    def decode_matched(self, decode, stream, curelem, match):
+        """Decodes sequence items yielding only ones which match the
+        predicate."""
+        for event, elem in stream:
+            if event == 'start':
+                item = decode(stream, elem)
+                if match(item):
+                    yield item
+            if event == 'end':
+                assert elem is curelem
+                break
+
     def encode(self, encode, name=None, value=None, **attrs):
         elem = super(ListCodec, self).encode(encode, name, **attrs)
         for item in value:
@@ -313,13 +499,29 @@ class ObjectCodec(BaseCodec):
     tagname = 'o'
 
     def decode(self, decode, stream, curelem):
+        fields = None
+        if getattr(stream, 'fields', None) is not None:
+            fields = stream.projection(curelem)
+        if getattr(stream, 'lazy', False):
+            return self.decode_lazy(decode, stream, curelem, fields)
+        raw = getattr(stream, 'raw', None)
         data = {}
         for event, elem in stream:
             if event == 'start':
-                if not 'n' in elem.attrib:
+                key = elem.get('n')
+                if key is None:
                     raise ValueError('Unnamed element %s: attribute `n`'
                                      ' expected (%s)' % (elem, elem.attrib))
-                key = elem.attrib['n']
+                if fields is not None and key not in fields:
+                    skip(stream, elem)
+                    continue
+                key = interned(stream, key)
+                if raw is not None and key in raw and elem.tag == 'f':
+                    # lxml cleans up element once the next event is emitted
+                    value = raw_value(elem)
+                    skip(stream, elem)
+                    data[key] = value
+                    continue
                 value = decode(stream, elem)
                 if isinstance(value, GeneratorType):
                     value = list(value)
@@ -329,11 +531,64 @@ class ObjectCodec(BaseCodec):
                 for key, value in elem.attrib.items():
                     if key in ['n', 't', 'v']:
                         continue
+                    if fields is not None and key not in fields:
+                        continue
                     assert key not in data, 'name collision with attibute %r' % key
-                    data[key] = Attribute(value)
+                    data[interned(stream, key)] = interned(stream, value,
+                                                           Attribute)
                 break
         return data
 
+    def decode_lazy(self, decode, stream, curelem, fields=None):
+        """Decodes object as :class:`~phoxpy.xmlobjects.LazyObject` which
+        keeps child elements and decodes them on first access."""
+        stream.skip()
+        event, elem = stream.next()
+        assert event == 'end' and elem is curelem, (event, elem, curelem)
+        intern = stream.intern
+        # object is detached from the tree, so depth of his fields elements
+        # is counted from it
+        depth = stream.depth(curelem)
+        def load(elem):
+            substream = stream.substream(elem, depth)
+            substream.next() # fire element opening event
+            value = decode(substream, elem)
+            if isinstance(value, GeneratorType):
+                value = list(value)
+            return value
+        items = [(elem.get('n'), elem) for elem in curelem]
+        if fields is not None:
+            items = [item for item in items
+                     if item[0] is None or item[0] in fields]
+        if intern is not None:
+            items = [(intern(key) if key is not None else key, elem)
+                     for key, elem in items]
+        elems = dict(items)
+        if stream.raw is not None:
+            for key, elem in items:
+                if key in stream.raw and elem.tag == 'f':
+                    elems[key] = raw_value(elem)
+        if None in elems:
+            del elems[None]
+            for key, elem in items:
+                if key is None and isinstance(elem.tag, basestring):
+                    raise ValueError('Unnamed element %s: attribute `n`'
+                                     ' expected (%s)' % (elem, elem.attrib))
+        data = LazyObject(load, elems)
+        for key, value in curelem.attrib.items():
+            if key in ['n', 't', 'v']:
+                continue
+            if fields is not None and key not in fields:
+                continue
+            assert key not in data, 'name collision with attibute %r' % key
+            data[interned(stream, key)] = interned(stream, value, Attribute)
+        parent = getattr(curelem, 'getparent', None)
+        if parent is not None and parent() is not None:
+            # detach object from lxml tree, so his elements are released once
+            # all of them decoded; ElementTree elements don't refer to parent
+            parent().remove(curelem)
+        return data
+
     def encode(self, encode, name=None, value=None, **attrs):
         elem = super(ObjectCodec, self).encode(encode, name, **attrs)
         for key, value in value.items():
@@ -436,7 +691,7 @@ class PhoxErrorCodec(ContentCodec):
         assert event == 'end' and elem is curelem
         code = elem.attrib['code']
         descr = elem.attrib.get('description', '')
-        raise exceptions.get_error_class(int(code))(descr.encode('utf-8'))
+        raise exceptions.from_code(int(code), descr.encode('utf-8'))
 
     def encode(self, encode, name, value, **attrs):
         elem = xml.Element('error')
@@ -489,7 +744,7 @@ xml.register_codec(ReferenceCodec, Reference)
 xml.register_codec(DateTimeCodec, datetime.date, datetime.datetime)
 xml.register_codec(ReferenceCodec, Reference)
 xml.register_codec(ListCodec, tuple, list, set, frozenset)
-xml.register_codec(ObjectCodec, dict, Mapping)
+xml.register_codec(ObjectCodec, dict, Mapping, LazyObject)
 xml.register_codec(ContentCodec, Content)
 xml.register_codec(PhoxRequestCodec, PhoxRequest)
 xml.register_codec(PhoxResponseCodec, PhoxResponse)
@@ -10,6 +10,10 @@
 # special Python objects that could be extracted from XML data
 # why in this module? to solve import recursions
 
+import collections
+from . import xml
+
+
 class Attribute(unicode):
     """Sentinel unicode value that marks value to help serialize it back to
     XML attribute."""
@@ -18,3 +22,130 @@ class Attribute(unicode):
 class Reference(unicode):
     """Sentinel unicode value that marks value for RefField to help serialize it
     back to XML without losing information about their kind."""
+
+
+class LazyObject(object):
+    """Decoded object which holds XML elements of his fields and decodes
+    them on first access. Decoded elements are released.
+
+    It behaves like :class:`dict`, but isn't his subclass: dict copies via
+    ``dict(obj)``, ``update`` or ``**obj`` would take raw elements from
+    dict slots bypassing :meth:`__getitem__`. Since they go through
+    :meth:`keys` and :meth:`__getitem__` for other mappings, copies,
+    comparison and representation decode all fields at once.
+
+    It's registered as :class:`collections.MutableMapping`. Note that
+    :func:`json.dumps` accepts only real dicts, so pass ``default=dict`` to
+    serialize lazy objects.
+
+    :param decode: Callable which decodes field element.
+    :param fields: Mapping of field names to their elements or values.
+    :type fields: dict
+    """
+    __slots__ = ('_decode', '_fields')
+    __hash__ = None
+
+    def __init__(self, decode, fields=None):
+        self._decode = decode
+        self._fields = {} if fields is None else fields
+
+    def __getitem__(self, key):
+        value = self._fields[key]
+        if isinstance(value, xml.ElementType):
+            value = self._fields[key] = self._decode(value)
+        return value
+
+    def __setitem__(self, key, value):
+        self._fields[key] = value
+
+    def __delitem__(self, key):
+        del self._fields[key]
+
+    def __contains__(self, key):
+        return key in self._fields
+
+    def __iter__(self):
+        return iter(self._fields)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __reduce__(self):
+        return dict, (self.copy(),)
+
+    def __eq__(self, other):
+        if isinstance(other, LazyObject):
+            other = other.copy()
+        return self.copy() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(self.copy())
+
+    def materialize(self):
+        """Converts all fields values.
+
+        :return: self
+        """
+        for key in self:
+            self[key]
+        return self
+
+    def has_key(self, key):
+        return key in self
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def setdefault(self, key, default=None):
+        if key in self:
+            return self[key]
+        self[key] = default
+        return default
+
+    def pop(self, key, *default):
+        if key in self:
+            value = self[key]
+            del self[key]
+            return value
+        return self._fields.pop(key, *default)
+
+    def popitem(self):
+        for key in self:
+            return key, self.pop(key)
+        raise KeyError('popitem(): dictionary is empty')
+
+    def update(self, *args, **kwargs):
+        self._fields.update(*args, **kwargs)
+
+    def clear(self):
+        self._fields.clear()
+
+    def copy(self):
+        return dict(self.iteritems())
+
+    def keys(self):
+        return self._fields.keys()
+
+    def values(self):
+        return [self[key] for key in self]
+
+    def items(self):
+        return [(key, self[key]) for key in self]
+
+    def iterkeys(self):
+        return iter(self._fields)
+
+    def itervalues(self):
+        for key in self:
+            yield self[key]
+
+    def iteritems(self):
+        for key in self:
+            yield key, self[key]
+
+collections.MutableMapping.register(LazyObject)